@@ -0,0 +1,108 @@
+"""Semantic cache of generated answers, persisted in SQLite next to users.db
+
+A question is answered from the cache when an earlier question asked against the
+same retrieved context has an embedding within ANSWER_CACHE_THRESHOLD cosine
+similarity. Entries are evicted least recently used first.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+
+hits = 0
+misses = 0
+_counter_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(ANSWER_CACHE_PATH)
+    conn.execute('''CREATE TABLE IF NOT EXISTS answers
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, context_hash TEXT, question TEXT,
+                     embedding BLOB, answer TEXT, created_at REAL, last_used REAL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+    return conn
+
+
+def context_hash(context: str) -> str:
+    return hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+
+
+def _count(hit: bool):
+    global hits, misses
+    with _counter_lock:
+        if hit:
+            hits += 1
+        else:
+            misses += 1
+
+
+def lookup(embedding: np.ndarray, context: str, threshold: float = None) -> Optional[str]:
+    """Stored answer for the most similar earlier question with the same context, if close enough"""
+    threshold = ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+    query = np.asarray(embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT id, embedding, answer FROM answers WHERE context_hash=?",
+            (context_hash(context),)
+        ).fetchall()
+        if not rows:
+            _count(False)
+            return None
+
+        # Stored embeddings are unit-normalized, so a dot product is the cosine similarity
+        matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            _count(False)
+            return None
+
+        conn.execute("UPDATE answers SET last_used=? WHERE id=?", (time.time(), rows[best][0]))
+        conn.commit()
+        _count(True)
+        return rows[best][2]
+    finally:
+        conn.close()
+
+
+def store(question: str, embedding: np.ndarray, context: str, answer: str):
+    """Remember an answer and evict the least recently used entries beyond the size limit"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    vector = vector / (np.linalg.norm(vector) or 1.0)
+    now = time.time()
+
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO answers (context_hash, question, embedding, answer, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (context_hash(context), question, vector.tobytes(), answer, now, now)
+        )
+        conn.execute(
+            "DELETE FROM answers WHERE id IN "
+            "(SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (ANSWER_CACHE_MAX_ENTRIES,)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logging.error(f"Error storing answer in cache: {e}")
+    finally:
+        conn.close()
+
+
+def stats() -> dict:
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / lookups if lookups else 0.0}
@@ -0,0 +1,151 @@
+"""HTTP API over the RAG pipeline, for other services and load-balanced deployments
+
+    uvicorn api:app --workers 4 --port 8000
+
+Endpoints (HTTP Basic auth with the app's user accounts; each user is a tenant):
+
+    POST   /documents            upload a PDF (multipart field "file"), queued as an ingestion job
+    GET    /documents            the user's indexed documents
+    DELETE /documents/{doc_id}   remove a document and its chunks, queued as a job
+    GET    /jobs/{job_id}        ingestion or deletion job state and progress
+    POST   /ask                  {"question", "doc_id", "top_k", "stream"}; with stream the
+                                 answer arrives as server-sent events
+    GET    /health, /metrics
+
+Each worker process loads the embedding model and opens the vector store once, at
+startup. Uploads and deletes go through the ingest_jobs queue, so only one process
+writes to Chroma; the other workers reopen their Chroma client when a tenant's
+documents change (vector_store.get_collection), since it doesn't see other
+processes' writes.
+"""
+import importlib
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from pydantic import BaseModel, Field
+
+import auth
+import ingest_cache
+import ingest_jobs
+import metrics
+import vector_store
+
+# Pipeline behind the API: rag_utils_simple (Chroma's ONNX embeddings) or rag_utils
+API_BACKEND = os.getenv("API_BACKEND", "rag_utils_simple")
+
+# Largest accepted upload
+API_MAX_UPLOAD_MB = float(os.getenv("API_MAX_UPLOAD_MB", "50"))
+
+# Most chunks a question may retrieve
+API_MAX_TOP_K = int(os.getenv("API_MAX_TOP_K", "20"))
+
+backend = importlib.import_module(API_BACKEND)
+security = HTTPBasic()
+
+
+def _warm_up():
+    """Load the embedding model and open the vector store before the first request"""
+    vector_store.get_client()
+    backend.embed_query("warm up")
+    ingest_jobs.resume()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(_warm_up)
+    yield
+
+
+app = FastAPI(title="PDF RAG Chatbot API", lifespan=lifespan)
+
+
+async def current_tenant(credentials: HTTPBasicCredentials = Depends(security)) -> str:
+    """The authenticated user, whose collection the request works on"""
+    if not await run_in_threadpool(auth.login_user, credentials.username, credentials.password):
+        raise HTTPException(status_code=401, detail="Invalid username or password",
+                            headers={"WWW-Authenticate": "Basic"})
+    return credentials.username
+
+
+class Question(BaseModel):
+    question: str
+    doc_id: Optional[str] = None
+    top_k: int = Field(3, ge=1, le=API_MAX_TOP_K)
+    stream: bool = False
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _answer_events(question: str, context: str):
+    """Server-sent events for a streamed answer: token*, then done"""
+    parts = []
+    for text in backend.answer_question_stream(question, context):
+        parts.append(text)
+        yield _sse("token", {"text": text})
+    yield _sse("done", {"answer": "".join(parts)})
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "backend": API_BACKEND}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
+
+
+@app.post("/documents", status_code=202)
+async def upload_document(file: UploadFile = File(...), tenant: str = Depends(current_tenant)):
+    data = await file.read()
+    if len(data) > API_MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"PDF is larger than {API_MAX_UPLOAD_MB:g} MB")
+    try:
+        job_id = await run_in_threadpool(ingest_jobs.submit, data, file.filename or "upload.pdf",
+                                         tenant, API_BACKEND)
+    except Exception as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return await run_in_threadpool(ingest_jobs.get_job, job_id)
+
+
+@app.get("/documents")
+async def list_documents(tenant: str = Depends(current_tenant)):
+    return await run_in_threadpool(ingest_cache.list_documents, tenant)
+
+
+@app.delete("/documents/{doc_id}", status_code=202)
+async def delete_document(doc_id: str, tenant: str = Depends(current_tenant)):
+    if not await run_in_threadpool(ingest_cache.get_document, doc_id, tenant):
+        raise HTTPException(status_code=404, detail="Document not found")
+    job_id = await run_in_threadpool(ingest_jobs.submit_delete, doc_id, tenant)
+    return await run_in_threadpool(ingest_jobs.get_job, job_id)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, tenant: str = Depends(current_tenant)):
+    job = await run_in_threadpool(ingest_jobs.get_job, job_id)
+    # Another tenant's job is reported as missing rather than forbidden
+    if job is None or job["tenant"] != tenant:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/ask")
+async def ask(body: Question, tenant: str = Depends(current_tenant)):
+    if body.doc_id and not await run_in_threadpool(ingest_cache.get_document, body.doc_id, tenant):
+        raise HTTPException(status_code=404, detail="Document not found")
+    context = await run_in_threadpool(backend.retrieve_context, body.question, body.top_k, body.doc_id, tenant)
+    if body.stream:
+        # The sync generator is iterated on the thread pool, one event per model chunk
+        return StreamingResponse(_answer_events(body.question, context), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    answer = await run_in_threadpool(backend.answer_question, body.question, context)
+    return {"answer": answer}
@@ -1,89 +1,393 @@
 import os
+import asyncio
 import logging
-import google.generativeai as genai
-from typing import List, Optional
+import random
+import threading
+import metrics
+import resources
+from typing import Callable, Dict, Iterator, List, Optional
 import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+
+# Per-key limits: sustained requests per minute (token bucket) and concurrent requests
+KEY_REQUESTS_PER_MINUTE = float(os.getenv("API_KEY_RPM", "60"))
+KEY_MAX_IN_FLIGHT = int(os.getenv("API_KEY_MAX_IN_FLIGHT", "4"))
+
+# A key whose last BREAKER_FAILURES calls failed is skipped for BREAKER_COOLDOWN seconds,
+# then gets a single trial request (half-open) before it is trusted again
+BREAKER_FAILURES = int(os.getenv("API_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("API_BREAKER_COOLDOWN", "30"))
+
+# Retry backoff: full jitter over BACKOFF_BASE * 2^attempt, capped at BACKOFF_MAX seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# How long a request waits for any key to have capacity before giving up
+ACQUIRE_TIMEOUT = float(os.getenv("API_ACQUIRE_TIMEOUT", "30"))
+
+# Weight of the newest observation in the rolling latency and error averages
+EWMA_ALPHA = 0.2
+
+
+class GeminiClient:
+    """Gemini API client bound to one API key instead of the process-global genai.configure
+
+    The key goes in the generativelanguage client's options; responses are wrapped the way
+    GenerativeModel.generate_content returns them (.text, .usage_metadata, chunk iteration).
+    """
+
+    def __init__(self, key: str):
+        self.genai = resources.lazy_import("google.generativeai")
+        self.glm = resources.lazy_import("google.ai.generativelanguage")
+        self.client = self.glm.GenerativeServiceClient(client_options={"api_key": key})
+        self.model_name = GEMINI_MODEL if GEMINI_MODEL.startswith("models/") else f"models/{GEMINI_MODEL}"
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        request = self.glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=[self.glm.Content(role="user", parts=[self.glm.Part(text=prompt)])])
+        response_type = self.genai.types.GenerateContentResponse
+        if stream:
+            return response_type.from_iterator(self.client.stream_generate_content(request))
+        return response_type.from_response(self.client.generate_content(request))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at rate tokens per second up to capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def try_take(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class KeyState:
+    """Rate limit, concurrency, circuit breaker and rolling health of one API key"""
+
+    def __init__(self, key: str, requests_per_minute: float, max_in_flight: int):
+        self.key = key
+        self.bucket = TokenBucket(requests_per_minute / 60.0, max(1.0, requests_per_minute / 60.0 * 5))
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.half_open_trial = False
+        self.latency = 1.0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def score(self) -> float:
+        """Lower is healthier: rolling latency, inflated by recent errors and current load"""
+        load = 1 + self.in_flight / self.max_in_flight
+        return self.latency * (1 + 4 * self.error_rate) * load
+
+    def to_dict(self) -> dict:
+        return {
+            "key": f"{self.key[:10]}...",
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "latency_s": round(self.latency, 3),
+            "error_rate": round(self.error_rate, 3),
+            "circuit_open": self.is_open(time.monotonic()),
+        }
+
+
 class APIManager:
-    def __init__(self):
-        """Initialize API manager with multiple API keys"""
-        self.api_keys = [
-            os.getenv("GOOGLE_API_KEY_1", ""),
-            os.getenv("GOOGLE_API_KEY_2", ""),
-            os.getenv("GOOGLE_API_KEY_3", ""),
-            os.getenv("GOOGLE_API_KEY_4", ""),
-            os.getenv("GOOGLE_API_KEY_5", ""),
-        ]
-        
+    def __init__(self, api_keys: Optional[List[str]] = None, client_factory: Callable = GeminiClient,
+                 requests_per_minute: float = KEY_REQUESTS_PER_MINUTE, max_in_flight: int = KEY_MAX_IN_FLIGHT):
+        """Initialize API manager with multiple API keys
+
+        client_factory(key) returns a model object with generate_content (and optionally
+        generate_content_async); pass a stub such as llm_stub.StubGenerativeModel to test.
+        """
+        if api_keys is None:
+            api_keys = [
+                os.getenv("GOOGLE_API_KEY_1", ""),
+                os.getenv("GOOGLE_API_KEY_2", ""),
+                os.getenv("GOOGLE_API_KEY_3", ""),
+                os.getenv("GOOGLE_API_KEY_4", ""),
+                os.getenv("GOOGLE_API_KEY_5", ""),
+            ]
+
         # Filter out empty keys
-        self.api_keys = [key for key in self.api_keys if key]
-        
+        self.api_keys = [key for key in api_keys if key]
+
         if not self.api_keys:
             # Fallback to single key if no multi-keys provided
-            self.api_keys = [os.getenv("GOOGLE_API_KEY", "")]
-        
-        self.current_key_index = 0
-        self.failed_keys = set()
-        self.last_reset_time = time.time()
-        
+            fallback = os.getenv("GOOGLE_API_KEY", "")
+            self.api_keys = [fallback] if fallback else []
+
+        self.client_factory = client_factory
+        self.states: Dict[str, KeyState] = {
+            key: KeyState(key, requests_per_minute, max_in_flight) for key in self.api_keys
+        }
+        self.max_attempts = len(self.api_keys) + 1
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, key: str):
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self.client_factory(key)
+        return client
+
+    def _try_acquire(self):
+        """Reserve the healthiest key with capacity; returns (state, 0) or (None, seconds to wait)"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            waits = []
+            for state in self.states.values():
+                if state.is_open(now):
+                    waits.append(state.open_until - now)
+                    continue
+                if state.consecutive_failures >= BREAKER_FAILURES and state.half_open_trial:
+                    continue
+                if state.in_flight >= state.max_in_flight:
+                    # Frees up when a request finishes, which has no known deadline; poll
+                    waits.append(0.05)
+                    continue
+                bucket_wait = state.bucket.wait_time()
+                if bucket_wait > 0:
+                    waits.append(bucket_wait)
+                    continue
+                candidates.append(state)
+
+            if not candidates:
+                return None, min(waits) if waits else 0.05
+
+            # Weighted random choice spreads load over healthy keys instead of always key 1
+            weights = [1.0 / max(state.score(), 1e-3) for state in candidates]
+            state = random.choices(candidates, weights=weights)[0]
+            state.bucket.try_take()
+            state.in_flight += 1
+            state.requests += 1
+            if state.consecutive_failures >= BREAKER_FAILURES:
+                state.half_open_trial = True
+            return state, 0.0
+
+    def _release(self, state: KeyState, latency: float, error: Optional[Exception] = None):
+        metrics.record_api_call(f"{state.key[:10]}...", latency, error)
+        with self._lock:
+            state.in_flight -= 1
+            state.half_open_trial = False
+            state.error_rate = (1 - EWMA_ALPHA) * state.error_rate + EWMA_ALPHA * (1.0 if error else 0.0)
+            if error is None:
+                state.latency = (1 - EWMA_ALPHA) * state.latency + EWMA_ALPHA * latency
+                state.consecutive_failures = 0
+                return
+            state.errors += 1
+            state.consecutive_failures += 1
+            if state.consecutive_failures >= BREAKER_FAILURES:
+                state.open_until = time.monotonic() + BREAKER_COOLDOWN
+                logger.warning(f"Circuit opened for API key {state.key[:10]}... for {BREAKER_COOLDOWN:.0f}s")
+        logger.error(f"API key failed: {state.key[:10]}... Error: {str(error)}")
+
+    def _acquire(self) -> Optional[KeyState]:
+        deadline = time.monotonic() + ACQUIRE_TIMEOUT
+        while True:
+            state, wait = self._try_acquire()
+            if state is not None:
+                return state
+            if time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    async def _acquire_async(self) -> Optional[KeyState]:
+        deadline = time.monotonic() + ACQUIRE_TIMEOUT
+        while True:
+            state, wait = self._try_acquire()
+            if state is not None:
+                return state
+            if time.monotonic() + wait > deadline:
+                return None
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
     def get_working_key(self) -> Optional[str]:
-        """Get the next working API key"""
-        # Reset failed keys every hour
-        if time.time() - self.last_reset_time > 3600:
-            self.failed_keys.clear()
-            self.last_reset_time = time.time()
-        
-        # Try keys in order
-        for i, key in enumerate(self.api_keys):
-            if key not in self.failed_keys:
-                self.current_key_index = i
-                return key
-        
-        # If all keys failed, reset and try again
-        self.failed_keys.clear()
-        if self.api_keys:
-            self.current_key_index = 0
-            return self.api_keys[0]
-        
-        return None
-    
+        """Get the healthiest API key whose circuit is closed (without reserving it)"""
+        now = time.monotonic()
+        with self._lock:
+            available = [state for state in self.states.values() if not state.is_open(now)]
+            if not available:
+                available = list(self.states.values())
+            if not available:
+                return None
+            return min(available, key=lambda state: state.score()).key
+
     def mark_key_failed(self, key: str):
-        """Mark an API key as failed"""
-        self.failed_keys.add(key)
+        """Mark an API key as failed, opening its circuit breaker"""
+        state = self.states.get(key)
+        if state is None:
+            return
+        with self._lock:
+            state.errors += 1
+            state.consecutive_failures = max(state.consecutive_failures + 1, BREAKER_FAILURES)
+            state.open_until = time.monotonic() + BREAKER_COOLDOWN
         logger.warning(f"API key marked as failed: {key[:10]}...")
-    
+
+    def _generate(self, prompt: str):
+        """Response to prompt from the healthiest key, failing over to the others
+
+        Raises an Exception with a message for the user if no key answers.
+        """
+        if not self.api_keys:
+            raise Exception("No API keys available. Please check your configuration.")
+
+        for attempt in range(self.max_attempts):
+            state = self._acquire()
+            if state is None:
+                raise Exception("All API keys are busy. Please try again later.")
+
+            start = time.monotonic()
+            try:
+                response = self._client(state.key).generate_content(prompt)
+                # Blocked or empty responses raise here, so they fail over too
+                response.text
+            except Exception as e:
+                self._release(state, time.monotonic() - start, e)
+                if attempt < self.max_attempts - 1:
+                    time.sleep(self._backoff(attempt))
+                continue
+            self._release(state, time.monotonic() - start)
+            return response
+
+        raise Exception("All API keys have failed. Please try again later.")
+
+    def _generate_stream(self, prompt: str):
+        """Response chunks for prompt; fails over to another key until the first text arrives
+
+        Raises an Exception with a message for the user if no key answers, and the
+        key's error if the stream fails after text was yielded.
+        """
+        if not self.api_keys:
+            raise Exception("No API keys available. Please check your configuration.")
+
+        for attempt in range(self.max_attempts):
+            state = self._acquire()
+            if state is None:
+                raise Exception("All API keys are busy. Please try again later.")
+
+            start = time.monotonic()
+            started = False
+            error = None
+            # finally also releases the key when the caller closes the stream early
+            # (GeneratorExit on a rerun or a client disconnect)
+            try:
+                for chunk in self._client(state.key).generate_content(prompt, stream=True):
+                    if chunk.text:
+                        started = True
+                    yield chunk
+            except Exception as e:
+                error = e
+            finally:
+                self._release(state, time.monotonic() - start, error)
+            if error is None:
+                return
+            # Text already shown to the user can't be retried on another key
+            if started:
+                raise error
+            if attempt < self.max_attempts - 1:
+                time.sleep(self._backoff(attempt))
+
+        raise Exception("All API keys have failed. Please try again later.")
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        """GenerativeModel.generate_content over the managed keys, with their limits and failover"""
+        if stream:
+            return self._generate_stream(prompt)
+        return self._generate(prompt)
+
+    @metrics.timed("api_generate_response")
     def generate_response(self, prompt: str) -> str:
-        """Generate response using available API keys with automatic failover"""
-        max_retries = len(self.api_keys)
-        
-        for attempt in range(max_retries):
-            key = self.get_working_key()
-            if not key:
-                return "No API keys available. Please check your configuration."
-            
+        """Generate response using available API keys with automatic failover (thread-safe)"""
+        try:
+            return self._generate(prompt).text.strip()
+        except Exception as e:
+            return str(e)
+
+    @metrics.timed("api_generate_response")
+    async def agenerate_response(self, prompt: str) -> str:
+        """Asyncio version of generate_response; many calls can run concurrently on one loop"""
+        if not self.api_keys:
+            return "No API keys available. Please check your configuration."
+
+        for attempt in range(self.max_attempts):
+            state = await self._acquire_async()
+            if state is None:
+                return "All API keys are busy. Please try again later."
+
+            start = time.monotonic()
             try:
-                genai.configure(api_key=key)
-                model = genai.GenerativeModel("gemini-1.5-pro")
-                
-                response = model.generate_content(prompt)
-                return response.text.strip()
-                
+                client = self._client(state.key)
+                if hasattr(client, "generate_content_async"):
+                    response = await client.generate_content_async(prompt)
+                else:
+                    response = await asyncio.to_thread(client.generate_content, prompt)
+                text = response.text.strip()
             except Exception as e:
-                logger.error(f"API key failed: {key[:10]}... Error: {str(e)}")
-                self.mark_key_failed(key)
-                
-                if attempt == max_retries - 1:
-                    return "All API keys have failed. Please try again later."
-                
-                # Wait a bit before retrying with next key
-                time.sleep(1)
+                self._release(state, time.monotonic() - start, e)
+                if attempt < self.max_attempts - 1:
+                    await asyncio.sleep(self._backoff(attempt))
                 continue
-        
-        return "Unable to generate response. Please try again."
+            self._release(state, time.monotonic() - start)
+            return text
+
+        return "All API keys have failed. Please try again later."
+
+    @metrics.timed("api_generate_response_stream")
+    def generate_response_stream(self, prompt: str) -> Iterator[str]:
+        """Yield response text as it streams in; fails over to another key until the first chunk arrives"""
+        started = False
+        try:
+            for chunk in self._generate_stream(prompt):
+                if chunk.text:
+                    started = True
+                    yield chunk.text
+        except Exception as e:
+            if not started:
+                yield str(e)
+
+    def stats(self) -> List[dict]:
+        """Per-key request, error, latency and circuit state"""
+        with self._lock:
+            return [state.to_dict() for state in self.states.values()]
 
 # Global API manager instance
 api_manager = APIManager()
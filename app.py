@@ -1,7 +1,11 @@
+import time
 import streamlit as st
-from pdf_utils import extract_text_from_pdf
-from rag_utils_simple import chunk_text, embed_and_store, retrieve_relevant_chunks, answer_question
-from auth import login_user, signup_user, logout
+from rag_utils_simple import retrieve_context, answer_question_stream
+from auth import login_user, signup_user, logout, create_session, session_user
+import conversation
+import ingest_cache
+import ingest_jobs
+import metrics
 
 # Page configuration
 st.set_page_config(
@@ -30,6 +34,7 @@ def login_page():
             if login_user(username, password):
                 st.session_state.authenticated = True
                 st.session_state.username = username
+                st.session_state.session_token = create_session(username)
                 st.rerun()
             else:
                 st.error("Invalid username or password")
@@ -48,7 +53,7 @@ def login_page():
             elif signup_user(new_username, new_password):
                 st.success("Account created successfully! Please login.")
             else:
-                st.error("Username already exists")
+                st.error("Username already exists or is reserved")
 
 def main_app():
     # Custom CSS for enhanced UI
@@ -148,31 +153,61 @@ def main_app():
         # Initialize session state
         if "pdf_processed" not in st.session_state:
             st.session_state.pdf_processed = False
-        if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
+        if "memory" not in st.session_state:
+            # Recent turns plus a rolling summary; bounded however long the chat runs
+            st.session_state.memory = conversation.ConversationMemory()
         if "pdf_name" not in st.session_state:
             st.session_state.pdf_name = ""
         
-        # Process PDF
-        if uploaded_file and not st.session_state.pdf_processed:
-            with st.spinner("🔄 Processing PDF..."):
-                text = extract_text_from_pdf(uploaded_file)
-                chunks = chunk_text(text)
-                embed_and_store(chunks)
-                st.session_state.pdf_processed = True
-                st.session_state.pdf_name = uploaded_file.name
-                st.rerun()
+        if "doc_id" not in st.session_state:
+            st.session_state.doc_id = None
+        
+        # Each user's documents live in their own collection
+        tenant = st.session_state.username
+        
+        # PDFs are indexed by a background job (reused if these exact bytes were seen
+        # before); after a page reload, pick up the user's job that is still running
+        ingest_jobs.resume()
+        if "job_id" not in st.session_state:
+            active = ingest_jobs.list_jobs(tenant, active_only=True, limit=1)
+            st.session_state.job_id = active[0]["job_id"] if active else None
+        doc_id = ingest_cache.document_hash(uploaded_file.getvalue()) if uploaded_file else None
+        if uploaded_file and doc_id not in (st.session_state.doc_id, st.session_state.get("job_doc_id")):
+            try:
+                st.session_state.job_id = ingest_jobs.submit(
+                    uploaded_file.getvalue(), uploaded_file.name, tenant, backend="rag_utils_simple")
+                st.session_state.job_doc_id = doc_id
+            except Exception as e:
+                st.error(str(e))
+        
+        job = ingest_jobs.get_job(st.session_state.job_id) if st.session_state.job_id else None
+        if job and job["state"] == "done":
+            st.session_state.job_id = None
+            st.session_state.doc_id = job["doc_id"]
+            st.session_state.pdf_processed = True
+            st.session_state.pdf_name = job["name"]
+            st.rerun()
+        elif job and job["state"] == "failed":
+            st.session_state.job_id = None
+            st.error(f"Failed to process {job['name']}: {job['error']}")
+        elif job:
+            total = job["pages_total"]
+            st.progress(job["pages_done"] / total if total else 0.0,
+                        text=f"🔄 Processing {job['name']}: {job['pages_done']}/{total or '?'} pages, "
+                             f"{job['chunks_done']} chunks")
         
         # Display PDF status
         if st.session_state.pdf_processed:
             st.info(f"📄 **Loaded:** {st.session_state.pdf_name}")
             
-            # Chat interface
-            for message in st.session_state.chat_history:
-                if message["role"] == "user":
-                    st.markdown(f'<div class="chat-message user-message"><b>You:</b> {message["content"]}</div>', unsafe_allow_html=True)
-                else:
-                    st.markdown(f'<div class="chat-message bot-message"><b>Bot:</b> {message["content"]}</div>', unsafe_allow_html=True)
+            # Chat interface: only the last CHAT_HISTORY_TURNS turns are kept and rendered
+            memory = st.session_state.memory
+            if memory.total_turns > len(memory.history) and memory.summary:
+                with st.expander("Earlier conversation (summary)"):
+                    st.write(memory.summary)
+            for turn in memory.history:
+                st.markdown(f'<div class="chat-message user-message"><b>You:</b> {turn.question}</div>', unsafe_allow_html=True)
+                st.markdown(f'<div class="chat-message bot-message"><b>Bot:</b> {turn.answer}</div>', unsafe_allow_html=True)
             
             # Input for new questions with automatic clearing
             with st.form(key="chat_form", clear_on_submit=True):
@@ -184,18 +219,29 @@ def main_app():
                 submitted = st.form_submit_button("Send", use_container_width=True)
                 
                 if submitted and question:
-                    with st.spinner("🤖 Thinking..."):
-                        context = " ".join(retrieve_relevant_chunks(question))
-                        answer = answer_question(question, context)
+                    # METRICS_PROFILE=cpu or memory profiles this question
+                    with metrics.capture(name="question"):
+                        with st.spinner("🤖 Thinking..."):
+                            # Follow-ups like "what about section 4?" are searched with the previous question
+                            query = memory.rewrite_query(question)
+                            context = retrieve_context(query, doc_id=st.session_state.doc_id, tenant=tenant)
                         
-                        st.session_state.chat_history.append({"role": "user", "content": question})
-                        st.session_state.chat_history.append({"role": "bot", "content": answer})
-                        st.rerun()
+                        # Render the answer as it streams in; the full text is kept for the history
+                        st.markdown(f'<div class="chat-message user-message"><b>You:</b> {question}</div>', unsafe_allow_html=True)
+                        answer = st.write_stream(answer_question_stream(question, context, memory.prompt_history()))
+                    
+                    memory.add(question, answer)
+                    st.rerun()
         else:
             st.info("Please upload a PDF to start chatting")
+        
+        # Poll the running ingestion job
+        if job and job["state"] in ingest_jobs.ACTIVE_STATES:
+            time.sleep(1)
+            st.rerun()
 
-# Main app logic
-if not st.session_state.authenticated:
+# Main app logic; the session token is checked in memory, without the users database
+if not st.session_state.authenticated or session_user(st.session_state.get("session_token")) != st.session_state.username:
     login_page()
 else:
     main_app()
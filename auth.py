@@ -1,52 +1,255 @@
-import streamlit as st
+"""User accounts for the app and the API
+
+Users live in users.db, opened in WAL mode through a small pool of shared
+connections (ConnectionPool), so logins read while a signup writes and no request
+pays for opening the database. Each connection caches its prepared statements.
+
+Passwords are hashed with scrypt. Hashing deliberately costs tens of milliseconds
+of CPU, so it runs on AUTH_HASH_WORKERS threads: a burst of logins queues there
+instead of taking every core from the Streamlit script threads. Accounts created
+with the old unsalted SHA-256 hashes still log in and are rehashed with scrypt on
+their next login.
+
+Verified logins are remembered in memory for SESSION_TTL seconds: the app keeps a
+session token, and the API's per-request Basic credentials are recognized without
+touching the database or hashing again.
+"""
+import base64
 import hashlib
-import sqlite3
+import hmac
 import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+import streamlit as st
+
+import resources
+import vector_store
+
+DB_PATH = 'users.db'
+
+# Connections kept open to users.db
+AUTH_DB_POOL_SIZE = int(os.getenv("AUTH_DB_POOL_SIZE", "4"))
+
+# Threads computing password hashes; logins beyond this wait their turn
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+
+# scrypt cost (a power of two); r and p are the usual 8 and 1, about 16 MB per hash
+AUTH_SCRYPT_N = int(os.getenv("AUTH_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# How long a verified login is remembered, and how many are kept
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(12 * 3600)))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "4096"))
+
+# The shared collection that chat_ui.py and bulk_ingest.py index into is the
+# DEFAULT_TENANT's; an account by that name would see all of it
+RESERVED_USERNAMES = {vector_store.DEFAULT_TENANT}
+
+SELECT_PASSWORD = "SELECT password FROM users WHERE username=?"
+INSERT_USER = "INSERT INTO users (username, password) VALUES (?, ?)"
+UPDATE_PASSWORD = "UPDATE users SET password=? WHERE username=? AND password=?"
+
+
+class ConnectionPool:
+    """Up to size SQLite connections in WAL mode, handed out one thread at a time"""
+
+    def __init__(self, path: str, size: int = AUTH_DB_POOL_SIZE):
+        self.path = path
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=32)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                self._created += create
+            conn = self._open() if create else self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (username TEXT PRIMARY KEY, password TEXT)''')
-    conn.commit()
-    conn.close()
+    pool = ConnectionPool(DB_PATH)
+    with pool.connection() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users
+                        (username TEXT PRIMARY KEY, password TEXT)''')
+        conn.commit()
+    return pool
+
+def ensure_db() -> ConnectionPool:
+    """Create the users table and connection pool on first use, once per process"""
+    return resources.get_resource("users_db", init_db)
+
+def _hash_pool() -> ThreadPoolExecutor:
+    return resources.get_resource(
+        "password_hasher", lambda: ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="auth-hash"))
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+def _scrypt(password: str, salt: bytes, n: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
 
 def hash_password(password):
-    """Hash password using SHA-256"""
+    """Salted scrypt hash of a password, as scrypt$n$r$p$salt$hash"""
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, AUTH_SCRYPT_N)
+    return f"scrypt${AUTH_SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+def legacy_hash_password(password):
+    """Unsalted SHA-256, as stored by earlier versions"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def signup_user(username, password):
-    """Register a new user"""
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
+def verify_password(password, stored) -> bool:
+    """Whether password matches stored; a malformed stored hash never matches"""
     try:
-        hashed_password = hash_password(password)
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", 
-                  (username, hashed_password))
-        conn.commit()
+        if not stored.startswith("scrypt$"):
+            return hmac.compare_digest(legacy_hash_password(password), stored)
+        _, n, r, p, salt, digest = stored.split("$")
+        computed = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p),
+                                  dklen=len(base64.b64decode(digest)))
+        return hmac.compare_digest(computed, base64.b64decode(digest))
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+def needs_rehash(stored) -> bool:
+    """Whether a stored hash is legacy SHA-256, malformed, or weaker than the current scrypt cost"""
+    try:
+        return not stored.startswith("scrypt$") or int(stored.split("$")[1]) < AUTH_SCRYPT_N
+    except (AttributeError, ValueError):
         return True
-    except sqlite3.IntegrityError:
+
+# Checked against when the user doesn't exist, so unknown names take as long as wrong passwords
+_DUMMY_HASH = f"scrypt${AUTH_SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(bytes(16))}${_b64(bytes(32))}"
+
+
+class SessionCache:
+    """Bounded, thread-safe map of keys to usernames that expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() > entry[1]:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, username: str):
+        with self._lock:
+            self._data[key] = (username, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# Session token -> username, for the app
+sessions = SessionCache()
+
+# Keyed digest of verified (username, password) pairs -> username, for API requests
+_verified = SessionCache()
+_verified_key = os.urandom(32)
+
+def _credentials_key(username, password) -> bytes:
+    return hmac.new(_verified_key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+def signup_user(username, password):
+    """Register a new user"""
+    if not username or username in RESERVED_USERNAMES:
+        return False
+    pool = ensure_db()
+    with pool.connection() as conn:
+        if conn.execute(SELECT_PASSWORD, (username,)).fetchone():
+            return False
+    hashed_password = _hash_pool().submit(hash_password, password).result()
+    with pool.connection() as conn:
+        try:
+            conn.execute(INSERT_USER, (username, hashed_password))
+            conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+def _check_password(username, password) -> bool:
+    """Runs on the hashing threads"""
+    pool = ensure_db()
+    with pool.connection() as conn:
+        row = conn.execute(SELECT_PASSWORD, (username,)).fetchone()
+    if row is None:
+        verify_password(password, _DUMMY_HASH)
         return False
-    finally:
-        conn.close()
+    stored = row[0]
+    if not verify_password(password, stored):
+        return False
+    if needs_rehash(stored):
+        # Move the account to the current scrypt parameters while the password is at hand
+        with pool.connection() as conn:
+            conn.execute(UPDATE_PASSWORD, (hash_password(password), username, stored))
+            conn.commit()
+    return True
 
 def login_user(username, password):
     """Check user credentials"""
-    conn = sqlite3.connect('users.db')
-    c = conn.cursor()
-    hashed_password = hash_password(password)
-    c.execute("SELECT * FROM users WHERE username=? AND password=?", 
-              (username, hashed_password))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
+    if username in RESERVED_USERNAMES:
+        return False
+    key = _credentials_key(username, password)
+    if _verified.get(key) == username:
+        return True
+    if not _hash_pool().submit(_check_password, username, password).result():
+        return False
+    _verified.put(key, username)
+    return True
+
+def create_session(username) -> str:
+    """New session token for a user who just logged in"""
+    token = secrets.token_urlsafe(32)
+    sessions.put(token, username)
+    return token
+
+def session_user(token) -> Optional[str]:
+    """The user a session token belongs to, or None if it is unknown or expired"""
+    return sessions.get(token) if token else None
 
 def logout():
     """Clear session state"""
+    sessions.pop(st.session_state.get("session_token"))
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     st.rerun()
-
-# Initialize database on import
-init_db()
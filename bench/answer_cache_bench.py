@@ -0,0 +1,117 @@
+"""Replay a question log against the semantic answer cache with a stub LLM
+
+    python bench/answer_cache_bench.py                       # synthetic log, offline embedder
+    python bench/answer_cache_bench.py --log questions.jsonl --embedder model
+
+A log is JSON lines with "question" and "context" fields. Prints hit rate, LLM calls
+and answer latency with and without the cache as JSON.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import answer_cache
+import generation
+from llm_stub import StubGenerativeModel
+
+SAMPLE_TOPICS = [
+    ("The warranty covers parts and labour for 24 months from purchase.",
+     ["How long is the warranty?", "how long is the warranty", "What is the warranty period?",
+      "How long does the warranty last?"]),
+    ("Refunds are issued within 14 days to the original payment method.",
+     ["How do refunds work?", "How do refunds work", "When will I get my refund?",
+      "how are refunds issued?"]),
+    ("The device must be charged for 6 hours before first use.",
+     ["How long should I charge it first?", "How long should I charge it first",
+      "How long to charge before first use?", "initial charging time?"]),
+]
+
+
+def sample_log(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    log = []
+    for _ in range(n):
+        context, questions = rng.choice(SAMPLE_TOPICS)
+        log.append({"question": rng.choice(questions), "context": context})
+    return log
+
+
+def load_log(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def hash_embed(text: str, dim: int = 384) -> np.ndarray:
+    """Offline bag-of-words embedding; only catches repeats and near-verbatim rewordings"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def replay(log: list, model: StubGenerativeModel, embed_fn) -> dict:
+    latencies = []
+    calls_before = model.calls
+    for entry in log:
+        start = time.perf_counter()
+        generation.answer_question(entry["question"], entry["context"], embed_fn=embed_fn, model=model)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "llm_calls": model.calls - calls_before,
+        "total_s": round(sum(latencies), 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log", help="JSONL question log (default: synthetic)")
+    parser.add_argument("--questions", type=int, default=200, help="synthetic log length")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub LLM latency in seconds")
+    parser.add_argument("--threshold", type=float, default=answer_cache.ANSWER_CACHE_THRESHOLD)
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash",
+                        help="hash: offline bag-of-words; model: rag_utils' sentence-transformers model")
+    args = parser.parse_args()
+
+    log = load_log(args.log) if args.log else sample_log(args.questions)
+    if args.embedder == "model":
+        import rag_utils
+        embed_fn = rag_utils.embed_query
+    else:
+        embed_fn = hash_embed
+
+    answer_cache.ANSWER_CACHE_THRESHOLD = args.threshold
+    with tempfile.TemporaryDirectory() as tmp:
+        answer_cache.ANSWER_CACHE_PATH = os.path.join(tmp, "answer_cache.db")
+        model = StubGenerativeModel(latency=args.latency)
+        uncached = replay(log, model, embed_fn=None)
+        cached = replay(log, model, embed_fn=embed_fn)
+
+    report = {
+        "questions": len(log),
+        "threshold": args.threshold,
+        "embedder": args.embedder,
+        "hit_rate": round(answer_cache.stats()["hit_rate"], 3),
+        "without_cache": uncached,
+        "with_cache": cached,
+        "time_saved_s": round(uncached["total_s"] - cached["total_s"], 3),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Local load test of the HTTP API: concurrent users asking questions about an uploaded PDF
+
+    python bench/api_load_test.py --users 1 8 32 --workers 2
+    python bench/api_load_test.py --url http://127.0.0.1:8000 --user alice --password secret
+
+Without --url it starts `uvicorn api:app` on a free port in a temporary directory (own
+CHROMA_PATH and users.db, LLM_BACKEND=stub standing in for Gemini, answer cache off),
+creates a user, uploads a synthetic PDF and waits for its ingestion job. Then, for each
+user count, that many concurrent clients ask the planted-fact questions for --duration
+seconds, alternating plain and streamed (SSE) answers. Reports requests/sec, errors,
+latency percentiles and streamed time to first token as JSON.
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import common
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Client:
+    def __init__(self, url: str, user: str, password: str):
+        self.url = url.rstrip("/")
+        token = base64.b64encode(f"{user}:{password}".encode()).decode()
+        self.headers = {"Authorization": f"Basic {token}"}
+
+    def request(self, method: str, path: str, body: bytes = None, content_type: str = None):
+        headers = dict(self.headers)
+        if content_type:
+            headers["Content-Type"] = content_type
+        request = urllib.request.Request(self.url + path, data=body, method=method, headers=headers)
+        return urllib.request.urlopen(request, timeout=120)
+
+    def json(self, method: str, path: str, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        with self.request(method, path, body, "application/json" if body else None) as response:
+            return json.loads(response.read() or b"null")
+
+    def upload(self, name: str, data: bytes) -> dict:
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+                f"Content-Type: application/pdf\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        with self.request("POST", "/documents", body, f"multipart/form-data; boundary={boundary}") as response:
+            return json.loads(response.read())
+
+    def ask_stream(self, payload) -> float:
+        """Seconds to the first token event of a streamed answer"""
+        start = time.perf_counter()
+        first = None
+        with self.request("POST", "/ask", json.dumps(payload).encode(), "application/json") as response:
+            for line in response:
+                if first is None and line.startswith(b"event: token"):
+                    first = time.perf_counter() - start
+                if line.startswith(b"event: done"):
+                    break
+        return first if first is not None else time.perf_counter() - start
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str, workers: int, backend: str, user: str, password: str):
+    env = dict(os.environ, CHROMA_PATH=os.path.join(workdir, "chroma_db"), LLM_BACKEND="stub",
+               ANSWER_CACHE_THRESHOLD="2", API_BACKEND=backend,
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO, os.environ.get("PYTHONPATH")])))
+    # auth keeps users.db in the working directory, shared with the server below
+    subprocess.run([sys.executable, "-c", f"import auth; auth.signup_user({user!r}, {password!r})"],
+                   cwd=workdir, env=env, check=True)
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--app-dir", REPO, "--port", str(port),
+                               "--workers", str(workers), "--log-level", "warning"], cwd=workdir, env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise Exception("API server exited during startup")
+        try:
+            urllib.request.urlopen(url + "/health", timeout=1).close()
+            return server, url
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise Exception("API server did not start in time")
+
+
+def ingest(client: Client, pages: int, seed: int):
+    texts, facts = common.synthetic_pages(pages, seed=seed)
+    job = client.upload("load-test.pdf", common.make_pdf(texts))
+    while job["state"] in ("queued", "running"):
+        time.sleep(0.5)
+        job = client.json("GET", f"/jobs/{job['job_id']}")
+    if job["state"] != "done":
+        raise Exception(f"Ingestion failed: {job['error']}")
+    return job["doc_id"], [query for _, _, query in facts]
+
+
+def run_load(client: Client, users: int, duration: float, doc_id: str, queries) -> dict:
+    latencies, first_tokens, errors = [], [], []
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def user(index: int):
+        i = index
+        while time.monotonic() < stop:
+            payload = {"question": queries[i % len(queries)], "doc_id": doc_id, "stream": i % 2 == 1}
+            start = time.perf_counter()
+            try:
+                if payload["stream"]:
+                    first = client.ask_stream(payload)
+                else:
+                    client.json("POST", "/ask", payload)
+                    first = None
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if first is not None:
+                        first_tokens.append(first)
+            except (OSError, urllib.error.HTTPError) as e:
+                with lock:
+                    errors.append(str(e))
+            i += users
+
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    def summary(seconds):
+        values = sorted(s * 1000 for s in seconds)
+        return {q: round(common.percentile(values, q), 2) for q in (50, 95, 99)}
+
+    return {
+        "users": users,
+        "requests": len(latencies),
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "errors": len(errors),
+        "latency_ms": summary(latencies),
+        "first_token_ms": summary(first_tokens),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="existing API server (default: start one locally)")
+    parser.add_argument("--user", default="loadtest")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn workers of the local server")
+    parser.add_argument("--backend", default="rag_utils_simple", help="API_BACKEND of the local server")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per user count")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = None
+    with tempfile.TemporaryDirectory() as workdir:
+        url = args.url
+        if url is None:
+            server, url = start_server(workdir, args.workers, args.backend, args.user, args.password)
+        try:
+            client = Client(url, args.user, args.password)
+            doc_id, queries = ingest(client, args.pages, args.seed)
+            results = [run_load(client, users, args.duration, doc_id, queries) for users in args.users]
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    print(json.dumps({"url": args.url or "local", "workers": args.workers, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
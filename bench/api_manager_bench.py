@@ -0,0 +1,69 @@
+"""Aggregate APIManager throughput against stub model clients, by number of keys
+
+    python bench/api_manager_bench.py --keys 1 2 4 --requests 200 --concurrency 32
+
+Each key gets its own StubGenerativeModel, so the per-key rate limit and in-flight
+limit are what bound throughput. Prints requests/sec, error count and per-key stats
+as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_manager import APIManager
+from llm_stub import StubGenerativeModel
+
+
+async def run(keys: int, requests: int, concurrency: int, latency: float, rpm: float,
+              in_flight: int, fail_rate: float) -> dict:
+    manager = APIManager(
+        api_keys=[f"stub-key-{i}" for i in range(keys)],
+        client_factory=lambda key: StubGenerativeModel(latency=latency, fail_rate=fail_rate),
+        requests_per_minute=rpm,
+        max_in_flight=in_flight,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            return await manager.agenerate_response(f"Question: {i} Answer:")
+
+    start = time.perf_counter()
+    answers = await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "keys": keys,
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 2),
+        "failed": sum(1 for answer in answers if not answer.startswith("Stub answer")),
+        "per_key": manager.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub model latency (s)")
+    parser.add_argument("--rpm", type=float, default=600, help="per-key requests per minute")
+    parser.add_argument("--in-flight", type=int, default=4, help="per-key concurrent requests")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(run(keys, args.requests, args.concurrency, args.latency, args.rpm,
+                        args.in_flight, args.fail_rate))
+        for keys in args.keys
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
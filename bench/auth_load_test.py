@@ -0,0 +1,142 @@
+"""Concurrent signups and logins against auth.py, and how much they slow other threads
+
+    python bench/auth_load_test.py
+    python bench/auth_load_test.py --users 1 8 32 --duration 5 --hash-workers 2
+
+Creates --accounts users from --signup-threads threads in a temporary users.db, then
+for each number of concurrent users logs in with random accounts for --duration
+seconds, twice: "cold" with the verified-login cache disabled (every login reads the
+database and runs scrypt) and "cached" as in the app once every account has logged
+in before. Meanwhile a probe thread runs
+a small piece of Python work every 10 ms, standing in for a Streamlit script thread;
+its latency percentiles show whether a login burst starves the rest of the process.
+Prints the results as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+
+class Probe:
+    """Times a fixed slice of Python work every 10 ms on its own thread"""
+
+    def __init__(self):
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.01):
+            start = time.perf_counter()
+            sum(i * i for i in range(20000))
+            self.samples.append((time.perf_counter() - start) * 1000)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self) -> dict:
+        values = sorted(self.samples)
+        return {"probe_ms_p50": round(common.percentile(values, 50), 2),
+                "probe_ms_p95": round(common.percentile(values, 95), 2)}
+
+
+def run_logins(auth, accounts, users: int, duration: float, seed: int) -> dict:
+    latencies = []
+    failures = 0
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def user(index):
+        nonlocal failures
+        rng = random.Random(seed * 1000 + index)
+        mine, failed = [], 0
+        while time.monotonic() < stop:
+            name, password = rng.choice(accounts)
+            start = time.perf_counter()
+            failed += not auth.login_user(name, password)
+            mine.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(mine)
+            failures += failed
+
+    with Probe() as probe:
+        threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "logins": len(latencies),
+        "failures": failures,
+        "logins_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(common.percentile(latencies, 50), 2),
+        "p95_ms": round(common.percentile(latencies, 95), 2),
+        **probe.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--signup-threads", type=int, default=8)
+    parser.add_argument("--hash-workers", type=int, help="AUTH_HASH_WORKERS (default: the env setting)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.hash_workers:
+        os.environ["AUTH_HASH_WORKERS"] = str(args.hash_workers)
+
+    import auth
+
+    with tempfile.TemporaryDirectory(prefix="auth_bench_") as workdir:
+        auth.DB_PATH = os.path.join(workdir, "users.db")
+        auth.ensure_db()
+        accounts = [(f"user{i}", f"password-{i}") for i in range(args.accounts)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.signup_threads) as executor:
+            created = sum(executor.map(lambda account: auth.signup_user(*account), accounts))
+        signup_s = time.perf_counter() - start
+
+        with Probe() as idle:
+            time.sleep(1)
+        # Every account logs in once, so the cached runs measure repeat logins
+        for name, password in accounts:
+            auth.login_user(name, password)
+        results = []
+        for users in args.users:
+            verified = auth._verified
+            auth._verified = auth.SessionCache(maxsize=0)
+            cold = run_logins(auth, accounts, users, args.duration, users)
+            auth._verified = verified
+            cached = run_logins(auth, accounts, users, args.duration, users)
+            results.append({"users": users, "cold": cold, "cached": cached})
+
+    print(json.dumps({
+        "hash_workers": auth.AUTH_HASH_WORKERS,
+        "scrypt_n": auth.AUTH_SCRYPT_N,
+        "cpu_count": os.cpu_count(),
+        "signups": created,
+        "signups_per_s": round(created / signup_s, 1),
+        "idle_probe": idle.stats(),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare the token-aware chunker with the old 1000-word windows: recall@k and indexing time
+
+    python bench/chunking_bench.py                      # synthetic corpus, offline embedder
+    python bench/chunking_bench.py --pages 200 --embedder model
+
+Queries ask about fact sentences planted in the corpus; a query is a hit at k when
+one of the top-k chunks contains its fact. The offline embedder
+truncates input at --max-seq-tokens like all-MiniLM-L6-v2 does, which is what makes
+long chunks lose recall.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import common
+import chunking
+
+
+def evaluate(name, chunk_fn, page_texts, facts, encode, ks, queries):
+    start = time.perf_counter()
+    stream = (f"\n=== Page {page} ===\n{text}" for page, text in enumerate(page_texts, 1))
+    texts = chunking.chunk_texts(chunk_fn(stream))
+    chunk_time = time.perf_counter() - start
+    matrix = encode(texts)
+    index_time = time.perf_counter() - start
+
+    query_matrix = encode([q for q, _ in queries])
+    scores = query_matrix @ matrix.T
+    order = np.argsort(-scores, axis=1)[:, :max(ks)]
+    recall = {}
+    for k in ks:
+        hits = sum(
+            any(fact in texts[i] for i in order[row, :k])
+            for row, (_, fact) in enumerate(queries)
+        )
+        recall[f"recall@{k}"] = round(hits / len(queries), 3)
+
+    tokens = [chunking.count_tokens(t) for t in texts]
+    return {
+        "scheme": name,
+        "chunks": len(texts),
+        "mean_tokens": round(float(np.mean(tokens)), 1),
+        "chunks_over_model_limit": sum(1 for t in tokens if t > chunking.CHUNK_TOKENS),
+        "chunk_time_s": round(chunk_time, 3),
+        "index_time_s": round(index_time, 3),
+        **recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash")
+    parser.add_argument("--max-seq-tokens", type=int, default=256,
+                        help="input truncation of the offline embedder")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    args = parser.parse_args()
+
+    page_texts, facts = common.synthetic_pages(args.pages)
+    rng = random.Random(1)
+    queries = []
+    for _, fact, query in rng.sample(facts, min(args.queries, len(facts))):
+        queries.append((query, fact))
+
+    encode = common.make_encoder(args.embedder, args.max_seq_tokens)
+    results = [
+        evaluate("words-1000/100", chunking.iter_word_chunks, page_texts, facts, encode, args.k, queries),
+        evaluate(f"tokens-{chunking.CHUNK_TOKENS}/{chunking.CHUNK_OVERLAP_TOKENS}", chunking.iter_chunks,
+                 page_texts, facts, encode, args.k, queries),
+    ]
+    print(json.dumps({"pages": args.pages, "queries": len(queries), "embedder": args.embedder,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Helpers shared by the benchmark scripts in this directory"""
+import hashlib
+import os
+import random
+import re
+import sys
+import textwrap
+
+import numpy as np
+
+# Benchmarks import the app modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+WORDS = ("account audit battery billing cable clause contract customer delivery device "
+         "engine filter firmware invoice license manual module network notice order panel "
+         "payment policy power pressure refund report safety sensor service shipment "
+         "storage supplier system terminal valve voltage warranty").split()
+
+
+def hash_embed(text: str, dim: int = 384, max_tokens: int = None) -> np.ndarray:
+    """Offline bag-of-words embedding, optionally truncated like the real model's input
+
+    Only catches shared words, not paraphrases; use the real model for quality numbers.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    words = re.findall(r"\w+", text.lower())
+    if max_tokens is not None:
+        words = words[:max_tokens]
+    for word in words:
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+def make_encoder(kind: str = "hash", max_seq_tokens: int = 256):
+    """texts -> float32 matrix from the offline hash embedder, or the app's model if kind is model"""
+    if kind == "model":
+        import rag_utils
+        return rag_utils.encode_chunks
+    return lambda texts: np.stack([hash_embed(t, dim=4096, max_tokens=max_seq_tokens) for t in texts])
+
+
+def rare_word(rng: random.Random) -> str:
+    return "".join(rng.choice("bcdfghjklmnprstvz") + rng.choice("aeiou") for _ in range(3))
+
+
+def fact_sentence(rng: random.Random, fact_id: int):
+    """A sentence with unique terms and a query that asks for it, so exactly one answer is right"""
+    first, second = rare_word(rng), rare_word(rng)
+    sentence = (f"The {first} {second} {rng.choice(WORDS)} has reference code QX{fact_id:05d} "
+                f"according to section {rng.randint(1, 40)}.{rng.randint(1, 20)}.")
+    return sentence, f"{first} {second}"
+
+
+def filler_sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+
+def synthetic_pages(pages: int, seed: int = 0, sentences_per_page: int = 40,
+                    facts_per_page: int = 3):
+    """Page texts plus the planted facts, as (pages, [(page, sentence, query)])"""
+    rng = random.Random(seed)
+    texts, facts = [], []
+    for page in range(1, pages + 1):
+        sentences = [filler_sentence(rng) for _ in range(sentences_per_page)]
+        for _ in range(facts_per_page):
+            fact, query = fact_sentence(rng, len(facts))
+            sentences.insert(rng.randrange(len(sentences) + 1), fact)
+            facts.append((page, fact, query))
+        paragraphs = [" ".join(sentences[i:i + 8]) for i in range(0, len(sentences), 8)]
+        texts.append("\n\n".join(paragraphs))
+    return texts, facts
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(page_texts) -> bytes:
+    """Minimal PDF with one Helvetica text page per string, wrapped to the page width"""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(page_texts))), len(page_texts)),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(page_texts):
+        lines = []
+        for paragraph in text.split("\n\n"):
+            lines.extend(textwrap.wrap(paragraph, 110) + [""])
+        content = "BT /F1 8 Tf 40 760 Td 10 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    parts = [b"%PDF-1.4\n"]
+    size = len(parts[0])
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(size)
+        parts.append(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1", "replace"))
+        size += len(parts[-1])
+    trailer = (f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+               + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+               + f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{size}\n%%EOF\n")
+    parts.append(trailer.encode("latin-1"))
+    return b"".join(parts)
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
@@ -0,0 +1,105 @@
+"""Follow-up retrieval with and without query rewriting, and conversation memory size over a long chat
+
+    python bench/conversation_bench.py                     # offline hash embedder
+    python bench/conversation_bench.py --embedder model --turns 500
+
+Each sampled fact gets a two-turn conversation: a question naming it, then a
+follow-up ("which section is it in?") that only makes sense after it. Reports the
+follow-up's hybrid recall@k searched as typed and after
+ConversationMemory.rewrite_query, and how often a standalone question about another
+fact would have been rewritten by mistake. Then a chat of --turns turns with the extractive
+summarizer records what the memory holds and what each prompt carries
+(prompt_history tokens) as the chat grows.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import common
+import chunking
+import conversation
+import lexical_index
+import retrieval
+
+FOLLOW_UPS = ["which section is it in?", "what is its reference code?", "what about the section?",
+              "and where is that defined?"]
+
+
+def recall(rankings, texts, facts, ks):
+    return {f"recall@{k}": round(sum(any(fact in texts[i] for i in ranking[:k])
+                                     for ranking, fact in zip(rankings, facts)) / len(facts), 3)
+            for k in ks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    page_texts, facts = common.synthetic_pages(args.pages)
+    stream = (f"\n=== Page {page} ===\n{text}" for page, text in enumerate(page_texts, 1))
+    texts = chunking.chunk_texts(chunking.iter_chunks(stream))
+    ids = [str(i) for i in range(len(texts))]
+    encode = common.make_encoder(args.embedder)
+    matrix = encode(texts)
+    builder = lexical_index.SegmentBuilder()
+    builder.add(ids, texts)
+    segments = [builder.build()]
+
+    def search(query):
+        scores = matrix @ encode([query])[0]
+        dense_ids = [ids[i] for i in np.argsort(-scores)[:retrieval.HYBRID_CANDIDATES]]
+        fused = retrieval.fuse(dense_ids, lexical_index.search(query, segments, retrieval.HYBRID_CANDIDATES),
+                               max(args.k))
+        return [int(i) for i in fused]
+
+    rng = random.Random(1)
+    sample = rng.sample(facts, min(args.queries, len(facts)))
+    typed, rewritten = [], []
+    false_rewrites = 0
+    for _, _, name in sample:
+        memory = conversation.ConversationMemory(summarizer=conversation.ExtractiveSummarizer())
+        memory.add(f"What does the document say about the {name}?", "It is described in the document.")
+        follow_up = rng.choice(FOLLOW_UPS)
+        typed.append(search(follow_up))
+        rewritten.append(search(memory.rewrite_query(follow_up)))
+        standalone = f"What does the document say about the {rng.choice(facts)[2]}?"
+        false_rewrites += memory.rewrite_query(standalone) != standalone
+    fact_sentences = [sentence for _, sentence, _ in sample]
+
+    memory = conversation.ConversationMemory(summarizer=conversation.ExtractiveSummarizer())
+    growth = []
+    checkpoints = {t for t in (1, 10, 50, 100, 200, 500, 1000) if t <= args.turns} | {args.turns}
+    add_times = []
+    for turn in range(1, args.turns + 1):
+        _, sentence, name = facts[turn % len(facts)]
+        start = time.perf_counter()
+        memory.add(f"What does the document say about the {name}?", f"According to the document: {sentence}")
+        add_times.append((time.perf_counter() - start) * 1000)
+        if turn in checkpoints:
+            growth.append({"turns": turn, "kept_turns": len(memory.history),
+                           "summary_tokens": chunking.count_tokens(memory.summary),
+                           "prompt_history_tokens": chunking.count_tokens(memory.prompt_history())})
+    add_times.sort()
+
+    print(json.dumps({
+        "embedder": args.embedder,
+        "follow_ups": len(sample),
+        "follow_up_recall": {"as_typed": recall(typed, texts, fact_sentences, args.k),
+                             "rewritten": recall(rewritten, texts, fact_sentences, args.k)},
+        "standalone_rewritten": round(false_rewrites / len(sample), 3),
+        "memory_growth": growth,
+        "add_ms_p50": round(common.percentile(add_times, 50), 3),
+        "add_ms_p95": round(common.percentile(add_times, 95), 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Compare the rag_utils embedding backends: throughput, cold start, memory and retrieval quality
+
+    python bench/embedding_backends_bench.py
+    python bench/embedding_backends_bench.py --backends torch onnx-int8 --pages 100
+
+Each backend runs in a fresh interpreter, so cold start covers imports and model
+loading. The corpus is synthetic pages with planted facts, chunked as the app does.
+Per backend it reports cold start, chunk encoding throughput, single-query latency,
+peak RSS, and recall@1/@3 of the fact queries (exact cosine search). It also reports
+the mean cosine similarity of each backend's chunk vectors to the first backend's.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import common
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+
+def corpus(pages: int, seed: int):
+    import chunking
+    page_texts, facts = common.synthetic_pages(pages, seed=seed)
+    text = "".join(f"\n=== Page {i} ===\n{page}" for i, page in enumerate(page_texts, 1))
+    chunks = chunking.chunk_texts(chunking.chunk_text(text))
+    queries = []
+    for _, sentence, query in facts:
+        relevant = {i for i, chunk in enumerate(chunks) if sentence in chunk}
+        if relevant:
+            queries.append((query, relevant))
+    return chunks, queries
+
+
+def run_backend(name: str, pages: int, seed: int, batch_size: int, vectors_path: str) -> dict:
+    """Runs inside the worker subprocess"""
+    start = time.perf_counter()
+    import embedding_backends
+    backend = embedding_backends.load_backend(name)
+    backend.encode(["warm up"])
+    cold_start = time.perf_counter() - start
+    rss_loaded = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    chunks, queries = corpus(pages, seed)
+    start = time.perf_counter()
+    vectors = backend.encode(chunks, batch_size=batch_size)
+    encode_s = time.perf_counter() - start
+    np.save(vectors_path, vectors)
+
+    query_times = []
+    query_vectors = []
+    for query, _ in queries:
+        start = time.perf_counter()
+        query_vectors.append(backend.encode([query])[0])
+        query_times.append(time.perf_counter() - start)
+
+    hits = {1: 0, 3: 0}
+    for (_, relevant), query_vector in zip(queries, query_vectors):
+        ranked = np.argsort(-(vectors @ query_vector))
+        for k in hits:
+            hits[k] += bool(relevant & set(ranked[:k].tolist()))
+
+    times = sorted(t * 1000 for t in query_times)
+    return {
+        "backend": name,
+        "chunks": len(chunks),
+        "cold_start_s": round(cold_start, 3),
+        "encode_chunks_per_s": round(len(chunks) / encode_s, 1),
+        "query_ms_p50": round(common.percentile(times, 50), 2),
+        "query_ms_p95": round(common.percentile(times, 95), 2),
+        "rss_after_load_mb": round(rss_loaded, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "recall_at_1": round(hits[1] / len(queries), 3) if queries else None,
+        "recall_at_3": round(hits[3] / len(queries), 3) if queries else None,
+    }
+
+
+def spawn(name: str, workdir: str, args) -> dict:
+    result_path = os.path.join(workdir, f"{name}.json")
+    command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--result", result_path,
+               "--vectors", os.path.join(workdir, f"{name}.npy"), "--pages", str(args.pages),
+               "--seed", str(args.seed), "--batch-size", str(args.batch_size)]
+    subprocess.run(command, env=dict(os.environ, EMBEDDING_BACKEND=name), check=True)
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--vectors", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_backend(args.worker, args.pages, args.seed, args.batch_size, args.vectors)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="embedding_bench_") as workdir:
+        results = [spawn(name, workdir, args) for name in args.backends]
+        reference = np.load(os.path.join(workdir, f"{args.backends[0]}.npy"))
+        for result in results:
+            vectors = np.load(os.path.join(workdir, f"{result['backend']}.npy"))
+            result[f"mean_cosine_to_{args.backends[0]}"] = round(float((vectors * reference).sum(axis=1).mean()), 5)
+
+    print(json.dumps({"pages": args.pages, "cpu_count": os.cpu_count(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Recall of dense-only, BM25-only and hybrid (RRF) retrieval, and BM25 query latency
+
+    python bench/hybrid_eval.py                        # synthetic corpus, offline embedder
+    python bench/hybrid_eval.py --pages 200 --embedder model
+
+Two query sets ask for planted fact sentences: "names" by their rare words and
+"identifiers" by their reference code (e.g. "reference code QX00042"), the kind of
+exact token dense models handle poorly. The offline hash embedder sees identifiers
+as ordinary words, so it understates the hybrid gain; --embedder model uses
+all-MiniLM-L6-v2 as the app does.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import common
+import chunking
+import lexical_index
+import retrieval
+
+
+def recall(rankings, texts, queries, ks):
+    return {
+        f"recall@{k}": round(sum(
+            any(fact in texts[chunk] for chunk in ranking[:k])
+            for ranking, (_, fact) in zip(rankings, queries)
+        ) / len(queries), 3)
+        for k in ks
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash")
+    parser.add_argument("--candidates", type=int, default=retrieval.HYBRID_CANDIDATES)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    args = parser.parse_args()
+
+    page_texts, facts = common.synthetic_pages(args.pages)
+    stream = (f"\n=== Page {page} ===\n{text}" for page, text in enumerate(page_texts, 1))
+    texts = chunking.chunk_texts(chunking.iter_chunks(stream))
+    ids = [str(i) for i in range(len(texts))]
+    encode = common.make_encoder(args.embedder)
+    matrix = encode(texts)
+
+    builder = lexical_index.SegmentBuilder()
+    builder.add(ids, texts)
+    segments = [builder.build()]
+
+    sample = random.Random(1).sample(list(enumerate(facts)), min(args.queries, len(facts)))
+    query_sets = {
+        "names": [(query, fact) for _, (_, fact, query) in sample],
+        "identifiers": [(f"reference code QX{fact_id:05d}", fact) for fact_id, (_, fact, _) in sample],
+    }
+
+    results = {}
+    lexical_latencies = []
+    for set_name, queries in query_sets.items():
+        query_matrix = encode([query for query, _ in queries])
+        dense, lexical, hybrid = [], [], []
+        for row, (query, _) in enumerate(queries):
+            scores = matrix @ query_matrix[row]
+            dense_ids = [ids[i] for i in np.argsort(-scores)[:args.candidates]]
+            start = time.perf_counter()
+            lexical_results = lexical_index.search(query, segments, args.candidates)
+            lexical_latencies.append((time.perf_counter() - start) * 1000)
+            fused = retrieval.fuse(dense_ids, lexical_results, args.candidates)
+            dense.append([int(i) for i in dense_ids])
+            lexical.append([int(chunk_id) for chunk_id, _ in lexical_results])
+            hybrid.append([int(i) for i in fused])
+        results[set_name] = {
+            "dense": recall(dense, texts, queries, args.k),
+            "bm25": recall(lexical, texts, queries, args.k),
+            "hybrid": recall(hybrid, texts, queries, args.k),
+        }
+
+    lexical_latencies.sort()
+    print(json.dumps({
+        "pages": args.pages,
+        "chunks": len(texts),
+        "queries_per_set": len(sample),
+        "embedder": args.embedder,
+        "results": results,
+        "bm25_ms_p50": round(common.percentile(lexical_latencies, 50), 3),
+        "bm25_ms_p95": round(common.percentile(lexical_latencies, 95), 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
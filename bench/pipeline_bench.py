@@ -0,0 +1,251 @@
+"""End-to-end pipeline benchmark: extract -> chunk -> embed and store -> retrieve -> answer
+
+    python bench/pipeline_bench.py                                  # both backends, synthetic PDFs
+    python bench/pipeline_bench.py --sizes 10 50 200 --output bench/baseline.json
+    python bench/pipeline_bench.py --baseline bench/baseline.json   # compare, exit 1 on regression
+    python bench/pipeline_bench.py --corpus ~/pdfs --backends rag_utils
+
+Each backend runs in its own subprocess against a temporary Chroma directory, with
+LLM_BACKEND=stub standing in for Gemini and the answer cache disabled, so only this
+project's code is measured. Queries are sentences sampled from the indexed chunks.
+Reports extraction pages/sec, chunking and embedding chunks/sec, p50/p95/p99 latency
+of retrieve_relevant_chunks and of a full question (retrieve_context + answer_question),
+and peak RSS, as JSON.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+
+BACKENDS = ["rag_utils", "rag_utils_simple"]
+
+# Metrics compared against a baseline: name -> True if higher is better
+COMPARED = {
+    "extract_pages_per_s": True,
+    "chunk_chunks_per_s": True,
+    "embed_chunks_per_s": True,
+    "ingest_pages_per_s": True,
+    "retrieve_ms.p50": False,
+    "retrieve_ms.p95": False,
+    "retrieve_ms.p99": False,
+    "ask_ms.p50": False,
+    "ask_ms.p95": False,
+    "ask_ms.p99": False,
+    "peak_rss_mb": False,
+}
+
+
+def latency_summary(seconds) -> dict:
+    values = sorted(s * 1000 for s in seconds)
+    return {
+        "p50": round(common.percentile(values, 50), 2),
+        "p95": round(common.percentile(values, 95), 2),
+        "p99": round(common.percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+    }
+
+
+def run_backend(backend: str, pdf_paths, queries: int, top_k: int, seed: int) -> dict:
+    """Runs inside the worker subprocess; the environment is already isolated"""
+    import chunking
+    import ingest_cache
+    import pdf_utils
+    module = importlib.import_module(backend)
+
+    start = time.perf_counter()
+    module.embed_query("warm up")
+    model_load = time.perf_counter() - start
+
+    documents = []
+    all_chunks = []
+    for path in pdf_paths:
+        with open(path, "rb") as f:
+            doc_id = ingest_cache.document_hash(f.read())
+        start = time.perf_counter()
+        text = pdf_utils.extract_text_from_pdf(path)
+        extracted = time.perf_counter()
+        chunks = chunking.chunk_text(text)
+        chunked = time.perf_counter()
+        module.embed_and_store(chunks, doc_id=doc_id, name=os.path.basename(path))
+        stored = time.perf_counter()
+        documents.append({
+            "name": os.path.basename(path),
+            "pages": len(chunking.PAGE_MARKER.findall(text or "")),
+            "chunks": len(chunks),
+            "extract_s": round(extracted - start, 4),
+            "chunk_s": round(chunked - extracted, 4),
+            "embed_s": round(stored - chunked, 4),
+        })
+        all_chunks.extend(chunking.chunk_texts(chunks))
+
+    # Distinct sentences from the corpus, so neither query cache is hit
+    rng = random.Random(seed)
+    sentences = list(dict.fromkeys(
+        sentence for chunk in rng.sample(all_chunks, min(len(all_chunks), 2 * queries))
+        for sentence in re.split(r"(?<=[.!?])\s+", chunk)[:1] if len(sentence.split()) >= 4
+    ))
+    retrieve_queries = sentences[:queries]
+    ask_queries = [f"What does the document say about: {s}" for s in sentences[queries:2 * queries] or sentences]
+
+    retrieve_times = []
+    for query in retrieve_queries:
+        start = time.perf_counter()
+        module.retrieve_relevant_chunks(query, top_k=top_k)
+        retrieve_times.append(time.perf_counter() - start)
+
+    ask_times = []
+    for query in ask_queries[:queries]:
+        start = time.perf_counter()
+        context = module.retrieve_context(query, top_k=top_k)
+        module.answer_question(query, context)
+        ask_times.append(time.perf_counter() - start)
+
+    pages = sum(d["pages"] for d in documents)
+    chunks = sum(d["chunks"] for d in documents)
+    extract_s = sum(d["extract_s"] for d in documents)
+    chunk_s = sum(d["chunk_s"] for d in documents)
+    embed_s = sum(d["embed_s"] for d in documents)
+    return {
+        "backend": backend,
+        "documents": documents,
+        "pages": pages,
+        "chunks": chunks,
+        "model_load_s": round(model_load, 3),
+        "extract_pages_per_s": round(pages / extract_s, 2) if extract_s else 0.0,
+        "chunk_chunks_per_s": round(chunks / chunk_s, 2) if chunk_s else 0.0,
+        "embed_chunks_per_s": round(chunks / embed_s, 2) if embed_s else 0.0,
+        "ingest_pages_per_s": round(pages / (extract_s + chunk_s + embed_s), 2) if pages else 0.0,
+        "retrieve_ms": latency_summary(retrieve_times),
+        "ask_ms": latency_summary(ask_times),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def build_corpus(sizes, directory: str):
+    paths = []
+    for i, pages in enumerate(sizes):
+        page_texts, _ = common.synthetic_pages(pages, seed=i)
+        path = os.path.join(directory, f"synthetic_{i}_{pages}p.pdf")
+        with open(path, "wb") as f:
+            f.write(common.make_pdf(page_texts))
+        paths.append(path)
+    return paths
+
+
+def spawn(backend: str, pdf_paths, workdir: str, args) -> dict:
+    """Run one backend in a fresh interpreter with its own Chroma directory and caches"""
+    result_path = os.path.join(workdir, f"{backend}.json")
+    env = dict(
+        os.environ,
+        CHROMA_PATH=os.path.join(workdir, f"chroma_{backend}"),
+        ANSWER_CACHE_PATH=os.path.join(workdir, f"answers_{backend}.db"),
+        ANSWER_CACHE_THRESHOLD="2",
+        LLM_BACKEND="stub",
+        LLM_STUB_LATENCY=str(args.llm_latency),
+        LLM_STUB_CHUNK_DELAY="0",
+        ANONYMIZED_TELEMETRY="False",
+    )
+    command = [sys.executable, os.path.abspath(__file__), "--worker", backend,
+               "--result", result_path, "--queries", str(args.queries), "--top-k", str(args.top_k),
+               "--seed", str(args.seed), "--pdfs", *pdf_paths]
+    subprocess.run(command, env=env, check=True)
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def _metric(result: dict, name: str):
+    value = result
+    for part in name.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current: dict, baseline: dict, tolerance: float):
+    """Print metric changes against the baseline; returns the regressions beyond tolerance"""
+    regressions = []
+    for backend, result in current["results"].items():
+        previous = baseline.get("results", {}).get(backend)
+        if previous is None:
+            print(f"{backend}: not in baseline")
+            continue
+        for name, higher_is_better in COMPARED.items():
+            new, old = _metric(result, name), _metric(previous, name)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            print(f"{backend:18s} {name:22s} {old:>10.2f} -> {new:>10.2f} ({change:+.1%}) {flag}")
+            if flag:
+                regressions.append((backend, name, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 80],
+                        help="pages per synthetic PDF")
+    parser.add_argument("--corpus", help="directory of PDFs to use instead of synthetic ones")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub model latency (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="relative change counted as a regression")
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--pdfs", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_backend(args.worker, args.pdfs, args.queries, args.top_k, args.seed)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="pipeline_bench_") as workdir:
+        if args.corpus:
+            pdf_paths = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus)
+                               if name.lower().endswith(".pdf"))
+        else:
+            pdf_paths = build_corpus(args.sizes, workdir)
+        results = {backend: spawn(backend, pdf_paths, workdir, args) for backend in args.backends}
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "corpus": args.corpus or {"synthetic_pages": args.sizes},
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Query embedding throughput with and without micro-batching, by number of concurrent users
+
+    python bench/query_batching_bench.py                          # the app's model
+    python bench/query_batching_bench.py --encoder random-minilm  # offline, same architecture
+    python bench/query_batching_bench.py --users 1 8 32 --wait-ms 2 --batch-size 32
+
+Each user is a thread embedding distinct queries back to back for --duration seconds,
+either by calling the model once per query (as before batching) or through a shared
+QueryBatcher. random-minilm is a randomly initialised all-MiniLM-L6-v2-shaped BERT
+with hashed token ids, for measuring speed where the model can't be downloaded.
+Prints queries/sec, latency percentiles and mean batch size per mode as JSON.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+
+import common
+from query_batcher import QueryBatcher
+
+
+def random_minilm():
+    """texts -> embeddings from a 6-layer, 384-wide BERT with random weights"""
+    import torch
+    import transformers
+    config = transformers.BertConfig(hidden_size=384, num_hidden_layers=6, num_attention_heads=12,
+                                     intermediate_size=1536)
+    model = transformers.BertModel(config).eval()
+
+    def encode(texts):
+        ids = [[101] + [int(hashlib.md5(word.encode()).hexdigest(), 16) % 28000 + 1000
+                        for word in text.lower().split()][:254] + [102] for text in texts]
+        length = max(len(row) for row in ids)
+        input_ids = torch.tensor([row + [0] * (length - len(row)) for row in ids])
+        mask = (input_ids != 0).long()
+        with torch.inference_mode():
+            hidden = model(input_ids=input_ids, attention_mask=mask).last_hidden_state
+        pooled = (hidden * mask[..., None]).sum(1) / mask.sum(1, keepdim=True)
+        return torch.nn.functional.normalize(pooled, dim=1).numpy()
+
+    return encode
+
+
+def make_encoder(kind: str):
+    if kind == "random-minilm":
+        return random_minilm()
+    if kind == "hash":
+        return common.make_encoder("hash")
+    import rag_utils
+    model = rag_utils.get_model()
+    return lambda texts: model.encode(texts, batch_size=len(texts))
+
+
+def queries(seed: int):
+    rng = random.Random(seed)
+    while True:
+        words = [rng.choice(common.WORDS) for _ in range(rng.randint(5, 12))] + [common.rare_word(rng)]
+        yield "what does the " + " ".join(words) + " say"
+
+
+def run(embed, users: int, duration: float, seed: int) -> dict:
+    """Embed distinct queries from `users` threads for `duration` seconds"""
+    source = queries(seed)
+    source_lock = threading.Lock()
+    latencies = []
+    latencies_lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def user():
+        mine = []
+        while time.monotonic() < stop:
+            with source_lock:
+                query = next(source)
+            start = time.perf_counter()
+            embed(query)
+            mine.append(time.perf_counter() - start)
+        with latencies_lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=user) for _ in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    values = sorted(s * 1000 for s in latencies)
+    return {
+        "queries": len(values),
+        "queries_per_s": round(len(values) / elapsed, 1),
+        "p50_ms": round(common.percentile(values, 50), 2),
+        "p95_ms": round(common.percentile(values, 95), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--encoder", choices=["model", "random-minilm", "hash"], default="model")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--wait-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    encode = make_encoder(args.encoder)
+    encode(["warm up"])
+    results = []
+    seeds = itertools.count(args.seed)
+    for users in args.users:
+        single = run(lambda text: encode([text])[0], users, args.duration, next(seeds))
+        batcher = QueryBatcher(encode, max_batch=args.batch_size, max_wait_ms=args.wait_ms)
+        batched = run(batcher.encode, users, args.duration, next(seeds))
+        batched["mean_batch_size"] = round(batcher.stats()["mean_batch_size"], 2)
+        results.append({
+            "users": users,
+            "unbatched": single,
+            "batched": batched,
+            "speedup": round(batched["queries_per_s"] / single["queries_per_s"], 2) if single["queries_per_s"] else None,
+        })
+    print(json.dumps({"encoder": args.encoder, "batch_size": args.batch_size, "wait_ms": args.wait_ms,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
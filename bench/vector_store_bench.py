@@ -0,0 +1,98 @@
+"""Exact index vs Chroma: build time, query latency and recall by index size
+
+    python bench/vector_store_bench.py
+    python bench/vector_store_bench.py --sizes 500 2000 10000 --queries 200 --top-k 20
+
+For each size, a document of random normalized 384-dimensional chunk vectors is
+written through ExactStore and ChromaStore in a temporary CHROMA_PATH, then queried
+with noisy copies of its own vectors (unfiltered; a doc_id filter only slows Chroma).
+Reports build seconds, the first query (which opens the freshly written index), query
+latency percentiles and Chroma's recall@k against the exact result, plus the smallest
+size at which Chroma's median query is faster (the crossover, a guide for
+EXACT_INDEX_MAX_CHUNKS).
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import common
+
+
+def timed_queries(store, queries: np.ndarray, top_k: int):
+    results, times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = store.query(query, top_k)
+        times.append((time.perf_counter() - start) * 1000)
+        results.append([chunk_id for chunk_id, _, _, _ in hits])
+    return results, sorted(times)
+
+
+def run_size(size: int, args, rng: np.random.Generator) -> dict:
+    import exact_index
+    import vector_store
+
+    vectors = exact_index.normalize(rng.standard_normal((size, args.dim)))
+    picks = rng.integers(0, size, args.queries)
+    queries = exact_index.normalize(vectors[picks] + 0.5 * rng.standard_normal((args.queries, args.dim)) / np.sqrt(args.dim))
+    ids = [f"chunk-{i}" for i in range(size)]
+    texts = [f"text of chunk {i}" for i in range(size)]
+    doc_id = f"doc-{size}"
+    metadatas = [{"doc_id": doc_id, "chunk": i} for i in range(size)]
+
+    stores = {
+        "exact": exact_index.ExactStore(f"bench-{size}"),
+        "chroma": vector_store.ChromaStore(vector_store.get_collection(f"bench-{size}")),
+    }
+    result = {"chunks": size}
+    rankings = {}
+    for name, store in stores.items():
+        start = time.perf_counter()
+        for begin in range(0, size, vector_store.CHROMA_BATCH_SIZE):
+            end = begin + vector_store.CHROMA_BATCH_SIZE
+            store.add(doc_id, ids[begin:end], vectors[begin:end], texts[begin:end], metadatas[begin:end])
+        store.commit(doc_id)
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        store.query(queries[0], args.top_k)
+        first_query_ms = (time.perf_counter() - start) * 1000
+        rankings[name], times = timed_queries(store, queries, args.top_k)
+        result[name] = {
+            "build_s": round(build_s, 3),
+            "query_ms_p50": round(common.percentile(times, 50), 3),
+            "query_ms_p95": round(common.percentile(times, 95), 3),
+            "first_query_ms": round(first_query_ms, 3),
+        }
+    overlap = [len(set(a) & set(e)) / len(e) for a, e in zip(rankings["chroma"], rankings["exact"])]
+    result["chroma"][f"recall_at_{args.top_k}"] = round(float(np.mean(overlap)), 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000, 10000, 20000, 50000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--no-mmap", action="store_true", help="load exact indexes into memory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="vector_store_bench_") as workdir:
+        os.environ["CHROMA_PATH"] = workdir
+        os.environ["EXACT_INDEX_MMAP"] = "0" if args.no_mmap else "1"
+        rng = np.random.default_rng(args.seed)
+        results = [run_size(size, args, rng) for size in args.sizes]
+
+    crossover = next((r["chunks"] for r in results
+                      if r["chroma"]["query_ms_p50"] < r["exact"]["query_ms_p50"]), None)
+    print(json.dumps({"dim": args.dim, "top_k": args.top_k, "mmap": not args.no_mmap,
+                      "crossover_chunks": crossover, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
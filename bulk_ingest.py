@@ -0,0 +1,246 @@
+"""Index a directory of PDFs from the command line
+
+    python bulk_ingest.py ./papers                      # into the default tenant
+    python bulk_ingest.py ./papers --tenant alice --backend rag_utils --workers 8
+
+Every *.pdf under the directory is hashed and its pages extracted on a pool of
+--workers processes, while this process chunks, embeds and stores the documents as
+they come back (the usual embed_and_store, so embeddings go in batches and already
+indexed documents are reused). Each file's outcome is checkpointed in
+chroma_db/bulk_ingest.sqlite3, so an interrupted run picks up where it stopped;
+files that failed, or changed since, are tried again. Progress is logged every few
+seconds and the end-to-end pages/sec and chunks/sec are printed at the end.
+
+Like ingestion jobs, indexing takes the runner lock (see ingest_jobs), so it won't
+run while an app server is indexing into the same CHROMA_PATH. Raise
+CHROMA_DISK_BUDGET_MB before preloading a large corpus, or the oldest documents are
+evicted to make room for the newest.
+"""
+import argparse
+import concurrent.futures
+import importlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Iterator, List, Optional
+
+import ingest_cache
+import ingest_jobs
+import pdf_utils
+import vector_store
+from chunking import iter_chunks
+from vector_store import DEFAULT_TENANT
+
+try:
+    import fcntl
+except ImportError:  # Windows: no runner lock
+    fcntl = None
+
+CHECKPOINT_DB_PATH = os.path.join(vector_store.CHROMA_PATH, "bulk_ingest.sqlite3")
+
+# Seconds between progress lines
+REPORT_INTERVAL = 5.0
+
+FILE_COLUMNS = ("tenant", "path", "size", "mtime_ns", "doc_id", "state", "pages", "chunks", "error",
+                "finished_at")
+
+
+def _connect(path: str = CHECKPOINT_DB_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    # state is done or failed; size and mtime_ns tell whether the file changed since
+    conn.execute('''CREATE TABLE IF NOT EXISTS files
+                    (tenant TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, doc_id TEXT,
+                     state TEXT, pages INTEGER, chunks INTEGER, error TEXT, finished_at REAL,
+                     PRIMARY KEY (tenant, path))''')
+    return conn
+
+
+def find_pdfs(root: str) -> List[str]:
+    """Absolute paths of the PDFs under root, in a stable order"""
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        paths.extend(os.path.join(directory, name) for name in sorted(files) if name.lower().endswith(".pdf"))
+    return [os.path.abspath(path) for path in paths]
+
+
+def pending_files(paths: List[str], tenant: str, conn) -> List[str]:
+    """The paths not already indexed by an earlier run, unchanged since"""
+    done = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in conn.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE tenant=? AND state='done'", (tenant,)
+        )
+    }
+    pending = []
+    for path in paths:
+        stat = os.stat(path)
+        if done.get(path) != (stat.st_size, stat.st_mtime_ns):
+            pending.append(path)
+    return pending
+
+
+def extract(path: str, tenant: str) -> dict:
+    """Runs in a pool worker: hash the file and, unless it is already indexed, extract its pages"""
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    doc_id = ingest_cache.document_hash(data)
+    pages = None
+    if not ingest_cache.get_document(doc_id, tenant):
+        pages = [f"\n=== Page {page_num} ===\n{text}"
+                 for page_num, text in pdf_utils.iter_pdf_pages(io.BytesIO(data), workers=1)]
+    return {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "doc_id": doc_id, "pages": pages}
+
+
+def _extract_all(executor, paths: List[str], tenant: str, window: int) -> Iterator[tuple]:
+    """(path, extract() result or exception) as files finish, keeping at most window in flight"""
+    paths = iter(paths)
+    futures = {}
+    while True:
+        while len(futures) < window:
+            path = next(paths, None)
+            if path is None:
+                break
+            futures[executor.submit(extract, path, tenant)] = path
+        if not futures:
+            return
+        finished, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            path = futures.pop(future)
+            try:
+                yield path, future.result()
+            except Exception as e:
+                yield path, e
+
+
+class Stats:
+    """Running totals of a bulk run, for progress lines and the final report"""
+
+    def __init__(self, files: int):
+        self.files = files
+        self.indexed = 0
+        self.reused = 0
+        self.failed = 0
+        self.pages = 0
+        self.chunks = 0
+        self.start = time.perf_counter()
+        self.reported = time.monotonic()
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        return {
+            "files": self.files,
+            "indexed": self.indexed,
+            "reused": self.reused,
+            "failed": self.failed,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "seconds": round(elapsed, 2),
+            "pages_per_s": round(self.pages / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_s": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def maybe_report(self):
+        if time.monotonic() - self.reported < REPORT_INTERVAL:
+            return
+        self.reported = time.monotonic()
+        s = self.summary()
+        logging.info(f"{s['indexed'] + s['reused'] + s['failed']}/{s['files']} files, "
+                     f"{s['pages_per_s']} pages/s, {s['chunks_per_s']} chunks/s")
+
+
+def _record(conn, tenant: str, result: dict, state: str, pages: int = 0, chunks: int = 0,
+            error: Optional[str] = None):
+    conn.execute(f"INSERT OR REPLACE INTO files ({', '.join(FILE_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                 (tenant, result["path"], result.get("size"), result.get("mtime_ns"), result.get("doc_id"),
+                  state, pages, chunks, error, time.time()))
+    conn.commit()
+
+
+def _take_runner_lock():
+    """Take ingest_jobs' runner lock, or fail if a server process holds it"""
+    os.makedirs(vector_store.CHROMA_PATH, exist_ok=True)
+    lock = open(ingest_jobs.RUNNER_LOCK_PATH, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise Exception("Another process is indexing into this CHROMA_PATH; stop the app server first")
+    return lock
+
+
+def ingest_directory(root: str, tenant: str = DEFAULT_TENANT, backend: str = "rag_utils_simple",
+                     workers: Optional[int] = None, checkpoint: str = CHECKPOINT_DB_PATH) -> dict:
+    """Index every PDF under root that an earlier run didn't finish, and return the run's totals"""
+    workers = workers or os.cpu_count() or 1
+    lock = _take_runner_lock()
+    conn = _connect(checkpoint)
+    try:
+        paths = find_pdfs(root)
+        pending = pending_files(paths, tenant, conn)
+        logging.info(f"{len(paths)} PDFs under {root}, {len(paths) - len(pending)} already indexed")
+        stats = Stats(len(pending))
+        module = importlib.import_module(backend)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, result in _extract_all(executor, pending, tenant, window=2 * workers):
+                name = os.path.relpath(path, root)
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to extract {name}: {result}")
+                    stats.failed += 1
+                    _record(conn, tenant, {"path": path}, "failed", error=str(result))
+                    continue
+                if result["pages"] is None:
+                    ingest_cache.touch_document(result["doc_id"], tenant)
+                    stats.reused += 1
+                    _record(conn, tenant, result, "done")
+                    continue
+                chunk_count = 0
+
+                def chunks():
+                    nonlocal chunk_count
+                    for chunk in iter_chunks(iter(result["pages"])):
+                        chunk_count += 1
+                        yield chunk
+
+                try:
+                    module.embed_and_store(chunks(), doc_id=result["doc_id"], name=name, tenant=tenant)
+                except Exception as e:
+                    logging.error(f"Failed to index {name}: {e}")
+                    stats.failed += 1
+                    _record(conn, tenant, result, "failed", error=str(e))
+                    continue
+                stats.indexed += 1
+                stats.pages += len(result["pages"])
+                stats.chunks += chunk_count
+                _record(conn, tenant, result, "done", len(result["pages"]), chunk_count)
+                stats.maybe_report()
+        return stats.summary()
+    finally:
+        lock.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="searched recursively for *.pdf")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT, help="username whose collection receives the documents")
+    parser.add_argument("--backend", choices=["rag_utils_simple", "rag_utils"], default="rag_utils_simple",
+                        help="pipeline whose embeddings the app will query with (app.py uses rag_utils_simple)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PDF extraction processes")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_DB_PATH, help="SQLite file recording finished files")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    print(json.dumps(ingest_directory(args.directory, args.tenant, args.backend, args.workers, args.checkpoint),
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import time
 import streamlit as st
-from pdf_utils import extract_text_from_pdf
-from rag_utils import chunk_text, embed_and_store, retrieve_relevant_chunks, answer_question
+from rag_utils import retrieve_context, answer_question_stream
+import conversation
+import ingest_cache
+import ingest_jobs
+import metrics
 
 # --- Custom CSS for Gen Z animated UI ---
 st.markdown("""
@@ -55,7 +59,7 @@ with st.sidebar:
     
     # Clear chat button
     if st.button("🗑️ Clear Chat", type="secondary", use_container_width=True):
-        st.session_state.chat_history = []
+        st.session_state.memory = conversation.ConversationMemory()
         st.rerun()
     
     st.info("Powered by Python, LangChain, ChromaDB, and Gemini.")
@@ -65,22 +69,45 @@ st.markdown('<div class="header">🤖 PDF Chatbot </div>', unsafe_allow_html=Tru
 st.markdown('<div class="subheader">Ask questions about your PDF and get instant, AI-powered answers.</div>', unsafe_allow_html=True)
 
 # --- Session state for chat history and PDF processing ---
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+if "memory" not in st.session_state:
+    # Recent turns plus a rolling summary; bounded however long the chat runs
+    st.session_state.memory = conversation.ConversationMemory()
 if "pdf_processed" not in st.session_state:
     st.session_state.pdf_processed = False
 if "pdf_name" not in st.session_state:
     st.session_state.pdf_name = ""
+if "doc_id" not in st.session_state:
+    st.session_state.doc_id = None
 
-# --- PDF Processing ---
-if uploaded_file and not st.session_state.pdf_processed:
-    with st.spinner("✨ Extracting and indexing your PDF..."):
-        text = extract_text_from_pdf(uploaded_file)
-        chunks = chunk_text(text)
-        embed_and_store(chunks)
-        st.session_state.pdf_processed = True
-        st.session_state.pdf_name = uploaded_file.name
-        st.success("PDF processed! Start chatting below.")
+# --- PDF Processing in a background job (skipped when the same file was already indexed) ---
+# Jobs interrupted by a server restart carry on
+ingest_jobs.resume()
+# Only jobs this session submitted are followed; other visitors share the default tenant
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None
+doc_id = ingest_cache.document_hash(uploaded_file.getvalue()) if uploaded_file else None
+if uploaded_file and doc_id not in (st.session_state.doc_id, st.session_state.get("job_doc_id")):
+    try:
+        st.session_state.job_id = ingest_jobs.submit(uploaded_file.getvalue(), uploaded_file.name, backend="rag_utils")
+        st.session_state.job_doc_id = doc_id
+    except Exception as e:
+        st.error(str(e))
+
+job = ingest_jobs.get_job(st.session_state.job_id) if st.session_state.job_id else None
+if job and job["state"] == "done":
+    st.session_state.job_id = None
+    st.session_state.doc_id = job["doc_id"]
+    st.session_state.pdf_processed = True
+    st.session_state.pdf_name = job["name"]
+    st.success("PDF processed! Start chatting below.")
+elif job and job["state"] == "failed":
+    st.session_state.job_id = None
+    st.error(f"Failed to process {job['name']}: {job['error']}")
+elif job:
+    total = job["pages_total"]
+    st.progress(job["pages_done"] / total if total else 0.0,
+                text=f"✨ Extracting and indexing {job['name']}: {job['pages_done']}/{total or '?'} pages, "
+                     f"{job['chunks_done']} chunks")
 
 # --- Show PDF status ---
 if st.session_state.pdf_processed:
@@ -100,22 +127,28 @@ if st.session_state.pdf_processed:
         submitted = st.form_submit_button("Send", use_container_width=True)
         
         if submitted and user_input:
-            with st.spinner("🤖 Thinking..."):
-                try:
-                    context = " ".join(retrieve_relevant_chunks(user_input))
-                    answer = answer_question(user_input, context)
-                except Exception as e:
-                    answer = "Sorry, something went wrong while processing your question."
-                    st.error(f"Error: {e}")
-                
-                st.session_state.chat_history.append(("user", user_input))
-                st.session_state.chat_history.append(("bot", answer))
-                st.rerun()
+            try:
+                # METRICS_PROFILE=cpu or memory profiles this question
+                with metrics.capture(name="question"):
+                    memory = st.session_state.memory
+                    with st.spinner("🤖 Thinking..."):
+                        # Follow-ups like "what about section 4?" are searched with the previous question
+                        context = retrieve_context(memory.rewrite_query(user_input), doc_id=st.session_state.doc_id)
+                    # Show the answer token by token as Gemini streams it
+                    answer = st.write_stream(answer_question_stream(user_input, context, memory.prompt_history()))
+            except Exception as e:
+                answer = "Sorry, something went wrong while processing your question."
+                st.error(f"Error: {e}")
+            
+            st.session_state.memory.add(user_input, answer)
+            st.rerun()
 
     # --- Display chat history as animated chat bubbles ---
     # This should be outside the if user_input block!
-    # So it always shows the chat history
-    for idx, (sender, message) in enumerate(st.session_state.chat_history):
+    # So it always shows the chat history (the last CHAT_HISTORY_TURNS turns)
+    messages = [(sender, message) for turn in st.session_state.memory.history
+                for sender, message in (("user", turn.question), ("bot", turn.answer))]
+    for idx, (sender, message) in enumerate(messages):
         st.markdown(
             f"""
             <div class="chat-bubble {'user-bubble' if sender == 'user' else 'bot-bubble'}" style="animation-delay: {0.1*idx}s;">
@@ -128,4 +161,9 @@ else:
     st.info("Please upload a PDF to get started.")
 
 # --- Footer ---
-st.markdown('<div class="footer">Made with 💜 by <b>Afra Falakh</b> &middot; AIML Engineer </div>', unsafe_allow_html=True)
\ No newline at end of file
+st.markdown('<div class="footer">Made with 💜 by <b>Afra Falakh</b> &middot; AIML Engineer </div>', unsafe_allow_html=True)
+
+# --- Poll the running ingestion job ---
+if job and job["state"] in ingest_jobs.ACTIVE_STATES:
+    time.sleep(1)
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""Chunking of extracted PDF text into pieces the embedding model can see in full
+
+all-MiniLM-L6-v2 truncates its input at 256 word pieces, so chunks are sized in model
+tokens rather than words. Chunks never cross the '=== Page N ===' markers emitted by
+pdf_utils, break at paragraph and then sentence boundaries where possible, and carry
+their page number so it can be stored as chunk metadata.
+"""
+import logging
+import math
+import os
+import re
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Union
+
+import embedding_backends
+import metrics
+import resources
+
+# Model input limit is 256 tokens including [CLS] and [SEP]
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "254"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+PAGE_MARKER = re.compile(r"=== Page (\d+) ===")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+WORD_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+class Chunk(NamedTuple):
+    text: str
+    page: Optional[int] = None
+
+
+def _load_tokenizer():
+    # Only the tokenizer.json already shipped with the embedding model: chunking
+    # never waits on the network
+    path = embedding_backends.local_tokenizer_path()
+    if path is None:
+        logging.warning("No local tokenizer.json for the embedding model; estimating token counts")
+        return False
+    try:
+        tokenizers = resources.lazy_import("tokenizers")
+        return tokenizers.Tokenizer.from_file(path)
+    except Exception as e:
+        logging.warning(f"Tokenizer unavailable ({e}); estimating token counts")
+        return False
+
+
+def count_tokens(text: str) -> int:
+    """Number of model word pieces in text, without the [CLS]/[SEP] specials"""
+    tokenizer = resources.get_resource("chunk_tokenizer", _load_tokenizer)
+    if tokenizer:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    # WordPiece keeps common words whole and splits rare ones into ~4 character pieces
+    return sum(1 if len(piece) <= 6 else math.ceil(len(piece) / 4)
+               for piece in WORD_PIECES.findall(text))
+
+
+def _split_long(sentence: str, max_tokens: int) -> List[str]:
+    """Break a sentence longer than max_tokens into word runs that fit"""
+    pieces, current, current_tokens = [], [], 0
+    for word in sentence.split():
+        tokens = count_tokens(word)
+        if current and current_tokens + tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(word)
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _page_units(text: str, max_tokens: int) -> Iterator[tuple]:
+    """(sentence, tokens, starts_paragraph) for a page, each sentence at most max_tokens"""
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        first = True
+        for sentence in SENTENCE_END.split(paragraph):
+            tokens = count_tokens(sentence)
+            parts = [sentence] if tokens <= max_tokens else _split_long(sentence, max_tokens)
+            for part in parts:
+                yield part, tokens if len(parts) == 1 else count_tokens(part), first
+                first = False
+
+
+def chunk_page(text: str, page: Optional[int] = None, max_tokens: int = CHUNK_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Chunk]:
+    """Pack one page's sentences into chunks of at most max_tokens
+
+    A chunk is closed early at a paragraph break once it is half full, and the next
+    chunk starts with up to overlap_tokens of the previous chunk's trailing sentences.
+    """
+    current, current_tokens = [], 0
+    for sentence, tokens, starts_paragraph in _page_units(text, max_tokens):
+        overflow = current_tokens + tokens > max_tokens
+        paragraph_break = starts_paragraph and current_tokens >= max_tokens // 2
+        if current and (overflow or paragraph_break):
+            yield Chunk(" ".join(s for s, _ in current), page)
+            carried, carried_tokens = [], 0
+            if not paragraph_break or overflow:
+                for s, t in reversed(current):
+                    if carried_tokens + t > overlap_tokens or carried_tokens + t + tokens > max_tokens:
+                        break
+                    carried.insert(0, (s, t))
+                    carried_tokens += t
+            current, current_tokens = carried, carried_tokens
+        current.append((sentence, tokens))
+        current_tokens += tokens
+    if current:
+        yield Chunk(" ".join(s for s, _ in current), page)
+
+
+def iter_pages(text: Union[str, Iterable[str]]) -> Iterator[tuple]:
+    """Split text (or a stream of text pieces) into (page_number, page_text) at page markers
+
+    A page is yielded as soon as the marker of the next page arrives; text before the
+    first marker (or without markers) has page None.
+    """
+    if isinstance(text, str):
+        text = [text]
+    page, parts = None, []
+    for piece in text:
+        position = 0
+        for marker in PAGE_MARKER.finditer(piece):
+            parts.append(piece[position:marker.start()])
+            if page is not None or "".join(parts).strip():
+                yield page, "".join(parts)
+            page, parts = int(marker.group(1)), []
+            position = marker.end()
+        parts.append(piece[position:])
+    if page is not None or "".join(parts).strip():
+        yield page, "".join(parts)
+
+
+def iter_chunks(text: Union[str, Iterable[str]], max_tokens: int = CHUNK_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Chunk]:
+    """Yield token-sized Chunks page by page as text arrives
+
+    Accepts a whole document or a stream of pieces (e.g. pdf_utils.iter_pdf_text),
+    so chunks can be embedded while later pages are still being parsed.
+    """
+    if not text:
+        return
+    for page, page_text in iter_pages(text):
+        yield from chunk_page(page_text, page, max_tokens, overlap_tokens)
+
+
+@metrics.timed("chunk_text")
+def chunk_text(text, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Chunk]:
+    """Split text into token-sized chunks with overlap for better context preservation"""
+    return list(iter_chunks(text, max_tokens, overlap_tokens))
+
+
+def iter_word_chunks(text: Union[str, Iterable[str]], chunk_size=1000, overlap=100) -> Iterator[str]:
+    """Previous scheme: windows of chunk_size words, ignoring pages and the model's input limit
+
+    Kept for comparison in bench/chunking_bench.py.
+    """
+    if not text:
+        return
+    if isinstance(text, str):
+        text = [text]
+
+    step = chunk_size - overlap
+    words = deque()
+    for piece in text:
+        words.extend(piece.split())
+        while len(words) >= chunk_size:
+            yield ' '.join(islice(words, chunk_size))
+            for _ in range(step):
+                words.popleft()
+
+    # Trailing windows, shorter than chunk_size
+    while words:
+        yield ' '.join(islice(words, chunk_size))
+        for _ in range(min(step, len(words))):
+            words.popleft()
+
+
+def chunk_texts(chunks: Iterable[Union[str, Chunk]]) -> List[str]:
+    """Plain text of chunks that may be Chunk records or strings"""
+    return [chunk.text if isinstance(chunk, Chunk) else chunk for chunk in chunks]
+
+
+def chunk_metadata(chunk: Union[str, Chunk], doc_id: str, index: int) -> dict:
+    """Chroma metadata for a chunk: its document, position and (if known) page"""
+    metadata = {"doc_id": doc_id, "chunk": index}
+    if isinstance(chunk, Chunk) and chunk.page is not None:
+        metadata["page"] = chunk.page
+    return metadata
+
+
+def iter_batches(chunks: Iterable, size: int) -> Iterator[list]:
+    """Group a chunk stream into lists of at most size chunks"""
+    chunks = iter(chunks)
+    while True:
+        batch = list(islice(chunks, size))
+        if not batch:
+            return
+        yield batch
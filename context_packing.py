@@ -0,0 +1,95 @@
+"""Assembly of retrieved chunks into the context block of the prompt
+
+Retrieved chunks arrive in relevance order and, when they are neighbours in the
+document, share the overlap the chunker carries from one chunk into the next.
+pack_context puts them in document order (page, then position), drops the words a
+chunk repeats from its predecessor, and keeps the most relevant chunks that fit a
+hard token budget.
+"""
+import os
+from typing import Dict, List
+
+import metrics
+from chunking import count_tokens
+
+# Hard limit on the context handed to the prompt, in embedding-model tokens
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1024"))
+
+# Shorter runs of shared words between adjacent chunks are coincidence, not overlap
+MIN_OVERLAP_WORDS = 5
+
+
+def _position(hit) -> tuple:
+    metadata = hit.metadata
+    page = metadata.get("page")
+    return (metadata.get("doc_id", ""), page if page is not None else -1, metadata.get("chunk", 0))
+
+
+def overlap_words(previous: List[str], current: List[str]) -> int:
+    """Length of the longest suffix of previous that current starts with"""
+    if not current:
+        return 0
+    for size in range(min(len(previous), len(current)), MIN_OVERLAP_WORDS - 1, -1):
+        if previous[-size] == current[0] and previous[-size:] == current[:size]:
+            return size
+    return 0
+
+
+def _pieces(hits) -> List[tuple]:
+    """(page, text) of hits in document order, without text repeated from the previous chunk"""
+    pieces = []
+    previous = None
+    for hit in sorted(hits, key=_position):
+        words = hit.text.split()
+        if previous is not None and previous[0] == hit.metadata.get("doc_id"):
+            if words == previous[1]:
+                continue
+            words = words[overlap_words(previous[1], words):]
+        previous = (hit.metadata.get("doc_id"), hit.text.split())
+        if words:
+            pieces.append((hit.metadata.get("page"), " ".join(words)))
+    return pieces
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """The leading words of text that fit in max_tokens"""
+    kept, used = [], 0
+    for word in text.split():
+        used += count_tokens(word)
+        if used > max_tokens:
+            break
+        kept.append(word)
+    return " ".join(kept)
+
+
+def _label(page) -> str:
+    return f"[Page {page}] " if page is not None else ""
+
+
+@metrics.timed("pack_context")
+def pack_context(hits, max_tokens: int = CONTEXT_MAX_TOKENS) -> str:
+    """Context text for a prompt from retrieval Hits given best first
+
+    The least relevant chunks are dropped until the rest, page labels included, fit in
+    max_tokens; a single chunk that is still too long is cut to fit.
+    """
+    selected = list(hits)
+    tokens: Dict[str, int] = {}
+    while selected:
+        pieces = [_label(page) + text for page, text in _pieces(selected)]
+        total = 0
+        for piece in pieces:
+            if piece not in tokens:
+                tokens[piece] = count_tokens(piece)
+            total += tokens[piece]
+        if total <= max_tokens:
+            break
+        if len(selected) == 1:
+            page, text = _pieces(selected)[0]
+            label = _label(page)
+            pieces = [label + truncate(text, max_tokens - (count_tokens(label) if label else 0))]
+            break
+        selected.pop()
+    else:
+        return ""
+    return "\n\n".join(pieces)
@@ -0,0 +1,183 @@
+"""Bounded chat memory: recent turns verbatim, older ones in a rolling summary
+
+A session's ConversationMemory keeps the last MEMORY_TURNS question/answer turns
+word for word. Once MEMORY_TURNS more have piled up behind them, the oldest are
+folded into a summary of at most MEMORY_SUMMARY_TOKENS tokens, so the summarizer
+runs once every MEMORY_TURNS turns. Only the last CHAT_HISTORY_TURNS turns are kept
+for display. What a session holds, what each rerun renders and what each prompt
+carries are therefore all bounded, however long the chat runs.
+
+Follow-up questions ("what about section 4?", "why is that?") are rewritten with
+the previous question before retrieval, so the search sees what they refer to.
+
+The summarizer is chosen with MEMORY_SUMMARIZER:
+
+    extractive  no model call: earlier questions and the first sentence of each answer
+    model       the generative model (Gemini, or the local stub with LLM_BACKEND=stub);
+                every MEMORY_TURNS turns the answer waits for an extra model call
+"""
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import List, NamedTuple
+
+import generation
+from chunking import count_tokens
+from context_packing import truncate
+
+# Turns kept word for word in the prompt
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "3"))
+
+# Token budget of the rolling summary of older turns
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "256"))
+
+# Token budget of each recent answer quoted in the prompt
+MEMORY_ANSWER_TOKENS = int(os.getenv("MEMORY_ANSWER_TOKENS", "160"))
+
+# Turns kept (and rendered) for the chat display
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "20"))
+
+# extractive or model
+MEMORY_SUMMARIZER = os.getenv("MEMORY_SUMMARIZER", "extractive")
+
+# A question opening with one of these continues the previous one
+FOLLOW_UP_OPENERS = ("what about", "how about", "and", "but", "also", "so", "then")
+
+# Pronouns that point back; they also make a question with a single topic word
+# ("who wrote it?") a follow-up
+PRONOUNS = {"it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him",
+            "his", "her"}
+
+# Words that say nothing about the topic by themselves: a question made only of these
+# ("why is that?", "which section is it in?", "tell me more") needs the conversation
+NON_TOPIC_WORDS = PRONOUNS | {
+    "what", "which", "who", "whom", "whose", "where", "when", "why", "how",
+    "is", "are", "was", "were", "be", "been", "do", "does", "did", "can", "could", "should", "would",
+    "will", "may", "might", "must", "has", "have", "had",
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "from", "by", "with", "about", "as", "into",
+    "than", "or", "and", "but", "if", "so", "then", "also", "not", "no", "yes",
+    "i", "me", "my", "we", "our", "you", "your", "there", "here",
+    "more", "else", "same", "previous", "above", "other", "one", "again", "please", "tell", "explain",
+    "say", "says", "mean", "means", "meant", "exactly", "really",
+    "section", "page", "part", "chapter", "paragraph", "clause", "reference", "code", "detail",
+    "details", "example", "examples", "thing", "things", "point",
+}
+
+WORD = re.compile(r"[a-z']+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+class Turn(NamedTuple):
+    question: str
+    answer: str
+
+
+def first_sentence(text: str) -> str:
+    return SENTENCE_END.split(text.strip(), 1)[0]
+
+
+class ExtractiveSummarizer:
+    """Summary without a model: each earlier question with the first sentence of its answer"""
+
+    def summarize(self, summary: str, turns: List[Turn], max_tokens: int) -> str:
+        lines = summary.splitlines() if summary else []
+        lines += [f"Q: {turn.question} A: {first_sentence(turn.answer)}" for turn in turns]
+        # The oldest lines go first when over budget
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        text = "\n".join(lines)
+        return text if count_tokens(text) <= max_tokens else truncate(text, max_tokens)
+
+
+class ModelSummarizer:
+    """Summary written by the generative model; falls back to the extractive one on errors"""
+
+    def __init__(self, model=None):
+        self.model = model
+
+    def summarize(self, summary: str, turns: List[Turn], max_tokens: int) -> str:
+        exchanges = "\n".join(f"User: {turn.question}\nAssistant: {turn.answer}" for turn in turns)
+        prompt = f"""Update the summary of a conversation about a PDF document with the new exchanges.
+            Keep the topics, names, numbers and sections discussed; drop pleasantries.
+            Answer with the updated summary only, in at most {max_tokens * 3 // 4} words.
+
+            Summary so far: {summary or "(none)"}
+
+            New exchanges:
+            {exchanges}"""
+        try:
+            model = self.model or generation.get_generative_model()
+            started = time.monotonic()
+            response = model.generate_content(prompt)
+            generation.report_usage(prompt, started, response)
+            return truncate(response.text.strip(), max_tokens)
+        except Exception as e:
+            logging.error(f"Error summarizing conversation: {e}")
+            return ExtractiveSummarizer().summarize(summary, turns, max_tokens)
+
+
+SUMMARIZERS = {"model": ModelSummarizer, "extractive": ExtractiveSummarizer}
+
+
+def get_summarizer(name: str = MEMORY_SUMMARIZER):
+    if name not in SUMMARIZERS:
+        raise Exception(f"Unknown MEMORY_SUMMARIZER {name!r}; choose one of {', '.join(SUMMARIZERS)}")
+    return SUMMARIZERS[name]()
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether a question refers back to the conversation: it opens with a connective or
+    pronoun, or names no topic of its own besides what a pronoun points to"""
+    words = [word[:-2] if word.endswith("'s") else word for word in WORD.findall(question.lower())]
+    if not words:
+        return False
+    if words[0] in PRONOUNS or words[0] in FOLLOW_UP_OPENERS or " ".join(words[:2]) in FOLLOW_UP_OPENERS:
+        return True
+    topic = [word for word in words if word not in NON_TOPIC_WORDS]
+    return not topic or (len(topic) == 1 and any(word in PRONOUNS for word in words))
+
+
+class ConversationMemory:
+    """One chat session's turns, with a rolling summary of those older than the recent window"""
+
+    def __init__(self, summarizer=None, recent_turns: int = MEMORY_TURNS,
+                 history_turns: int = CHAT_HISTORY_TURNS, summary_tokens: int = MEMORY_SUMMARY_TOKENS):
+        self.summarizer = summarizer or get_summarizer()
+        self.recent_turns = max(1, recent_turns)
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.history = deque(maxlen=max(history_turns, 2 * self.recent_turns))
+        # Turns not yet folded into the summary (the newest are at the end)
+        self.unsummarized = 0
+        self.total_turns = 0
+
+    def add(self, question: str, answer: str):
+        """Record a turn, folding older turns into the summary once enough have piled up"""
+        self.history.append(Turn(question, answer))
+        self.total_turns += 1
+        self.unsummarized += 1
+        if self.unsummarized >= 2 * self.recent_turns:
+            fold = self.unsummarized - self.recent_turns
+            turns = list(self.history)[-self.unsummarized:][:fold]
+            self.summary = self.summarizer.summarize(self.summary, turns, self.summary_tokens)
+            self.unsummarized -= fold
+
+    def recent(self) -> List[Turn]:
+        """Turns the summary doesn't cover yet, oldest first"""
+        return list(self.history)[-self.unsummarized:] if self.unsummarized else []
+
+    def rewrite_query(self, question: str) -> str:
+        """Retrieval query for a question: follow-ups get the previous question prepended"""
+        if not self.history or not is_follow_up(question):
+            return question
+        return f"{self.history[-1].question} {question}"
+
+    def prompt_history(self) -> str:
+        """The conversation so far for the answer prompt, within a bounded number of tokens"""
+        lines = [f"Summary of earlier conversation: {self.summary}"] if self.summary else []
+        for turn in self.recent():
+            lines.append(f"User: {turn.question}")
+            lines.append(f"Assistant: {truncate(turn.answer, MEMORY_ANSWER_TOKENS)}")
+        return "\n".join(lines)
@@ -0,0 +1,160 @@
+"""Embedding backends for rag_utils, chosen with EMBEDDING_BACKEND
+
+    torch      sentence-transformers all-MiniLM-L6-v2 on PyTorch (full precision)
+    onnx       the same model on ONNX Runtime, without importing torch
+    onnx-int8  the ONNX model with dynamically quantized int8 weights
+
+All three produce 384-dimensional normalized vectors. torch and onnx compute the
+same function and share a vector space; int8 vectors are close but not equal, so they
+get their own space. The space is recorded in each collection's metadata (see
+vector_store.get_collection), the exact index and the document registry, so vectors
+from different spaces are never searched together.
+
+The ONNX backends use the all-MiniLM-L6-v2 export that ChromaDB already downloads for
+its default embedding function (or ONNX_MODEL_DIR). The int8 copy is written next to it
+on first use.
+"""
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+import resources
+import vector_store
+
+# torch, onnx or onnx-int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Directory with model.onnx and tokenizer.json (default: ChromaDB's model cache)
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "")
+
+# all-MiniLM-L6-v2 input limit, as in sentence-transformers
+MAX_SEQ_TOKENS = 256
+EMBEDDING_DIM = 384
+
+
+class TorchBackend:
+    """sentence-transformers model on PyTorch"""
+
+    name = "torch"
+    space = vector_store.DEFAULT_EMBEDDING_SPACE
+
+    def __init__(self):
+        sentence_transformers = resources.lazy_import("sentence_transformers")
+        self.model = sentence_transformers.SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+
+def _model_dir() -> str:
+    if ONNX_MODEL_DIR:
+        return ONNX_MODEL_DIR
+    onnx_mini_lm = resources.lazy_import("chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2")
+    embedding_function = onnx_mini_lm.ONNXMiniLM_L6_V2()
+    # Fetches and verifies the export on first use; no public hook for just the download
+    embedding_function._download_model_if_not_exists()
+    return os.path.join(embedding_function.DOWNLOAD_PATH, embedding_function.EXTRACTED_FOLDER_NAME)
+
+
+def local_tokenizer_path() -> Optional[str]:
+    """The model's tokenizer.json if a copy is already on disk; never downloads"""
+    candidates = []
+    if ONNX_MODEL_DIR:
+        candidates.append(os.path.join(ONNX_MODEL_DIR, "tokenizer.json"))
+    try:
+        onnx_mini_lm = resources.lazy_import("chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2")
+        bundle = onnx_mini_lm.ONNXMiniLM_L6_V2
+        candidates.append(os.path.join(bundle.DOWNLOAD_PATH, bundle.EXTRACTED_FOLDER_NAME, "tokenizer.json"))
+    except ImportError:
+        pass
+    try:
+        huggingface_hub = resources.lazy_import("huggingface_hub")
+        # The sentence-transformers download, looked up in the local cache only
+        cached = huggingface_hub.try_to_load_from_cache(f"sentence-transformers/{EMBEDDING_MODEL}", "tokenizer.json")
+        if isinstance(cached, str):
+            candidates.append(cached)
+    except ImportError:
+        pass
+    return next((path for path in candidates if os.path.exists(path)), None)
+
+
+class OnnxBackend:
+    """The exported model on ONNX Runtime, padded per batch instead of to the full 256 tokens"""
+
+    name = "onnx"
+    space = vector_store.DEFAULT_EMBEDDING_SPACE
+
+    def __init__(self):
+        ort = resources.lazy_import("onnxruntime")
+        tokenizers = resources.lazy_import("tokenizers")
+        model_dir = _model_dir()
+        self.tokenizer = tokenizers.Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_TOKENS)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        options = ort.SessionOptions()
+        options.log_severity_level = 3
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path(model_dir), sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.session.get_inputs()}
+
+    def model_path(self, model_dir: str) -> str:
+        return os.path.join(model_dir, "model.onnx")
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feed = {"input_ids": input_ids, "attention_mask": mask}
+            if "token_type_ids" in self.inputs:
+                feed["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(None, feed)[0]
+            # Mean pooling over real tokens, then L2 normalization, as sentence-transformers does
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            batches.append(pooled / np.clip(norms, 1e-12, None))
+        return np.concatenate(batches).astype(np.float32)
+
+
+class Int8OnnxBackend(OnnxBackend):
+    """ONNX model with int8 weights: smaller and faster on CPU, slightly different vectors"""
+
+    name = "onnx-int8"
+    space = f"{vector_store.DEFAULT_EMBEDDING_SPACE}-int8"
+
+    def model_path(self, model_dir: str) -> str:
+        path = os.path.join(model_dir, "model_int8.onnx")
+        if not os.path.exists(path):
+            quantization = resources.lazy_import("onnxruntime.quantization")
+            logging.info("Quantizing the ONNX embedding model to int8 (once)")
+            partial = f"{path}.{os.getpid()}.tmp"
+            quantization.quantize_dynamic(os.path.join(model_dir, "model.onnx"), partial,
+                                          weight_type=quantization.QuantType.QInt8)
+            os.replace(partial, path)
+        return path
+
+
+BACKENDS = {backend.name: backend for backend in (TorchBackend, OnnxBackend, Int8OnnxBackend)}
+
+
+def backend_class(name: str = EMBEDDING_BACKEND):
+    if name not in BACKENDS:
+        raise Exception(f"Unknown EMBEDDING_BACKEND {name!r}; choose one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]
+
+
+def embedding_space(name: str = EMBEDDING_BACKEND) -> str:
+    """Vector space of a backend's embeddings, without loading it"""
+    return backend_class(name).space
+
+
+def load_backend(name: str = EMBEDDING_BACKEND):
+    return backend_class(name)()
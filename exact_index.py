@@ -0,0 +1,494 @@
+"""Exact nearest-neighbour search over a tenant's small documents, without Chroma
+
+A tenant's first few thousand chunks don't need an HNSW graph or SQLite writes:
+their normalized embeddings form one float32 matrix, each document's chunks a
+contiguous block of rows, and a query over any number of the documents is a single
+matrix-vector product followed by a top-k partition.
+
+Each tenant's index is a directory under chroma_db/exact holding embeddings.f32
+(the float32 matrix, row after row), ids.bin, texts.bin and metadatas.bin (UTF-8
+strings back to back; metadata as JSON), offsets.bin (where each row's strings end
+in the blobs) and documents.json (the row count, each document's rows and the
+embedding space of the vectors, which the tenant's Chroma collection shares). A new
+document is appended to the files and then made visible by replacing documents.json,
+so readers never see a half-written index and adding one costs only its own rows.
+Removing a document only drops it from documents.json; once the dead rows outnumber
+the live ones the index is compacted into a new generation directory that CURRENT
+is then pointed at. With EXACT_INDEX_MMAP on, all of it is memory-mapped: opening
+an index reads no chunk data, processes searching the same tenant share its pages,
+and only the chunks a query returns are decoded.
+
+DocumentWriter puts a document here while the tenant's index stays within
+EXACT_INDEX_MAX_CHUNKS rows, and in the tenant's Chroma collection otherwise; above
+that size HNSW search is faster than scanning the matrix (see
+bench/vector_store_bench.py). Bounding the tenant rather than each document keeps a
+query over many small documents (a bulk_ingest corpus, say) to one scan.
+"""
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import vector_store
+
+EXACT_PATH = os.path.join(vector_store.CHROMA_PATH, "exact")
+
+# Rows of a tenant's exact index; documents that don't fit go to Chroma (0: always Chroma)
+EXACT_INDEX_MAX_CHUNKS = int(os.getenv("EXACT_INDEX_MAX_CHUNKS", "20000"))
+
+# Memory-map indexes instead of reading them into memory
+EXACT_INDEX_MMAP = os.getenv("EXACT_INDEX_MMAP", "1") == "1"
+
+
+class StringTable:
+    """Strings stored back to back in one UTF-8 blob, decoded one at a time by offset"""
+
+    def __init__(self, blob, offsets: np.ndarray, decode: Optional[Callable] = None):
+        self.blob = blob
+        self.offsets = offsets
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int):
+        string = self.blob[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+        return self.decode(string) if self.decode else string
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def block(self, start: int, end: int) -> Tuple[bytes, np.ndarray]:
+        """Rows start to end as (their bytes, each string's length), for copying without decoding"""
+        return bytes(self.blob[self.offsets[start]:self.offsets[end]]), np.diff(self.offsets[start:end + 1])
+
+
+def _encode_block(strings) -> Tuple[bytes, np.ndarray]:
+    data = [string.encode("utf-8") for string in strings]
+    return b"".join(data), np.array([len(item) for item in data], dtype=np.int64)
+
+
+def _read_blob(path: str, size: int):
+    """The first size bytes of a file, memory-mapped if EXACT_INDEX_MMAP is on"""
+    with open(path, "rb") as f:
+        if not EXACT_INDEX_MMAP:
+            return f.read(size)
+        if size == 0:
+            # mmap can't map an empty file
+            return b""
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+
+def _top_k(scores: np.ndarray, top_k: int, candidates: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows of the top_k scores (of candidates finite ones) and the scores, best first"""
+    top_k = min(top_k, candidates)
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64), scores[:0]
+    if top_k < len(scores):
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        rows = np.arange(len(scores))
+    rows = rows[np.argsort(-scores[rows], kind="stable")]
+    return rows, scores[rows]
+
+
+class ExactIndex:
+    """A tenant's chunks: ids, texts, metadata and their normalized embedding matrix
+
+    documents maps each doc_id to its (start, end) rows; rows of removed documents
+    that no entry covers are dead and never returned. space names the embedding model
+    the vectors come from.
+    """
+
+    def __init__(self, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[dict],
+                 embeddings: np.ndarray, documents: Dict[str, Tuple[int, int]],
+                 space: str = vector_store.DEFAULT_EMBEDDING_SPACE):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.documents = documents
+        self.space = space
+        self.live = sum(end - start for start, end in documents.values())
+        self._rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        """Row of each live chunk id, built on first lookup; searching doesn't need it"""
+        if self._rows is None:
+            self._rows = {self.ids[row]: row for start, end in self.documents.values() for row in range(start, end)}
+        return self._rows
+
+    def chunk(self, row: int) -> tuple:
+        return self.ids[row], self.texts[row], self.metadatas[row]
+
+    def document_rows(self, doc_id: str) -> range:
+        return range(*self.documents.get(doc_id, (0, 0)))
+
+    def document_ids(self, doc_id: str) -> List[str]:
+        return [self.ids[row] for row in self.document_rows(doc_id)]
+
+    def search(self, query_embedding: np.ndarray, top_k: int,
+               doc_ids: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the top_k chunks (of doc_ids, or all) and their cosine similarities, best first"""
+        wanted = self.documents.keys() if doc_ids is None else set(doc_ids)
+        if self.live == len(self) and self.documents.keys() <= wanted:
+            return _top_k(self.embeddings @ query_embedding, top_k, len(self))
+        ranges = np.array([self.documents[doc_id] for doc_id in wanted if doc_id in self.documents],
+                          dtype=np.int64).reshape(-1, 2)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            rows, scores = _top_k(self.embeddings[start:end] @ query_embedding, top_k, end - start)
+            return rows + start, scores
+        lengths = ranges[:, 1] - ranges[:, 0]
+        selected = int(lengths.sum())
+        if 2 * selected < len(self):
+            # Few rows: score just those, gathered range after range
+            rows = np.repeat(ranges[:, 0] - np.cumsum(lengths) + lengths, lengths) + np.arange(selected)
+            best, scores = _top_k(self.embeddings[rows] @ query_embedding, top_k, selected)
+            return rows[best], scores
+        # Ranges don't overlap, so +1 at each start and -1 at each end sum to 1 inside them
+        marks = np.zeros(len(self) + 1, dtype=np.int64)
+        np.add.at(marks, ranges[:, 0], 1)
+        np.add.at(marks, ranges[:, 1], -1)
+        mask = np.cumsum(marks[:-1]) > 0
+        scores = np.where(mask, self.embeddings @ query_embedding, -np.inf).astype(np.float32)
+        return _top_k(scores, top_k, selected)
+
+
+def normalize(embeddings) -> np.ndarray:
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+
+def _index_path(tenant: str) -> str:
+    return os.path.join(EXACT_PATH, vector_store.collection_name(tenant))
+
+
+# tenant -> ((generation, documents.json inode and mtime), ExactIndex)
+_indexes: Dict[str, tuple] = {}
+_indexes_lock = threading.Lock()
+
+# Serializes writes by threads of this process; only the process holding the ingest
+# runner lock (ingest_jobs, bulk_ingest) writes
+_write_lock = threading.Lock()
+
+# Blobs of an index directory, in the order of the columns of offsets.bin
+_TABLES = ("ids", "texts", "metadatas")
+
+
+def _current_generation(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _read_manifest(path: str) -> dict:
+    try:
+        with open(os.path.join(path, "documents.json")) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"rows": 0, "dim": 0, "bytes": [0] * len(_TABLES), "documents": {}, "space": None}
+    manifest["documents"] = {doc_id: tuple(rows) for doc_id, rows in manifest["documents"].items()}
+    return manifest
+
+
+def _open_generation(path: str) -> ExactIndex:
+    manifest = _read_manifest(path)
+    rows, dim = manifest["rows"], manifest["dim"]
+    # Only the part documents.json covers; a write in progress may have appended more
+    offsets = np.frombuffer(_read_blob(os.path.join(path, "offsets.bin"), (rows + 1) * len(_TABLES) * 8),
+                            dtype=np.int64).reshape(rows + 1, len(_TABLES)).T
+    blobs = [_read_blob(os.path.join(path, f"{table}.bin"), size) for table, size in zip(_TABLES, manifest["bytes"])]
+    ids = StringTable(blobs[0], offsets[0])
+    texts = StringTable(blobs[1], offsets[1])
+    metadatas = StringTable(blobs[2], offsets[2], decode=json.loads)
+    embeddings = np.frombuffer(_read_blob(os.path.join(path, "embeddings.f32"), rows * dim * 4),
+                               dtype=np.float32).reshape(rows, dim)
+    return ExactIndex(ids, texts, metadatas, embeddings, manifest["documents"], manifest["space"])
+
+
+def load_index(tenant: str = vector_store.DEFAULT_TENANT) -> Optional[ExactIndex]:
+    """A tenant's exact index, or None if it has none"""
+    path = _index_path(tenant)
+    # Compaction may remove the generation between reading CURRENT and opening it; try once more
+    for attempt in range(2):
+        generation = _current_generation(path)
+        if generation is None:
+            return None
+        try:
+            stat = os.stat(os.path.join(path, generation, "documents.json"))
+            key = (generation, stat.st_ino, stat.st_mtime_ns)
+            with _indexes_lock:
+                cached = _indexes.get(tenant)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            index = _open_generation(os.path.join(path, generation))
+        except FileNotFoundError:
+            if attempt:
+                raise
+            continue
+        with _indexes_lock:
+            _indexes[tenant] = (key, index)
+        return index
+
+
+def _append(path: str, blocks: List[tuple], removed: Iterable[str] = (), space: Optional[str] = None):
+    """Append (doc_id, embeddings, [(bytes, lengths)] per table) blocks of space to an index directory
+
+    The files are cut back to what documents.json covers first, dropping whatever
+    an interrupted write left behind.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = _read_manifest(path)
+    rows, dim = manifest["rows"], manifest["dim"]
+    removed = set(removed)
+    documents = {doc_id: span for doc_id, span in manifest["documents"].items() if doc_id not in removed}
+    matrices = [embeddings for _, embeddings, _ in blocks if len(embeddings)]
+    if matrices:
+        dim = dim or matrices[0].shape[1]
+        for matrix in matrices:
+            if matrix.shape[1] != dim:
+                raise Exception(f"Exact index has {dim}-dimensional embeddings, got {matrix.shape[1]}")
+
+    def extend(name: str, size: int, data: Iterable[bytes]):
+        with open(os.path.join(path, name), "ab+") as f:
+            f.truncate(size)
+            for item in data:
+                f.write(item)
+
+    extend("embeddings.f32", rows * dim * 4,
+           (np.ascontiguousarray(matrix, dtype=np.float32).tobytes() for matrix in matrices))
+    ends = [np.array([size], dtype=np.int64) for size in manifest["bytes"]]
+    for t, table in enumerate(_TABLES):
+        extend(f"{table}.bin", manifest["bytes"][t], (tables[t][0] for _, _, tables in blocks))
+        ends[t] = np.cumsum(np.concatenate([ends[t]] + [tables[t][1] for _, _, tables in blocks]))
+    first = b"" if rows else np.zeros(len(_TABLES), dtype=np.int64).tobytes()
+    extend("offsets.bin", (rows + 1) * len(_TABLES) * 8 if rows else 0,
+           [first, np.stack([end[1:] for end in ends], axis=1).astype(np.int64).tobytes()])
+    for doc_id, embeddings, _ in blocks:
+        documents[doc_id] = (rows, rows + len(embeddings))
+        rows += len(embeddings)
+    manifest = {"rows": rows, "dim": dim, "bytes": [int(end[-1]) for end in ends], "documents": documents,
+                "space": manifest["space"] or space}
+    tmp_path = os.path.join(path, "documents.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(path, "documents.json"))
+
+
+def _new_generation(path: str, blocks: List[tuple], space: str):
+    """Write blocks as a new generation, point CURRENT at it and remove the previous one"""
+    previous = _current_generation(path)
+    generation = uuid.uuid4().hex
+    _append(os.path.join(path, generation), blocks, space=space)
+    _set_current(path, generation)
+    if previous:
+        # Readers that already mapped it keep their pages until they let go
+        shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+
+def _compact(path: str, index: ExactIndex):
+    """Copy a tenant's live rows into a new generation"""
+    blocks = []
+    for doc_id, (start, end) in sorted(index.documents.items(), key=lambda item: item[1]):
+        tables = [table.block(start, end) for table in (index.ids, index.texts, index.metadatas)]
+        blocks.append((doc_id, index.embeddings[start:end], tables))
+    _new_generation(path, blocks, index.space)
+
+
+def _set_current(path: str, generation: str):
+    tmp_path = os.path.join(path, "CURRENT.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(generation)
+    os.replace(tmp_path, os.path.join(path, "CURRENT"))
+
+
+def update_index(tenant: str, add: Optional[tuple] = None, remove: Iterable[str] = (),
+                 space: str = vector_store.DEFAULT_EMBEDDING_SPACE):
+    """Add a document to a tenant's index and/or remove documents from it
+
+    add is (doc_id, ids, texts, metadatas, embeddings) with embeddings of space, and
+    replaces that document's rows if it has some. An index whose documents are all
+    removed starts over in the new space; one that still has documents of another
+    space refuses the new one.
+    """
+    path = _index_path(tenant)
+    remove = set(remove) | ({add[0]} if add else set())
+    with _write_lock:
+        blocks = []
+        if add:
+            doc_id, ids, texts, metadatas, embeddings = add
+            metadatas = (json.dumps(metadata, separators=(",", ":")) for metadata in metadatas)
+            matrix = normalize(embeddings) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+            blocks.append((doc_id, matrix, [_encode_block(ids), _encode_block(texts), _encode_block(metadatas)]))
+        index = load_index(tenant)
+        if index is None or (add and index.space != space and not index.documents.keys() - remove):
+            _new_generation(path, blocks, space)
+        else:
+            if add and index.space != space:
+                raise Exception(f"The exact index holds {index.space} embeddings, not {space}; "
+                                f"reindex the tenant's documents or switch the backend back")
+            _append(os.path.join(path, _current_generation(path)), blocks, remove)
+        index = load_index(tenant)
+        if 2 * index.live < len(index):
+            _compact(path, index)
+
+
+def compact_index(tenant: str = vector_store.DEFAULT_TENANT):
+    """Rewrite a tenant's index without the rows of removed documents, if it has any"""
+    with _write_lock:
+        index = load_index(tenant)
+        if index is not None and index.live < len(index):
+            _compact(_index_path(tenant), index)
+
+
+def delete_index(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT):
+    """Remove a document's rows from the tenant's index"""
+    index = load_index(tenant)
+    if index is None or doc_id not in index.documents:
+        return
+    try:
+        update_index(tenant, remove=[doc_id])
+    except OSError as e:
+        logging.error(f"Error deleting {doc_id[:12]} from the exact index: {e}")
+
+
+class ExactStore(vector_store.VectorStore):
+    """A tenant's documents held in its exact index, with embeddings of space"""
+    name = "exact"
+
+    def __init__(self, tenant: str = vector_store.DEFAULT_TENANT,
+                 space: str = vector_store.DEFAULT_EMBEDDING_SPACE):
+        self.tenant = tenant
+        self.space = space
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: str, ids, embeddings, texts, metadatas):
+        with self._lock:
+            pending = self._pending.setdefault(doc_id, ([], [], [], []))
+            pending[0].extend(ids)
+            pending[1].append(normalize(embeddings))
+            pending[2].extend(texts)
+            pending[3].extend(metadatas)
+
+    def pending_count(self, doc_id: str) -> int:
+        with self._lock:
+            return len(self._pending.get(doc_id, ((),))[0])
+
+    def take_pending(self, doc_id: str) -> tuple:
+        """Chunks added for doc_id but not committed, as (ids, embeddings, texts, metadatas)"""
+        with self._lock:
+            ids, embeddings, texts, metadatas = self._pending.pop(doc_id, ([], [], [], []))
+        matrix = np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        return ids, matrix, texts, metadatas
+
+    def commit(self, doc_id: str):
+        ids, embeddings, texts, metadatas = self.take_pending(doc_id)
+        update_index(self.tenant, add=(doc_id, ids, texts, metadatas, embeddings), space=self.space)
+
+    def _index(self) -> Optional[ExactIndex]:
+        index = load_index(self.tenant)
+        if index is not None and index.live and index.space != self.space:
+            raise Exception(f"The exact index holds {index.space} embeddings, but the query is in {self.space}")
+        return index
+
+    def query(self, query_embedding, n_results: int, doc_ids=None) -> List[tuple]:
+        index = self._index()
+        if index is None or not index.live:
+            return []
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_ids]
+        rows, scores = index.search(normalize(query_embedding)[0], n_results, doc_ids)
+        return [(*index.chunk(int(row)), 1.0 - float(score)) for row, score in zip(rows, scores)]
+
+    def get(self, ids, doc_ids=None) -> List[tuple]:
+        index = self._index()
+        if index is None:
+            return []
+        if isinstance(doc_ids, str):
+            doc_ids = [doc_ids]
+        allowed = None if doc_ids is None else [index.document_rows(doc_id) for doc_id in doc_ids]
+        chunks = []
+        for chunk_id in set(ids):
+            row = index.rows.get(chunk_id)
+            if row is not None and (allowed is None or any(row in rows for rows in allowed)):
+                chunks.append(index.chunk(row))
+        return chunks
+
+    def delete_document(self, doc_id: str):
+        delete_index(doc_id, self.tenant)
+
+
+class DocumentWriter:
+    """Writes one document's chunks to the store it belongs in
+
+    A new document goes to the tenant's exact index if it fits within
+    EXACT_INDEX_MAX_CHUNKS rows, and moves to the tenant's Chroma collection as soon
+    as it doesn't. A new version of a document stays in Chroma if the version it
+    replaces is there.
+    """
+
+    def __init__(self, collection, doc_id: str, tenant: str = vector_store.DEFAULT_TENANT,
+                 previous: Optional[dict] = None):
+        self.doc_id = doc_id
+        self.chroma = vector_store.ChromaStore(collection)
+        self.exact = ExactStore(tenant, vector_store.collection_space(collection))
+        self.previous = previous
+        previous_store = previous["store"] if previous else None
+        # Rows other documents keep in the index; the version this one replaces is removed
+        index = load_index(tenant)
+        self.exact_rows = index.live if index is not None else 0
+        if index is not None and previous_store == self.exact.name:
+            self.exact_rows -= len(index.document_rows(previous["doc_id"]))
+        if previous_store == "chroma" or self.exact_rows >= EXACT_INDEX_MAX_CHUNKS:
+            self.store = self.chroma
+        else:
+            self.store = self.exact
+
+    def add(self, ids, embeddings, texts, metadatas):
+        self.store.add(self.doc_id, ids, embeddings, texts, metadatas)
+        if (self.store is self.exact
+                and self.exact_rows + self.exact.pending_count(self.doc_id) > EXACT_INDEX_MAX_CHUNKS):
+            self._move_to_chroma()
+
+    def _move_to_chroma(self):
+        ids, embeddings, texts, metadatas = self.exact.take_pending(self.doc_id)
+        for start in range(0, len(ids), vector_store.CHROMA_BATCH_SIZE):
+            end = start + vector_store.CHROMA_BATCH_SIZE
+            self.chroma.add(self.doc_id, ids[start:end], embeddings[start:end], texts[start:end], metadatas[start:end])
+        self.store = self.chroma
+        logging.info(f"Document {self.doc_id[:12]} doesn't fit in the exact index "
+                     f"({EXACT_INDEX_MAX_CHUNKS} chunks); indexing it in Chroma")
+
+    def keep(self, ids, metadatas):
+        """Carry unchanged chunks over from the previous version's rows of the exact index
+
+        Chunks of a previous version in Chroma stay where they are and only get new
+        metadata (ingest_cache.VersionDiff.finish).
+        """
+        if not ids or not self.previous or self.previous["store"] != self.exact.name:
+            return
+        index = load_index(self.exact.tenant)
+        rows = [index.rows[chunk_id] for chunk_id in ids]
+        self.add(ids, np.asarray(index.embeddings[rows]), [index.texts[row] for row in rows], metadatas)
+
+    def commit(self) -> str:
+        """Make the document searchable and return the name of its store"""
+        self.store.commit(self.doc_id)
+        return self.store.name
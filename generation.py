@@ -0,0 +1,150 @@
+import os
+import logging
+import threading
+import time
+import metrics
+import resources
+import answer_cache
+from chunking import count_tokens
+
+# "gemini" calls the Gemini API; "stub" answers locally (see llm_stub.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+ERROR_ANSWER = "I apologize, but I'm having trouble responding right now. Please try again in a moment."
+
+GENERAL_CHAT_KEYWORDS = ['hi', 'hello', 'hey', 'how are you', 'good morning', 'good afternoon', 'good evening', 'thanks', 'thank you']
+
+def build_prompt(question, context, history=""):
+    """Prompt sent to Gemini for a question, its retrieved context and the conversation so far"""
+    # Check if it's a general conversation
+    is_general_chat = any(keyword in question.lower() for keyword in GENERAL_CHAT_KEYWORDS)
+
+    if is_general_chat:
+        return f"""You are a friendly and helpful AI assistant named PDF Chatbot. 
+            Respond to this greeting in a friendly and engaging way: {question}
+            Keep the response concise but warm and welcoming."""
+    # Earlier turns (see conversation.py) let the model resolve follow-up questions
+    conversation = f"Conversation so far:\n{history}\n\n            " if history else ""
+    return f"""You are a helpful AI assistant. Answer the question based on the provided context.
+            Be friendly and conversational in your response. If the question isn't related to the 
+            context, politely mention that you're here to help with the PDF content.
+
+            Context: {context}
+
+            {conversation}Question: {question}
+            Answer: """
+
+# Totals over all model calls in this process, for cost and latency tracking
+_usage = {"calls": 0, "prompt_tokens": 0, "seconds": 0.0}
+_usage_lock = threading.Lock()
+
+def prompt_tokens(prompt, response=None):
+    """Prompt size in tokens: Gemini's own count when the response carries it, else an estimate"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", None):
+        return usage.prompt_token_count
+    return count_tokens(prompt)
+
+def report_usage(prompt, started, response=None):
+    """Log the prompt token count and latency of one model call and add them to the totals"""
+    tokens = prompt_tokens(prompt, response)
+    elapsed = time.monotonic() - started
+    with _usage_lock:
+        _usage["calls"] += 1
+        _usage["prompt_tokens"] += tokens
+        _usage["seconds"] += elapsed
+    logging.info(f"Model call: {tokens} prompt tokens, {elapsed:.2f}s")
+    return tokens
+
+def usage_stats():
+    """Model calls so far with their total and mean prompt tokens and latency"""
+    with _usage_lock:
+        usage = dict(_usage)
+    calls = usage["calls"] or 1
+    usage["mean_prompt_tokens"] = usage["prompt_tokens"] / calls
+    usage["mean_seconds"] = usage["seconds"] / calls
+    return usage
+
+def get_generative_model():
+    """Generative model for the configured LLM_BACKEND"""
+    if LLM_BACKEND == "stub":
+        import llm_stub
+        return resources.get_resource("llm_stub", llm_stub.StubGenerativeModel)
+    # Gemini calls go through the shared key pool (rate limits, circuit breakers, failover)
+    import api_manager
+    return api_manager.api_manager
+
+def _cache_context(context, history):
+    """What a cached answer depends on besides the question"""
+    return f"{history}\n\n{context}" if history else context
+
+@metrics.timed("answer_question")
+def answer_question(question, context, embed_fn=None, model=None, history=""):
+    """Generate response using Gemini model
+
+    With embed_fn (text -> embedding), near-identical questions about the same context
+    are answered from the semantic answer cache without calling the model. history is
+    the conversation so far; answers that depend on it are cached under it too.
+    """
+    try:
+        question_emb = embed_fn(question) if embed_fn else None
+        cache_context = _cache_context(context, history)
+        if question_emb is not None:
+            cached = answer_cache.lookup(question_emb, cache_context)
+            if cached is not None:
+                return cached
+
+        model = model or get_generative_model()
+        prompt = build_prompt(question, context, history)
+        started = time.monotonic()
+        response = model.generate_content(prompt)
+        answer = response.text.strip()
+        report_usage(prompt, started, response)
+
+        if question_emb is not None:
+            answer_cache.store(question, question_emb, cache_context, answer)
+        return answer
+    except Exception as e:
+        logging.error(f"Error generating content from Gemini API: {e}")
+        return ERROR_ANSWER
+
+@metrics.timed("answer_question_stream")
+def stream_answer(question, context, embed_fn=None, model=None, history=""):
+    """Yield the answer text as Gemini streams it, so the UI can render it incrementally
+
+    The complete answer goes into the semantic answer cache once the stream ends; a cached
+    answer is yielded in one piece.
+    """
+    parts = []
+    try:
+        question_emb = embed_fn(question) if embed_fn else None
+        cache_context = _cache_context(context, history)
+        if question_emb is not None:
+            cached = answer_cache.lookup(question_emb, cache_context)
+            if cached is not None:
+                yield cached
+                return
+
+        model = model or get_generative_model()
+        prompt = build_prompt(question, context, history)
+        started = time.monotonic()
+        response = model.generate_content(prompt, stream=True)
+        for chunk in response:
+            text = chunk.text
+            if not parts:
+                text = text.lstrip()
+            if text:
+                if not parts:
+                    metrics.observe("answer_first_token", time.monotonic() - started)
+                parts.append(text)
+                yield text
+        report_usage(prompt, started, response)
+    except Exception as e:
+        logging.error(f"Error streaming content from Gemini API: {e}")
+        if not parts:
+            yield ERROR_ANSWER
+        return
+
+    answer = "".join(parts).strip()
+    if question_emb is not None and answer:
+        answer_cache.store(question, question_emb, cache_context, answer)
@@ -0,0 +1,315 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import answer_cache
+import exact_index
+import lexical_index
+import resources
+import vector_store
+
+# Registry of indexed documents, stored next to the vector store it describes
+CACHE_DB_PATH = os.path.join(vector_store.CHROMA_PATH, "ingest_cache.sqlite3")
+
+# Disk budget for CHROMA_PATH (indexes, registry, queued uploads) and the answer cache,
+# shared by all tenants
+DISK_BUDGET_MB = float(os.getenv("CHROMA_DISK_BUDGET_MB", "1024"))
+
+# all-MiniLM-L6-v2 produces 384-dimensional embeddings
+EMBEDDING_DIM = 384
+
+DOCUMENT_COLUMNS = ("doc_id", "name", "chunk_count", "size_bytes", "created_at", "last_used", "source_id",
+                    "store", "space")
+
+
+def _init_db():
+    os.makedirs(vector_store.CHROMA_PATH, exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB_PATH, timeout=30)
+    # Readers in other processes (API workers) don't wait for the writer
+    conn.execute("PRAGMA journal_mode=WAL")
+    # source_id is the doc_id of a document's first version; later versions uploaded
+    # under the same name keep it, and it prefixes their chunk ids. store is the
+    # vector store holding the document's chunks ("chroma" or "exact") and space the
+    # embedding space of their vectors
+    conn.execute('''CREATE TABLE IF NOT EXISTS documents
+                    (tenant TEXT, doc_id TEXT, name TEXT, chunk_count INTEGER,
+                     size_bytes INTEGER, created_at REAL, last_used REAL, source_id TEXT,
+                     store TEXT, space TEXT, PRIMARY KEY (tenant, doc_id))''')
+    # Bumped with every change to a tenant's documents; cached retrieval results carry it
+    conn.execute("CREATE TABLE IF NOT EXISTS versions (tenant TEXT PRIMARY KEY, version INTEGER)")
+    conn.commit()
+    conn.close()
+    return True
+
+
+_local = threading.local()
+
+
+def _connection() -> sqlite3.Connection:
+    """This thread's connection to the registry; the schema is created once per process
+
+    Use it as a context manager around writes, which commits them (or rolls back).
+    """
+    resources.get_resource("ingest_cache_db", _init_db)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_DB_PATH, timeout=30, cached_statements=32)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+def document_hash(data: bytes) -> str:
+    """Content address of a document: SHA-256 of its raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def disk_usage() -> int:
+    """Bytes the disk budget covers: everything under CHROMA_PATH plus the answer cache"""
+    paths = [os.path.join(directory, name)
+             for directory, _, files in os.walk(vector_store.CHROMA_PATH) for name in files]
+    paths += [answer_cache.ANSWER_CACHE_PATH + suffix for suffix in ("", "-wal")]
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def estimate_size(chunks: List[str], dim: int = EMBEDDING_DIM) -> int:
+    """Approximate bytes a set of chunks occupies in the vector store"""
+    text_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+    return text_bytes + len(chunks) * dim * 4
+
+
+def _document(row) -> dict:
+    return dict(zip(DOCUMENT_COLUMNS, row))
+
+
+def _bump_version(conn, tenant: str):
+    conn.execute("INSERT INTO versions VALUES (?, 1) ON CONFLICT (tenant) DO UPDATE SET version=version+1",
+                 (tenant,))
+
+
+def get_version(tenant: str = vector_store.DEFAULT_TENANT) -> int:
+    """Version of a tenant's set of documents, shared by every process using the registry"""
+    conn = _connection()
+    row = conn.execute("SELECT version FROM versions WHERE tenant=?", (tenant,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_document(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT) -> Optional[dict]:
+    """Return the registry entry for a tenant's indexed document, or None"""
+    conn = _connection()
+    row = conn.execute(
+        f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents WHERE tenant=? AND doc_id=?",
+        (tenant, doc_id)
+    ).fetchone()
+    return _document(row) if row is not None else None
+
+
+def list_documents(tenant: str = vector_store.DEFAULT_TENANT) -> List[dict]:
+    """All documents indexed for a tenant, most recently used first"""
+    conn = _connection()
+    rows = conn.execute(
+        f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents WHERE tenant=? ORDER BY last_used DESC",
+        (tenant,)
+    ).fetchall()
+    return [_document(row) for row in rows]
+
+
+def check_embedding_space(space: str, tenant: str = vector_store.DEFAULT_TENANT):
+    """Raise if the tenant has documents indexed with embeddings of another space"""
+    conn = _connection()
+    row = conn.execute("SELECT space FROM documents WHERE tenant=? AND space!=? LIMIT 1",
+                       (tenant, space)).fetchone()
+    if row is not None:
+        raise Exception(f"Indexed documents use {row[0]} embeddings, but the embedding backend "
+                        f"produces {space}; reindex them or switch the backend back")
+
+
+def previous_version(name: str, doc_id: str,
+                     tenant: str = vector_store.DEFAULT_TENANT) -> Optional[dict]:
+    """The tenant's most recent other document with the same name, which doc_id replaces"""
+    if not name:
+        return None
+    conn = _connection()
+    row = conn.execute(
+        f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents "
+        "WHERE tenant=? AND name=? AND doc_id!=? ORDER BY created_at DESC LIMIT 1",
+        (tenant, name, doc_id)
+    ).fetchone()
+    return _document(row) if row is not None else None
+
+
+def touch_document(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT):
+    """Mark a document as recently used for LRU eviction"""
+    with _connection() as conn:
+        conn.execute("UPDATE documents SET last_used=? WHERE tenant=? AND doc_id=?",
+                     (time.time(), tenant, doc_id))
+
+
+def register_document(doc_id: str, name: str, chunk_count: int, size_bytes: int,
+                      tenant: str = vector_store.DEFAULT_TENANT, source_id: Optional[str] = None,
+                      store: str = vector_store.ChromaStore.name,
+                      space: str = vector_store.DEFAULT_EMBEDDING_SPACE):
+    """Record a freshly indexed document, the store holding its chunks and their embedding space"""
+    now = time.time()
+    with _connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (tenant, doc_id, name, chunk_count, size_bytes, now, now, source_id or doc_id, store, space)
+        )
+        _bump_version(conn, tenant)
+
+
+def remove_document(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT):
+    """Drop a document from the registry"""
+    with _connection() as conn:
+        conn.execute("DELETE FROM documents WHERE tenant=? AND doc_id=?", (tenant, doc_id))
+        _bump_version(conn, tenant)
+
+
+def chunk_hash(text: str) -> str:
+    """Content address of a chunk: truncated SHA-256 of its text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class VersionDiff:
+    """Chunk-level diff of a document being indexed against the version it replaces
+
+    Chunk ids are f"{source_id}:{chunk_hash}", so they are stable across versions of a
+    document: chunks whose text is unchanged keep their stored embedding and only get
+    new metadata, changed chunks are embedded, and chunks that disappeared are deleted
+    by finish(). A document with no previous version simply has every chunk embedded.
+    """
+
+    def __init__(self, doc_id: str, name: str, tenant: str = vector_store.DEFAULT_TENANT):
+        self.doc_id = doc_id
+        self.name = name
+        self.tenant = tenant
+        self.previous = previous_version(name, doc_id, tenant)
+        self.source_id = self.previous["source_id"] if self.previous else doc_id
+        self.stored = set()
+        if self.previous and self.previous["store"] == exact_index.ExactStore.name:
+            index = exact_index.load_index(tenant)
+            self.stored = set(index.document_ids(self.previous["doc_id"]) if index is not None else [])
+        elif self.previous:
+            self.stored = set(vector_store.get_collection(tenant).get(
+                where={"doc_id": self.previous["doc_id"]}, include=[]
+            )["ids"])
+        self.kept_ids = []
+        self.kept_metadatas = []
+        self.embedded = 0
+        self._occurrences: Dict[str, int] = {}
+
+    def chunk_ids(self, texts: Iterable[str]) -> List[str]:
+        """Stable ids for the next chunks of the document; repeated texts get a counter suffix"""
+        ids = []
+        for text in texts:
+            digest = chunk_hash(text)
+            seen = self._occurrences.get(digest, 0)
+            self._occurrences[digest] = seen + 1
+            ids.append(f"{self.source_id}:{digest}" if not seen else f"{self.source_id}:{digest}-{seen}")
+        return ids
+
+    def split(self, ids: List[str], metadatas: List[dict]) -> List[int]:
+        """Positions of the chunks that need embedding; unchanged ones are kept for finish()"""
+        changed = []
+        for position, (chunk_id, metadata) in enumerate(zip(ids, metadatas)):
+            if chunk_id in self.stored:
+                self.kept_ids.append(chunk_id)
+                self.kept_metadatas.append(metadata)
+            else:
+                changed.append(position)
+        self.embedded += len(changed)
+        return changed
+
+    def finish(self):
+        """Point unchanged chunks at the new version and drop what is left of the old one
+
+        Unchanged chunks of a previous version in the exact index were copied into the
+        new version's store (exact_index.DocumentWriter.keep), so its rows just go.
+        """
+        if not self.previous:
+            return
+        stale = list(self.stored.difference(self.kept_ids))
+        if self.previous["store"] == exact_index.ExactStore.name:
+            exact_index.delete_index(self.previous["doc_id"], self.tenant)
+        else:
+            self._update_chroma(stale)
+        remove_document(self.previous["doc_id"], self.tenant)
+        lexical_index.delete_segment(self.previous["doc_id"], self.tenant)
+        logging.info(f"Re-indexed {self.name or self.doc_id[:12]}: {len(self.kept_ids)} chunks unchanged, "
+                     f"{self.embedded} embedded, {len(stale)} removed")
+
+    def _update_chroma(self, stale: List[str]):
+        collection = vector_store.get_collection(self.tenant)
+        for start in range(0, len(self.kept_ids), vector_store.CHROMA_BATCH_SIZE):
+            collection.update(ids=self.kept_ids[start:start + vector_store.CHROMA_BATCH_SIZE],
+                              metadatas=self.kept_metadatas[start:start + vector_store.CHROMA_BATCH_SIZE])
+        for start in range(0, len(stale), vector_store.CHROMA_BATCH_SIZE):
+            collection.delete(ids=stale[start:start + vector_store.CHROMA_BATCH_SIZE])
+
+
+def eviction_candidates(excess_bytes: int,
+                        keep: Optional[Tuple[str, str]] = None) -> List[Tuple[str, str]]:
+    """Least recently used (tenant, doc_id) pairs whose chunks and BM25 segments add up to excess_bytes"""
+    conn = _connection()
+    rows = conn.execute(
+        "SELECT tenant, doc_id, size_bytes FROM documents ORDER BY last_used ASC"
+    ).fetchall()
+
+    victims = []
+    for tenant, doc_id, size in rows:
+        if excess_bytes <= 0:
+            break
+        if (tenant, doc_id) == keep:
+            continue
+        victims.append((tenant, doc_id))
+        excess_bytes -= size + lexical_index.segment_bytes(doc_id, tenant)
+    return victims
+
+
+def delete_document(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT):
+    """Remove a document's chunks from its tenant collection or the exact index and from the registry"""
+    vector_store.get_collection(tenant).delete(where={"doc_id": doc_id})
+    exact_index.delete_index(doc_id, tenant)
+    lexical_index.delete_segment(doc_id, tenant)
+    remove_document(doc_id, tenant)
+
+
+def enforce_disk_budget(keep: Optional[Tuple[str, str]] = None):
+    """Evict least recently used documents while the disk usage exceeds the budget
+
+    Deleting chunks leaves their space in the stores' files, so the exact indexes
+    and Chroma's files are compacted afterwards, and collections left without
+    documents are dropped.
+    """
+    budget_bytes = int(DISK_BUDGET_MB * 1024 * 1024)
+    usage = disk_usage()
+    if usage <= budget_bytes:
+        return
+    tenants = set()
+    for tenant, doc_id in eviction_candidates(usage - budget_bytes, keep=keep):
+        try:
+            delete_document(doc_id, tenant)
+            tenants.add(tenant)
+            logging.info(f"Evicted cached document {doc_id[:12]} to stay within disk budget")
+        except Exception as e:
+            logging.error(f"Error evicting document {doc_id[:12]}: {e}")
+    for tenant in tenants:
+        exact_index.compact_index(tenant)
+        if not vector_store.get_collection(tenant).count():
+            vector_store.drop_collection(tenant)
+    vector_store.reclaim_space()
+    usage = disk_usage()
+    if usage > budget_bytes:
+        logging.warning(f"Disk usage is {usage / 2**20:.0f} MB after evicting, over the "
+                        f"{DISK_BUDGET_MB:.0f} MB budget")
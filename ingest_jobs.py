@@ -0,0 +1,323 @@
+"""Background ingestion: uploads are queued as jobs and indexed off the Streamlit script thread
+
+submit() stores the PDF under chroma_db/uploads and records a job in a SQLite table;
+INGEST_CONCURRENCY runner threads in the server process take jobs in order and run
+the usual extract -> chunk -> embed_and_store pipeline, with pages decoded on a
+process pool of INGEST_PDF_WORKERS. Progress (pages and chunks done) is written to
+the job row, so any session can poll it, and jobs keep running across Streamlit
+reruns and page reloads. Jobs left queued or running by a restart are resumed.
+
+Writes to Chroma stay in one process: a PersistentClient must not be shared by
+several writer processes. When several processes share CHROMA_PATH (Streamlit plus
+API workers), they all queue jobs in the table, but only the one holding the runner
+lock file indexes them; another takes over if it exits. Deleting a document is a job
+too (submit_delete), so it never races an ingestion of the same document: jobs for
+one document run one at a time, in the order they were queued.
+"""
+import importlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import resources
+import ingest_cache
+import metrics
+import pdf_utils
+import vector_store
+from chunking import iter_chunks
+from vector_store import DEFAULT_TENANT
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, no runner lock
+    fcntl = None
+
+JOBS_DB_PATH = os.path.join(vector_store.CHROMA_PATH, "ingest_jobs.sqlite3")
+UPLOADS_PATH = os.path.join(vector_store.CHROMA_PATH, "uploads")
+RUNNER_LOCK_PATH = os.path.join(vector_store.CHROMA_PATH, "ingest_jobs.lock")
+
+# Jobs indexed at the same time; the rest wait in the queue so several big uploads
+# don't compete for the embedding CPUs
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "1"))
+
+# Processes decoding pages for each running job
+INGEST_PDF_WORKERS = int(os.getenv("INGEST_PDF_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+
+# Queued or running jobs allowed per tenant
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "3"))
+
+# Minimum seconds between progress writes for a job
+PROGRESS_INTERVAL = 0.5
+
+# Seconds between checks of the job table for jobs queued by other processes
+POLL_INTERVAL = 1.0
+
+ACTIVE_STATES = ("queued", "running")
+
+JOB_COLUMNS = ("job_id", "tenant", "doc_id", "name", "backend", "action", "state", "pages_done",
+               "pages_total", "chunks_done", "error", "created_at", "started_at", "finished_at")
+
+
+def _connect():
+    os.makedirs(vector_store.CHROMA_PATH, exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    # action is index (an upload) or delete
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                    (job_id TEXT PRIMARY KEY, tenant TEXT, doc_id TEXT, name TEXT, backend TEXT,
+                     action TEXT DEFAULT 'index',
+                     state TEXT, pages_done INTEGER DEFAULT 0, pages_total INTEGER DEFAULT 0,
+                     chunks_done INTEGER DEFAULT 0, error TEXT, created_at REAL,
+                     started_at REAL, finished_at REAL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_tenant ON jobs (tenant, created_at)")
+    return conn
+
+
+def _update(job_id: str, **fields):
+    conn = _connect()
+    try:
+        assignments = ", ".join(f"{name}=?" for name in fields)
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id=?", (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _upload_path(job_id: str) -> str:
+    return os.path.join(UPLOADS_PATH, f"{job_id}.pdf")
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """A job's state and progress, or None"""
+    conn = _connect()
+    try:
+        row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+
+def list_jobs(tenant: str = DEFAULT_TENANT, active_only: bool = False, limit: int = 20,
+              action: str = "index") -> List[dict]:
+    """A tenant's most recent jobs of one action, newest first"""
+    query = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE tenant=? AND action=?"
+    if active_only:
+        query += " AND state IN ('queued', 'running')"
+    conn = _connect()
+    try:
+        rows = conn.execute(query + " ORDER BY created_at DESC LIMIT ?", (tenant, action, limit)).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+
+
+def submit(data: bytes, name: str, tenant: str = DEFAULT_TENANT, backend: str = "rag_utils_simple") -> str:
+    """Queue a PDF for indexing with backend (rag_utils or rag_utils_simple) and return its job id
+
+    An upload that is already being indexed returns the existing job; one that is
+    already indexed gets a job that is done immediately.
+    """
+    doc_id = ingest_cache.document_hash(data)
+    conn = _connect()
+    try:
+        active = conn.execute(
+            "SELECT job_id, action FROM jobs WHERE tenant=? AND doc_id=? AND state IN ('queued', 'running') "
+            "ORDER BY created_at DESC LIMIT 1",
+            (tenant, doc_id)
+        ).fetchone()
+        if active and active[1] == "index":
+            return active[0]
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        # Unless a delete is pending, in which case it is indexed again after it
+        if not active and ingest_cache.get_document(doc_id, tenant):
+            ingest_cache.touch_document(doc_id, tenant)
+            conn.execute("INSERT INTO jobs (job_id, tenant, doc_id, name, backend, state, created_at, "
+                         "started_at, finished_at) VALUES (?, ?, ?, ?, ?, 'done', ?, ?, ?)",
+                         (job_id, tenant, doc_id, name, backend, now, now, now))
+            conn.commit()
+            return job_id
+
+        pending = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE tenant=? AND action='index' AND state IN ('queued', 'running')",
+            (tenant,)
+        ).fetchone()[0]
+        if pending >= INGEST_MAX_PENDING:
+            raise Exception("Too many uploads are still being processed. Please wait for one to finish.")
+
+        os.makedirs(UPLOADS_PATH, exist_ok=True)
+        with open(_upload_path(job_id), "wb") as f:
+            f.write(data)
+        conn.execute("INSERT INTO jobs (job_id, tenant, doc_id, name, backend, state, created_at) "
+                     "VALUES (?, ?, ?, ?, ?, 'queued', ?)", (job_id, tenant, doc_id, name, backend, now))
+        conn.commit()
+    finally:
+        conn.close()
+
+    _get_runner().set()
+    return job_id
+
+
+def submit_delete(doc_id: str, tenant: str = DEFAULT_TENANT) -> str:
+    """Queue the removal of an indexed document and return the job id"""
+    document = ingest_cache.get_document(doc_id, tenant)
+    conn = _connect()
+    try:
+        job_id = uuid.uuid4().hex
+        conn.execute("INSERT INTO jobs (job_id, tenant, doc_id, name, action, state, created_at) "
+                     "VALUES (?, ?, ?, ?, 'delete', 'queued', ?)",
+                     (job_id, tenant, doc_id, document["name"] if document else "", time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+    _get_runner().set()
+    return job_id
+
+
+class _Progress:
+    """Counts pages and chunks of a running job and writes them at most every PROGRESS_INTERVAL"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.pages = 0
+        self.chunks = 0
+        self.written = 0.0
+
+    def update(self, pages: int = 0, chunks: int = 0):
+        self.pages += pages
+        self.chunks += chunks
+        if time.monotonic() - self.written >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        _update(self.job_id, pages_done=self.pages, chunks_done=self.chunks)
+        self.written = time.monotonic()
+
+
+def run_job(job_id: str):
+    """Index one queued job in the calling thread"""
+    job = get_job(job_id)
+    if job is None or job["state"] not in ACTIVE_STATES:
+        return
+    if job["action"] == "delete":
+        _delete(job)
+        return
+    path = _upload_path(job_id)
+    progress = _Progress(job_id)
+    _update(job_id, state="running", started_at=time.time(), pages_done=0, chunks_done=0, error=None)
+    try:
+        if not os.path.exists(path):
+            raise Exception("Upload file missing")
+        module = importlib.import_module(job["backend"])
+        _update(job_id, pages_total=pdf_utils.count_pages(path))
+
+        def pages():
+            for page_num, text in pdf_utils.iter_pdf_pages(path, workers=INGEST_PDF_WORKERS):
+                progress.update(pages=1)
+                yield f"\n=== Page {page_num} ===\n{text}"
+
+        def chunks():
+            for chunk in iter_chunks(pages()):
+                progress.update(chunks=1)
+                yield chunk
+
+        with metrics.span("ingest_job"):
+            module.embed_and_store(chunks(), doc_id=job["doc_id"], name=job["name"], tenant=job["tenant"])
+        progress.flush()
+        _update(job_id, state="done", finished_at=time.time())
+        logging.info(f"Ingestion job {job_id[:8]} done: {progress.pages} pages, {progress.chunks} chunks")
+    except Exception as e:
+        logging.error(f"Ingestion job {job_id[:8]} failed: {e}")
+        _update(job_id, state="failed", error=str(e), finished_at=time.time())
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _delete(job: dict):
+    _update(job["job_id"], state="running", started_at=time.time(), error=None)
+    try:
+        ingest_cache.delete_document(job["doc_id"], job["tenant"])
+        _update(job["job_id"], state="done", finished_at=time.time())
+        logging.info(f"Deleted document {job['doc_id'][:12]}")
+    except Exception as e:
+        logging.error(f"Deleting document {job['doc_id'][:12]} failed: {e}")
+        _update(job["job_id"], state="failed", error=str(e), finished_at=time.time())
+
+
+def _claim() -> Optional[str]:
+    """Mark the oldest queued job running and return its id, or None
+
+    A job waits while an earlier job for the same document is still running.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT job_id FROM jobs AS queued WHERE state='queued' AND NOT EXISTS "
+            "(SELECT 1 FROM jobs WHERE state='running' AND tenant=queued.tenant AND doc_id=queued.doc_id) "
+            "ORDER BY created_at LIMIT 1"
+        ).fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET state='running', started_at=? WHERE job_id=?", (time.time(), row[0]))
+        conn.commit()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def _worker(wake: threading.Event):
+    while True:
+        job_id = _claim()
+        if job_id is None:
+            wake.wait(POLL_INTERVAL)
+            wake.clear()
+            continue
+        run_job(job_id)
+
+
+_runner_lock = None
+
+
+def _lead(wake: threading.Event):
+    """Wait for the runner lock, then start the job threads in this process"""
+    global _runner_lock
+    os.makedirs(vector_store.CHROMA_PATH, exist_ok=True)
+    _runner_lock = open(RUNNER_LOCK_PATH, "a")
+    if fcntl is not None:
+        # Blocks while another process is running the jobs
+        fcntl.flock(_runner_lock, fcntl.LOCK_EX)
+    # Until now another process may have been writing; from now on only this one does
+    vector_store.become_writer()
+    # Jobs interrupted by a restart start over
+    conn = _connect()
+    try:
+        conn.execute("UPDATE jobs SET state='queued' WHERE state='running'")
+        conn.commit()
+    finally:
+        conn.close()
+    for i in range(INGEST_CONCURRENCY):
+        threading.Thread(target=_worker, args=(wake,), name=f"ingest-{i}", daemon=True).start()
+
+
+def _start_runner() -> threading.Event:
+    wake = threading.Event()
+    threading.Thread(target=_lead, args=(wake,), name="ingest-runner", daemon=True).start()
+    return wake
+
+
+def _get_runner() -> threading.Event:
+    """Event that wakes the job threads, started (and interrupted jobs resumed) on first use"""
+    return resources.get_resource("ingest_runner", _start_runner)
+
+
+def resume():
+    """Start the runner so jobs left over from a previous server process continue"""
+    _get_runner()
@@ -0,0 +1,215 @@
+"""BM25 keyword index over document chunks, kept next to the Chroma collections
+
+Dense embeddings are weak at exact identifiers (part numbers, clause numbers, codes),
+so every indexed document also gets a lexical segment: a sorted term array with
+offsets into flat postings arrays (chunk position, term frequency) plus the chunk
+lengths and ids. Segments are written as .npz files under chroma_db/lexical/ per
+tenant collection, loaded on first use and scored with NumPy. A query over many
+documents searches them merged into one segment (merge()), so its cost doesn't grow
+with the number of documents.
+"""
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import query_cache
+import vector_store
+
+LEXICAL_PATH = os.path.join(vector_store.CHROMA_PATH, "lexical")
+
+# Segments kept loaded per process; the least recently used are dropped beyond this
+LEXICAL_CACHE_SEGMENTS = int(os.getenv("LEXICAL_CACHE_SEGMENTS", "256"))
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words with internal dots, dashes or slashes stay whole, so "12.3", "QX-100" and
+# "A/B" are single terms
+TERM = re.compile(r"\w+(?:[./-]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TERM.findall(text.lower())
+
+
+class Segment:
+    """Immutable inverted index of one document's chunks"""
+
+    def __init__(self, ids, lengths, terms, offsets, postings, frequencies):
+        self.ids = ids
+        self.lengths = lengths
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.vocabulary = {term: i for i, term in enumerate(terms.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def postings_for(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk positions, term frequencies) of a term; empty arrays if absent"""
+        i = self.vocabulary.get(term)
+        if i is None:
+            return self.postings[:0], self.frequencies[:0]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.postings[start:end], self.frequencies[start:end]
+
+
+class SegmentBuilder:
+    """Accumulates chunks of a document as they are indexed and freezes them into a Segment"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.lengths: List[int] = []
+        self.counts: List[Counter] = []
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        for chunk_id, text in zip(ids, texts):
+            terms = tokenize(text)
+            self.ids.append(chunk_id)
+            self.lengths.append(len(terms))
+            self.counts.append(Counter(terms))
+
+    def build(self) -> Segment:
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for position, counts in enumerate(self.counts):
+            for term, frequency in counts.items():
+                postings.setdefault(term, []).append((position, frequency))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        flat = [entry for term in terms for entry in postings[term]]
+        return Segment(
+            ids=np.array(self.ids, dtype=str),
+            lengths=np.array(self.lengths, dtype=np.int32),
+            terms=np.array(terms, dtype=str),
+            offsets=offsets,
+            postings=np.array([position for position, _ in flat], dtype=np.int32),
+            frequencies=np.array([frequency for _, frequency in flat], dtype=np.float32),
+        )
+
+
+def _segment_path(tenant: str, doc_id: str) -> str:
+    return os.path.join(LEXICAL_PATH, vector_store.collection_name(tenant), f"{doc_id}.npz")
+
+
+# (tenant, doc_id) -> (file mtime, Segment)
+_segments = query_cache.LRUCache(maxsize=LEXICAL_CACHE_SEGMENTS, ttl=float("inf"))
+
+
+def save_segment(segment: Segment, doc_id: str, tenant: str = vector_store.DEFAULT_TENANT):
+    """Persist a document's segment, replacing any previous one"""
+    path = _segment_path(tenant, doc_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, ids=segment.ids, lengths=segment.lengths, terms=segment.terms,
+                 offsets=segment.offsets, postings=segment.postings,
+                 frequencies=segment.frequencies)
+    os.replace(tmp_path, path)
+    _segments.put((tenant, doc_id), (os.stat(path).st_mtime_ns, segment))
+
+
+def load_segment(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT) -> Optional[Segment]:
+    """A document's segment, or None if it has not been built"""
+    path = _segment_path(tenant, doc_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _segments.get((tenant, doc_id))
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with np.load(path) as data:
+        segment = Segment(**{name: data[name] for name in data.files})
+    _segments.put((tenant, doc_id), (mtime, segment))
+    return segment
+
+
+def segment_bytes(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT) -> int:
+    """Size of a document's segment file, 0 if it has none"""
+    try:
+        return os.path.getsize(_segment_path(tenant, doc_id))
+    except FileNotFoundError:
+        return 0
+
+
+def delete_segment(doc_id: str, tenant: str = vector_store.DEFAULT_TENANT):
+    _segments.pop((tenant, doc_id))
+    try:
+        os.remove(_segment_path(tenant, doc_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"Error deleting lexical index for {doc_id[:12]}: {e}")
+
+
+def merge(segments: List[Segment]) -> Optional[Segment]:
+    """One segment holding the chunks of the given segments (None for a missing one), in order"""
+    segments = [segment for segment in segments if segment is not None and len(segment)]
+    if len(segments) <= 1:
+        return segments[0] if segments else None
+    terms, term_ids = np.unique(np.concatenate([segment.terms for segment in segments]), return_inverse=True)
+    counts = np.concatenate([np.diff(segment.offsets) for segment in segments])
+    posting_terms = np.repeat(term_ids, counts)
+    bases = np.cumsum([0] + [len(segment) for segment in segments[:-1]])
+    postings = np.concatenate([segment.postings + base for segment, base in zip(segments, bases)])
+    frequencies = np.concatenate([segment.frequencies for segment in segments])
+    # Stable, so each term's postings stay in chunk order
+    order = np.argsort(posting_terms, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(posting_terms, minlength=len(terms)))
+    return Segment(
+        ids=np.concatenate([segment.ids for segment in segments]),
+        lengths=np.concatenate([segment.lengths for segment in segments]),
+        terms=terms,
+        offsets=offsets,
+        postings=postings[order].astype(np.int32),
+        frequencies=frequencies[order],
+    )
+
+
+def search(query: str, segments: List[Segment], top_k: int) -> List[Tuple[str, float]]:
+    """BM25 top_k (chunk id, score) over the given segments, best first"""
+    terms = list(dict.fromkeys(tokenize(query)))
+    segments = [segment for segment in segments if len(segment)]
+    if not terms or not segments:
+        return []
+
+    total_chunks = sum(len(segment) for segment in segments)
+    average_length = max(1.0, sum(float(segment.lengths.sum()) for segment in segments) / total_chunks)
+    postings = [[segment.postings_for(term) for term in terms] for segment in segments]
+    idf = []
+    for t in range(len(terms)):
+        df = sum(len(per_segment[t][0]) for per_segment in postings)
+        idf.append(math.log(1 + (total_chunks - df + 0.5) / (df + 0.5)))
+
+    ids, scores = [], []
+    for segment, per_segment in zip(segments, postings):
+        if not any(len(positions) for positions, _ in per_segment):
+            continue
+        segment_scores = np.zeros(len(segment), dtype=np.float32)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * segment.lengths / average_length)
+        for weight, (positions, frequencies) in zip(idf, per_segment):
+            segment_scores[positions] += weight * frequencies * (BM25_K1 + 1) / (frequencies + norms[positions])
+        hits = np.flatnonzero(segment_scores)
+        ids.append(segment.ids[hits])
+        scores.append(segment_scores[hits])
+    if not ids:
+        return []
+
+    ids = np.concatenate(ids)
+    scores = np.concatenate(scores)
+    if len(scores) > top_k:
+        best = np.argpartition(-scores, top_k)[:top_k]
+    else:
+        best = np.arange(len(scores))
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [(str(ids[i]), float(scores[i])) for i in best]
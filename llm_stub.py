@@ -0,0 +1,73 @@
+"""Local stand-in for a Gemini GenerativeModel, for benchmarks and offline runs
+
+Select it with LLM_BACKEND=stub. It answers after a fixed latency without any
+network access, echoing the question so different prompts get different answers.
+With stream=True the answer arrives in word chunks spaced by a configurable delay,
+like Gemini's streaming responses. fail_rate makes a fraction of calls raise, for
+exercising APIManager failover.
+"""
+import asyncio
+import os
+import random
+import time
+
+STUB_LATENCY = float(os.getenv("LLM_STUB_LATENCY", "0.5"))
+STUB_CHUNK_DELAY = float(os.getenv("LLM_STUB_CHUNK_DELAY", "0.05"))
+STUB_CHUNK_WORDS = int(os.getenv("LLM_STUB_CHUNK_WORDS", "3"))
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubGenerativeModel:
+    """Mimics GenerativeModel.generate_content with configurable latency and chunking
+
+    latency is the time to the first chunk (or to the whole answer without streaming);
+    chunk_delay is the gap between streamed chunks of chunk_words words.
+    """
+
+    def __init__(self, latency: float = STUB_LATENCY, reply: str = None,
+                 chunk_delay: float = STUB_CHUNK_DELAY, chunk_words: int = STUB_CHUNK_WORDS,
+                 fail_rate: float = 0.0):
+        self.latency = latency
+        self.reply = reply
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.fail_rate = fail_rate
+        self.calls = 0
+
+    def _maybe_fail(self):
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise RuntimeError("Stub model failure")
+
+    def _answer_for(self, prompt: str) -> str:
+        if self.reply is not None:
+            return self.reply
+        question = prompt.rsplit("Question:", 1)[-1].split("Answer:", 1)[0].strip()
+        return f"Stub answer to: {question or prompt[:80]}"
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        if stream:
+            return self._stream(self._answer_for(prompt))
+        time.sleep(self.latency)
+        self._maybe_fail()
+        return StubResponse(self._answer_for(prompt))
+
+    async def generate_content_async(self, prompt: str):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        self._maybe_fail()
+        return StubResponse(self._answer_for(prompt))
+
+    def _stream(self, answer: str):
+        time.sleep(self.latency)
+        self._maybe_fail()
+        words = answer.split(" ")
+        for i in range(0, len(words), self.chunk_words):
+            if i:
+                time.sleep(self.chunk_delay)
+            piece = " ".join(words[i:i + self.chunk_words])
+            yield StubResponse(piece if i + self.chunk_words >= len(words) else piece + " ")
@@ -0,0 +1,295 @@
+"""Timing spans, counters and Prometheus-style export for the RAG pipeline stages
+
+    with metrics.span("chroma_query"):
+        ...
+
+    @metrics.timed("chunk_text")
+    def chunk_text(...):
+
+Stage durations go into the rag_stage_seconds histogram (label stage) and failures
+into rag_stage_errors_total. Metrics are exported in the Prometheus text format from
+a local HTTP endpoint when METRICS_PORT is set, and/or written to METRICS_FILE every
+METRICS_FILE_INTERVAL seconds. With METRICS_PROFILE=cpu or memory, capture() profiles
+each request with cProfile or tracemalloc, one at a time, and writes the result to
+METRICS_PROFILE_DIR.
+"""
+import atexit
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import resources
+
+# Serve /metrics on 127.0.0.1:METRICS_PORT (unset or 0: no endpoint)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Periodically write the metrics to this file (unset: no file sink)
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+
+# Profile questions with capture(): cpu or memory (unset: off). Both profilers are
+# process-wide, so one request is profiled at a time and concurrent ones run unprofiled
+METRICS_PROFILE = os.getenv("METRICS_PROFILE", "")
+
+# Where capture() writes .prof files and tracemalloc reports
+METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", "profiles")
+
+# Seconds; spans run from sub-millisecond cache hits to multi-second PDF ingests
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(key, (list(counts), total, count)) for key, (counts, total, count) in series]
+        for key, (counts, total, count) in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_text(key, le)} {bucket_count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_text(key, le)} {count}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(key)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_label_text(key)} {value}" for key, value in values)
+        return lines
+
+
+stage_seconds = Histogram("rag_stage_seconds", "Time spent in each RAG pipeline stage")
+stage_errors = Counter("rag_stage_errors_total", "Exceptions raised out of each RAG pipeline stage")
+api_key_seconds = Histogram("api_key_request_seconds", "Latency of Gemini calls per API key")
+api_key_requests = Counter("api_key_requests_total", "Gemini calls per API key and outcome")
+
+REGISTRY = [stage_seconds, stage_errors, api_key_seconds, api_key_requests]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_file(path: str = None):
+    """Write the current metrics to path (default METRICS_FILE), replacing it atomically"""
+    path = path or METRICS_FILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+def _file_sink_loop():
+    while True:
+        time.sleep(METRICS_FILE_INTERVAL)
+        try:
+            write_file()
+        except OSError as e:
+            logging.error(f"Error writing metrics file: {e}")
+
+
+def _start_exporters():
+    server = None
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            logging.info(f"Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            # Another worker process already serves this port
+            logging.warning(f"Metrics endpoint not started: {e}")
+    if METRICS_FILE:
+        threading.Thread(target=_file_sink_loop, name="metrics-file", daemon=True).start()
+        atexit.register(write_file)
+    return server or True
+
+
+def _ensure_exporters():
+    if (METRICS_PORT or METRICS_FILE) and not resources.is_initialized("metrics_exporters"):
+        resources.get_resource("metrics_exporters", _start_exporters)
+
+
+def observe(stage: str, seconds: float):
+    _ensure_exporters()
+    stage_seconds.observe(seconds, stage=stage)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as one observation of stage; exceptions are counted and re-raised"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Decorator form of span(); generator functions are timed until they are exhausted or closed"""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def coroutine_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await function(*args, **kwargs)
+            return coroutine_wrapper
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                with span(stage):
+                    yield from function(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_api_call(key_label: str, seconds: float, error: Optional[Exception] = None):
+    """Per-key latency histogram and request/error counters for one Gemini call"""
+    _ensure_exporters()
+    api_key_seconds.observe(seconds, key=key_label)
+    api_key_requests.inc(key=key_label, outcome="error" if error else "ok")
+
+
+_capture_lock = threading.Lock()
+
+
+@contextmanager
+def capture(mode: Optional[str] = METRICS_PROFILE, name: str = "request"):
+    """Profile the enclosed request: mode "cpu" (cProfile), "memory" (tracemalloc) or None
+
+    Writes METRICS_PROFILE_DIR/<name>-<timestamp>.prof (load with pstats or snakeviz)
+    or a .txt report of the top allocation sites and the peak traced memory. Runs the
+    request unprofiled if another capture is in progress.
+    """
+    if mode not in ("cpu", "memory") or not _capture_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        with _profile(mode, name):
+            yield
+    finally:
+        _capture_lock.release()
+
+
+@contextmanager
+def _profile(mode: str, name: str):
+    os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(METRICS_PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+    if mode == "cpu":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+            logging.info(f"CPU profile written to {path}.prof\n{summary.getvalue()}")
+        return
+
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(25)
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    try:
+        yield
+    finally:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_here:
+            tracemalloc.stop()
+        top = after.compare_to(before, "lineno")[:25]
+        with open(f"{path}.txt", "w") as f:
+            f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n")
+            f.writelines(f"{stat}\n" for stat in top)
+        logging.info(f"Memory profile written to {path}.txt (peak {peak / 1024 / 1024:.1f} MiB)")
@@ -1,19 +1,88 @@
-import pypdf
+import io
+import os
 import logging
-from typing import Optional
+import time
+import metrics
+import resources
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, Tuple
 
-def extract_text_from_pdf(pdf_file) -> Optional[str]:
+# Worker processes used to decode pages; pypdf is pure Python, so threads would not help
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+
+# Per-process reader used by pool workers
+_worker_reader = None
+
+
+def _read_bytes(pdf_file) -> bytes:
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as f:
+            return f.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+def _init_worker(data: bytes):
+    global _worker_reader
+    _worker_reader = resources.lazy_import("pypdf").PdfReader(io.BytesIO(data))
+
+
+def _extract_page(page_index: int) -> str:
+    return _worker_reader.pages[page_index].extract_text() or ""
+
+
+def count_pages(pdf_file) -> int:
+    """Number of pages in a PDF, without extracting any text"""
+    try:
+        return len(resources.lazy_import("pypdf").PdfReader(io.BytesIO(_read_bytes(pdf_file))).pages)
+    except Exception as e:
+        logging.error(f"Error processing PDF: {e}")
+        raise Exception("Failed to process PDF. Please ensure the file is not corrupted.")
+
+
+def iter_pdf_pages(pdf_file, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) in page order as each page is decoded"""
+    workers = PDF_WORKERS if workers is None else workers
     try:
-        reader = pypdf.PdfReader(pdf_file)
-        text = ""
+        data = _read_bytes(pdf_file)
+        reader = resources.lazy_import("pypdf").PdfReader(io.BytesIO(data))
+        page_count = len(reader.pages)
+    except Exception as e:
+        logging.error(f"Error processing PDF: {e}")
+        raise Exception("Failed to process PDF. Please ensure the file is not corrupted.")
+
+    if workers <= 1 or page_count < 2 * workers:
         for page_num, page in enumerate(reader.pages, 1):
             try:
-                page_text = page.extract_text() or ""
-                text += f"\n=== Page {page_num} ===\n{page_text}"
+                start = time.perf_counter()
+                text = page.extract_text() or ""
+                metrics.observe("extract_page", time.perf_counter() - start)
+                yield page_num, text
             except Exception as e:
                 logging.error(f"Error extracting text from page {page_num}: {e}")
-                continue
-        return text.strip() if text else None
-    except Exception as e:
-        logging.error(f"Error processing PDF: {e}")
-        raise Exception("Failed to process PDF. Please ensure the file is not corrupted.")
\ No newline at end of file
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,))
+    try:
+        futures = [executor.submit(_extract_page, i) for i in range(page_count)]
+        for page_num, future in enumerate(futures, 1):
+            try:
+                yield page_num, future.result()
+            except Exception as e:
+                logging.error(f"Error extracting text from page {page_num}: {e}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_text(pdf_file, workers: Optional[int] = None) -> Iterator[str]:
+    """Yield each page's text prefixed with its '=== Page N ===' marker"""
+    for page_num, page_text in iter_pdf_pages(pdf_file, workers):
+        yield f"\n=== Page {page_num} ===\n{page_text}"
+
+
+@metrics.timed("extract_text_from_pdf")
+def extract_text_from_pdf(pdf_file, workers: Optional[int] = None) -> Optional[str]:
+    text = "".join(iter_pdf_text(pdf_file, workers))
+    return text.strip() if text else None
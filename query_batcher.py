@@ -0,0 +1,101 @@
+"""Micro-batching of query embeddings across concurrent sessions
+
+A single query is a batch-of-one forward pass, and most of its cost is per call,
+not per text. QueryBatcher funnels encode requests from every session thread to
+one background thread. It takes all queries waiting when it becomes free, plus any
+that arrive within QUERY_BATCH_WAIT_MS, encodes them in one call, and hands each
+caller its own row. Batches also grow naturally while the previous batch is
+encoding. The wait only applies once the previous batch held more than one query,
+so a single user pays no extra latency.
+"""
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+from typing import Callable, List
+
+import numpy as np
+
+import metrics
+
+# Most queries encoded in one call (1 disables batching)
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+
+# How long a batch waits for more queries after the first one arrives
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "2"))
+
+
+class QueryBatcher:
+    """Encodes texts from concurrent callers together with encode_batch(texts) -> rows"""
+
+    def __init__(self, encode_batch: Callable[[List[str]], object], max_batch: int = QUERY_BATCH_SIZE,
+                 max_wait_ms: float = QUERY_BATCH_WAIT_MS, name: str = "query-batcher"):
+        self.encode_batch = encode_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+        self._last_size = 0
+        self._pending = queue.Queue()
+        self._stats_lock = threading.Lock()
+        if self.max_batch > 1:
+            threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def encode(self, text: str) -> np.ndarray:
+        """Embedding of one text, computed in a batch with any concurrent callers"""
+        if self.max_batch == 1:
+            self._count(1)
+            return np.asarray(self.encode_batch([text])[0], dtype=np.float32)
+        future = concurrent.futures.Future()
+        self._pending.put((text, future))
+        return future.result()
+
+    def _count(self, queries: int):
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += queries
+
+    def _collect(self) -> list:
+        batch = [self._pending.get()]
+        # Waiting for company only pays off when queries are arriving concurrently
+        deadline = time.monotonic() + (self.max_wait if self._last_size > 1 else 0.0)
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._pending.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        self._last_size = len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Identical concurrent queries are encoded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                with metrics.span("embed_query_batch"):
+                    rows = self.encode_batch(texts)
+                # Rows are copied so a cached embedding doesn't pin the whole batch
+                embeddings = {text: np.array(row, dtype=np.float32) for text, row in zip(texts, rows)}
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self._count(len(batch))
+            for text, future in batch:
+                future.set_result(embeddings[text])
+
+    def stats(self) -> dict:
+        """Batches run, queries served and the mean batch size"""
+        with self._stats_lock:
+            return {"batches": self.batches, "queries": self.queries,
+                    "mean_batch_size": self.queries / self.batches if self.batches else 0.0}
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Entries kept per cache and how long they stay valid
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters"""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+
+# Normalized query text -> float32 query embedding
+embedding_cache = LRUCache()
+
+# (tenant, documents, query embedding digest, collection version, top_k) -> chunks; the
+# version (ingest_cache.get_version) changes with the tenant's documents, in every process,
+# so results computed against the old contents are never served again
+retrieval_cache = LRUCache()
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query (the embedding model is uncased)"""
+    return " ".join(query.lower().split())
+
+
+def embed_query(query: str, embed_fn, space: str = "") -> np.ndarray:
+    """Embedding of a query, computed with embed_fn(text) only on a cache miss
+
+    space names the embedding model, so backends with different vectors don't share entries.
+    """
+    text = normalize_query(query)
+    key = (space, text)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        embedding = np.asarray(embed_fn(text), dtype=np.float32)
+        embedding_cache.put(key, embedding)
+    return embedding
+
+
+def retrieval_key(tenant: str, doc_id, embedding: np.ndarray, top_k: int, version: int) -> tuple:
+    digest = hashlib.sha1(np.ascontiguousarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+    documents = doc_id if doc_id is None or isinstance(doc_id, str) else tuple(sorted(doc_id))
+    return (tenant, documents, digest, version, top_k)
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters for sizing the query caches"""
+    return {"embedding": embedding_cache.stats(), "retrieval": retrieval_cache.stats()}
@@ -1,9 +1,25 @@
-import chromadb
-from sentence_transformers import SentenceTransformer
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 import logging
+import resources
+import metrics
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import embedding_backends
+import exact_index
+import ingest_cache
+import query_cache
+import generation
+import retrieval
+import lexical_index
+from chunking import iter_batches, chunk_texts, chunk_metadata
+# chunk_text used to be defined here; still importable from this module
+from chunking import chunk_text  # noqa: F401
+from context_packing import pack_context, CONTEXT_MAX_TOKENS
+from query_batcher import QueryBatcher
+import vector_store
+from vector_store import DEFAULT_TENANT
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,105 +27,174 @@ logging.basicConfig(level=logging.INFO)
 # Load environment variables
 load_dotenv()
 
-# Initialize embedding model
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Initialize ChromaDB with persistent storage
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-
-# Create or get collection
-try:
-    collection = chroma_client.get_or_create_collection(
-        name="pdf_chunks",
-        metadata={"hnsw:space": "cosine"}
-    )
-except Exception as e:
-    logging.error(f"Error initializing ChromaDB: {e}")
-    collection = None
-
-def chunk_text(text, chunk_size=1000, overlap=100):
-    """Split text into chunks with overlap for better context preservation"""
-    if not text:
-        return []
-    
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        chunks.append(chunk)
-    return chunks
-
-def embed_and_store(chunks):
-    """Store document chunks with their embeddings"""
-    if not collection:
-        raise Exception("ChromaDB collection not initialized")
+# Embedding backend (EMBEDDING_BACKEND: torch, onnx or onnx-int8), created on first use
+# rather than at import time; collections are tagged with its vector space
+EMBEDDING_SPACE = embedding_backends.embedding_space()
+
+def get_model():
+    """Embedding backend, loaded on first use and shared process-wide"""
+    return resources.get_resource("embedding_model", embedding_backends.load_backend)
+
+# Embedding pipeline: chunks are encoded EMBED_BATCH_SIZE at a time on EMBED_WORKERS
+# CPU processes, and each window of EMBED_BATCH_SIZE * EMBED_WORKERS chunks is upserted
+# while the next one is being encoded
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+def _get_encode_pool():
+    """Start the sentence-transformers worker processes once per process"""
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            # One torch thread per worker process, so workers don't oversubscribe the cores
+            previous = os.environ.get("OMP_NUM_THREADS")
+            os.environ["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // EMBED_WORKERS))
+            try:
+                _encode_pool = get_model().model.start_multi_process_pool(target_devices=["cpu"] * EMBED_WORKERS)
+            finally:
+                if previous is None:
+                    del os.environ["OMP_NUM_THREADS"]
+                else:
+                    os.environ["OMP_NUM_THREADS"] = previous
+            atexit.register(get_model().model.stop_multi_process_pool, _encode_pool)
+        return _encode_pool
+
+def _create_query_batcher():
+    return QueryBatcher(lambda texts: get_model().encode(texts, batch_size=len(texts)))
+
+def get_query_batcher():
+    """Batches query embeddings from concurrent sessions into one model call"""
+    return resources.get_resource("query_batcher", _create_query_batcher)
+
+@metrics.timed("embed_query")
+def embed_query(query):
+    """Cached embedding of a query, encoded together with concurrent queries on a miss"""
+    return query_cache.embed_query(query, get_query_batcher().encode, EMBEDDING_SPACE)
+
+def encode_chunks(chunks):
+    """Encode a list of chunks into a float32 NumPy array of shape (len(chunks), dim)"""
+    model = get_model()
+    # The PyTorch backend spreads large windows over worker processes; ONNX Runtime
+    # already uses every core within a call
+    if model.name == "torch" and EMBED_WORKERS > 1 and len(chunks) > EMBED_BATCH_SIZE:
+        return model.model.encode(chunks, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True,
+                                  pool=_get_encode_pool())
+    return model.encode(chunks, batch_size=EMBED_BATCH_SIZE)
+
+@metrics.timed("embed_and_store")
+def embed_and_store(chunks, doc_id=None, name="", tenant=DEFAULT_TENANT):
+    """Store document chunks with their embeddings for the tenant, reusing an already indexed copy
+
+    chunks may be a list or a stream (e.g. from iter_chunks); a stream is embedded while
+    it is still being produced, but then doc_id must be given. A document with the same
+    name as one already indexed for the tenant replaces it, re-embedding only the chunks
+    whose text changed. Documents go to the tenant's exact index while it holds at most
+    exact_index.EXACT_INDEX_MAX_CHUNKS chunks, and to its Chroma collection after that.
+    """
+    ingest_cache.check_embedding_space(EMBEDDING_SPACE, tenant)
+    collection = vector_store.get_collection(tenant, EMBEDDING_SPACE)
     
-    if not chunks:
-        raise Exception("No text chunks to process")
+    if doc_id is None:
+        chunks = list(chunks)
+        doc_id = ingest_cache.document_hash("\n".join(chunk_texts(chunks)).encode("utf-8"))
+
+    indexed = ingest_cache.get_document(doc_id, tenant)
+    if indexed and indexed["space"] == EMBEDDING_SPACE:
+        ingest_cache.touch_document(doc_id, tenant)
+        logging.info(f"Reusing cached index for document {doc_id[:12]}")
+        return doc_id
 
     try:
-        # Clear existing collection
-        existing_ids = collection.get()['ids']
-        if existing_ids:
-            collection.delete(ids=existing_ids)
-        
-        # Process chunks
-        embeddings = model.encode(chunks).tolist()
-        
-        # Add all chunks at once
-        collection.add(
-            documents=chunks,
-            embeddings=embeddings,
-            ids=[str(i) for i in range(len(chunks))]
-        )
-        
-        logging.info(f"Successfully processed {len(chunks)} chunks")
+        # A new version of an already indexed document only embeds the chunks that changed
+        diff = ingest_cache.VersionDiff(doc_id, name, tenant)
+        lexical = lexical_index.SegmentBuilder()
+        # Small documents get an exact index, large ones the Chroma collection
+        document = exact_index.DocumentWriter(collection, doc_id, tenant, diff.previous)
+
+        # Encode window by window; the previous window is upserted while the next is encoded
+        window_size = EMBED_BATCH_SIZE * max(1, EMBED_WORKERS)
+        chunk_count = 0
+        size_bytes = 0
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for window in iter_batches(chunks, window_size):
+                start = chunk_count
+                texts = chunk_texts(window)
+                ids = diff.chunk_ids(texts)
+                metadatas = [chunk_metadata(chunk, doc_id, start + i) for i, chunk in enumerate(window)]
+                changed = diff.split(ids, metadatas)
+                lexical.add(ids, texts)
+                chunk_count += len(window)
+                size_bytes += ingest_cache.estimate_size(texts)
+                if not changed:
+                    continue
+                embeddings = encode_chunks([texts[i] for i in changed])
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(
+                    document.add,
+                    [ids[i] for i in changed],
+                    embeddings,
+                    [texts[i] for i in changed],
+                    [metadatas[i] for i in changed]
+                )
+            if pending is not None:
+                pending.result()
+        # An empty document must not leave an unregistered index behind
+        if chunk_count:
+            document.keep(diff.kept_ids, diff.kept_metadatas)
+            store = document.commit()
     except Exception as e:
         logging.error(f"Error in embedding and storing: {e}")
         raise Exception(f"Failed to process document: {str(e)}")
 
-def retrieve_relevant_chunks(query, top_k=3):
-    """Retrieve most relevant chunks for the query"""
-    if not collection:
-        raise Exception("ChromaDB collection not initialized")
+    if not chunk_count:
+        raise Exception("No text chunks to process")
+
+    lexical_index.save_segment(lexical.build(), doc_id, tenant)
+    diff.finish()
+    ingest_cache.register_document(doc_id, name, chunk_count, size_bytes, tenant, source_id=diff.source_id,
+                                   store=store, space=EMBEDDING_SPACE)
+    ingest_cache.enforce_disk_budget(keep=(tenant, doc_id))
+    logging.info(f"Successfully processed {chunk_count} chunks")
+    return doc_id
+
+@metrics.timed("retrieve_relevant_chunks")
+def retrieve_chunks(query, top_k=3, doc_id=None, tenant=DEFAULT_TENANT):
+    """Most relevant chunks for the query as retrieval.Hit records (id, text, metadata), best first"""
+    ingest_cache.check_embedding_space(EMBEDDING_SPACE, tenant)
+    version = ingest_cache.get_version(tenant)
+    collection = vector_store.get_collection(tenant, EMBEDDING_SPACE, version)
 
     try:
-        query_emb = model.encode([query]).tolist()[0]
-        results = collection.query(
-            query_embeddings=[query_emb],
-            n_results=top_k
-        )
-        return results['documents'][0] if results['documents'] else []
+        query_emb = embed_query(query)
+        key = query_cache.retrieval_key(tenant, doc_id, query_emb, top_k, version)
+        cached = query_cache.retrieval_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        hits = retrieval.retrieve(collection, query, query_emb, top_k, doc_id, tenant, version)
+        query_cache.retrieval_cache.put(key, hits)
+        return list(hits)
     except Exception as e:
         logging.error(f"Error in retrieval: {e}")
         return []
 
-def answer_question(question, context):
-    """Generate response using Gemini model"""
-    try:
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        model = genai.GenerativeModel("gemini-1.5-pro")
-        
-        # Check if it's a general conversation
-        general_chat_keywords = ['hi', 'hello', 'hey', 'how are you', 'good morning', 'good afternoon', 'good evening', 'thanks', 'thank you']
-        is_general_chat = any(keyword in question.lower() for keyword in general_chat_keywords)
-        
-        if is_general_chat:
-            prompt = f"""You are a friendly and helpful AI assistant named PDF Chatbot. 
-            Respond to this greeting in a friendly and engaging way: {question}
-            Keep the response concise but warm and welcoming."""
-        else:
-            prompt = f"""You are a helpful AI assistant. Answer the question based on the provided context.
-            Be friendly and conversational in your response. If the question isn't related to the 
-            context, politely mention that you're here to help with the PDF content.
-
-            Context: {context}
-
-            Question: {question}
-            Answer: """
-
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        logging.error(f"Error generating content from Gemini API: {e}")
-        return "I apologize, but I'm having trouble responding right now. Please try again in a moment."
\ No newline at end of file
+def retrieve_relevant_chunks(query, top_k=3, doc_id=None, tenant=DEFAULT_TENANT):
+    """Retrieve most relevant chunks for the query from the tenant's documents (or only doc_id)"""
+    return [hit.text for hit in retrieve_chunks(query, top_k, doc_id, tenant)]
+
+def retrieve_context(query, top_k=3, doc_id=None, tenant=DEFAULT_TENANT, max_tokens=CONTEXT_MAX_TOKENS):
+    """Prompt context for the query: retrieved chunks in page order, overlaps removed, within max_tokens"""
+    return pack_context(retrieve_chunks(query, top_k, doc_id, tenant), max_tokens)
+
+def answer_question(question, context, history=""):
+    """Generate response using Gemini model, reusing cached answers to near-identical questions"""
+    return generation.answer_question(question, context, embed_fn=embed_query, history=history)
+
+def answer_question_stream(question, context, history=""):
+    """Stream the Gemini answer chunk by chunk (see generation.stream_answer)"""
+    return generation.stream_answer(question, context, embed_fn=embed_query, history=history)
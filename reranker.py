@@ -0,0 +1,133 @@
+"""Optional second retrieval stage: rerank over-fetched chunks with a CPU cross-encoder
+
+A cross-encoder reads the query and a chunk together, which ranks far better than
+comparing two independent embeddings, at the cost of one model pass per pair. Pairs
+are scored in batches on a background thread with scores cached per (query, chunk);
+if they are not ready within RERANK_TIMEOUT_MS the candidates are returned in their
+retrieval order instead, and the scores still land in the cache for next time.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import List, Optional
+
+import metrics
+import resources
+from chunking import count_tokens
+from query_cache import LRUCache, normalize_query
+
+# Set RERANK=1 to enable the second stage
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Chunks fetched from the first stage for the cross-encoder to choose from
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "12"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+
+# Latency ceiling for scoring (not counting the first model load)
+RERANK_TIMEOUT_MS = float(os.getenv("RERANK_TIMEOUT_MS", "300"))
+
+# Token budget for the chunks handed to the prompt (at least one chunk is always kept)
+RERANK_MAX_TOKENS = int(os.getenv("RERANK_MAX_TOKENS", "768"))
+
+# (normalized query, chunk digest) -> cross-encoder score
+score_cache = LRUCache()
+
+_stats = {"reranked": 0, "fallbacks": 0}
+_stats_lock = threading.Lock()
+
+
+def _load_model():
+    sentence_transformers = resources.lazy_import("sentence_transformers")
+    return sentence_transformers.CrossEncoder(RERANKER_MODEL, device="cpu")
+
+
+def get_model():
+    """Cross-encoder, loaded on first use and shared process-wide"""
+    return resources.get_resource("reranker_model", _load_model)
+
+
+def _scoring_pool() -> ThreadPoolExecutor:
+    # One thread: the model already uses every core for a batch
+    return resources.get_resource(
+        "reranker_pool", lambda: ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank"))
+
+
+def _count(outcome: str):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def _predict(model, query: str, chunks: List[str], keys: list, scores: list, pending: List[int]):
+    """Runs on the scoring thread; caches each batch as it finishes"""
+    for start in range(0, len(pending), RERANK_BATCH_SIZE):
+        batch = pending[start:start + RERANK_BATCH_SIZE]
+        batch_scores = model.predict([(query, chunks[i]) for i in batch],
+                                     batch_size=RERANK_BATCH_SIZE, show_progress_bar=False)
+        for i, value in zip(batch, batch_scores):
+            scores[i] = float(value)
+            score_cache.put(keys[i], scores[i])
+
+
+def score(query: str, chunks: List[str], timeout_ms: float = RERANK_TIMEOUT_MS) -> Optional[List[float]]:
+    """Cross-encoder scores of (query, chunk) pairs; None if timeout_ms ran out first"""
+    query = normalize_query(query)
+    keys = [(query, hashlib.sha1(chunk.encode("utf-8")).hexdigest()) for chunk in chunks]
+    scores = [score_cache.get(key) for key in keys]
+    pending = [i for i, value in enumerate(scores) if value is None]
+    if not pending:
+        return scores
+
+    # Loaded before the clock starts, so the first query isn't a guaranteed fallback
+    model = get_model()
+    future = _scoring_pool().submit(_predict, model, query, chunks, keys, scores, pending)
+    try:
+        future.result(timeout=timeout_ms / 1000)
+    except TimeoutError:
+        # Not started yet (queued behind another query): drop it; otherwise it finishes
+        # in the background and its scores are cached for next time
+        future.cancel()
+        return None
+    return scores
+
+
+def trim_to_budget(chunks: List[str], max_tokens: int = RERANK_MAX_TOKENS) -> List[str]:
+    """Leading chunks that fit in max_tokens (always at least the first)"""
+    kept, used = [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk)
+        if kept and used + tokens > max_tokens:
+            break
+        kept.append(chunk)
+        used += tokens
+    return kept
+
+
+@metrics.timed("rerank")
+def rerank(query: str, chunks: List[str], top_k: int) -> List[int]:
+    """Indices into chunks of the best top_k by cross-encoder score, within the token budget
+
+    Falls back to the given (retrieval) order if the model fails or is too slow.
+    """
+    order = list(range(min(top_k, len(chunks))))
+    if len(chunks) > 1:
+        try:
+            scores = score(query, chunks)
+        except Exception as e:
+            logging.error(f"Error in reranking: {e}")
+            scores = None
+        if scores is None:
+            _count("fallbacks")
+        else:
+            _count("reranked")
+            order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)[:top_k]
+    return order[:len(trim_to_budget([chunks[i] for i in order]))]
+
+
+def stats() -> dict:
+    """Rerank and fallback counts plus score cache hits"""
+    with _stats_lock:
+        counts = dict(_stats)
+    return {**counts, "score_cache": score_cache.stats()}
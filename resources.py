@@ -0,0 +1,100 @@
+"""Process-wide registry of lazily created, shared resources
+
+Heavy objects (the embedding model, the ChromaDB client, the users database)
+are created on first use instead of at import time, once per process, and
+shared by every Streamlit session and worker thread. Each import and
+initialization is timed so cold-start cost can be inspected with
+``python resources.py``.
+"""
+import importlib
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+_instances: Dict[str, object] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+# (component, seconds) in the order components were first initialized
+_timings: List[Tuple[str, float]] = []
+
+
+def _record(component: str, seconds: float):
+    _timings.append((component, seconds))
+    logging.info(f"Initialized {component} in {seconds * 1000:.1f} ms")
+
+
+def get_resource(name: str, factory: Callable[[], object]):
+    """Return the shared instance for name, creating it with factory() on first use"""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+
+    # Per-resource lock: loading the model does not block opening the database
+    with lock:
+        instance = _instances.get(name)
+        if instance is None:
+            start = time.perf_counter()
+            instance = factory()
+            _record(name, time.perf_counter() - start)
+            _instances[name] = instance
+        return instance
+
+
+def reset_resource(name: str):
+    """Drop the shared instance for name; the next get_resource creates a new one"""
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        _instances.pop(name, None)
+
+
+def is_initialized(name: str) -> bool:
+    return name in _instances
+
+
+def lazy_import(module_name: str):
+    """Import a heavy module on first use, recording how long the import took"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    return get_resource(f"import {module_name}", lambda: importlib.import_module(module_name))
+
+
+def startup_report() -> List[Tuple[str, float]]:
+    """(component, seconds) for every import and initialization done so far"""
+    return list(_timings)
+
+
+def format_startup_report() -> str:
+    """Startup report as a table; a component's time includes any lazy imports it triggered"""
+    lines = [f"{'component':<40} {'ms':>10}"]
+    for component, seconds in startup_report():
+        lines.append(f"{component:<40} {seconds * 1000:>10.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Run as a script this file is __main__; record into the registry the app modules use
+    import resources
+
+    # Cold-start report: what the login page costs, then what the first upload and question add
+    for module_name in ("auth", "pdf_utils", "rag_utils_simple", "rag_utils"):
+        start = time.perf_counter()
+        importlib.import_module(module_name)
+        resources._record(f"import {module_name} (module)", time.perf_counter() - start)
+
+    import auth
+    import rag_utils
+    import vector_store
+
+    auth.ensure_db()
+    vector_store.get_collection()
+    rag_utils.get_model()
+    resources.lazy_import("google.generativeai")
+    print(resources.format_startup_report())
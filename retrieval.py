@@ -0,0 +1,155 @@
+"""Chunk retrieval shared by rag_utils and rag_utils_simple
+
+Dense nearest neighbours from the Chroma collection and the tenant's exact index
+(exact_index) are fused with BM25 results from
+lexical_index by reciprocal rank fusion, so exact identifiers that the embedding
+model does not capture still reach the prompt. With RERANK=1 a larger candidate set
+is reranked by reranker.py before it is cut to top_k.
+"""
+import os
+from typing import Iterable, List, NamedTuple, Optional
+
+import exact_index
+import ingest_cache
+import lexical_index
+import metrics
+import query_cache
+import reranker
+import vector_store
+from vector_store import DEFAULT_TENANT
+
+# Set HYBRID_SEARCH=0 to use dense similarity only
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+
+# Candidates taken from each ranking before fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+
+# Rank offset of reciprocal rank fusion; 60 is the value from the original paper
+RRF_K = 60
+
+# BM25 hits scoring below this fraction of the best hit only match common words of
+# the query; fusing them would outvote a single exact identifier match
+BM25_MIN_SCORE_RATIO = float(os.getenv("BM25_MIN_SCORE_RATIO", "0.5"))
+
+# (tenant, document version, doc_ids or True for all) -> merged BM25 segment; the
+# version changes with the tenant's documents, so stale entries are never hit again
+_merged_segments = query_cache.LRUCache(maxsize=16, ttl=float("inf"))
+
+# (tenant, document version) -> the tenant's registry entries
+_documents = query_cache.LRUCache(ttl=float("inf"))
+
+
+def tenant_documents(tenant: str, version: int) -> List[dict]:
+    """The tenant's documents at version, read from the registry once per version"""
+    documents = _documents.get((tenant, version))
+    if documents is None:
+        documents = ingest_cache.list_documents(tenant)
+        _documents.put((tenant, version), documents)
+    return documents
+
+
+class Hit(NamedTuple):
+    """A retrieved chunk: its id, text and metadata (doc_id, chunk, page)"""
+    id: str
+    text: str
+    metadata: dict
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[str]:
+    """Merge rankings of ids by summed 1 / (k + rank); ties keep first-seen order"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def fuse(dense_ids: List[str], lexical_results: List[tuple], top_k: int) -> List[str]:
+    """Top_k ids by RRF of the dense ranking and the strong BM25 (id, score) hits
+
+    Lexical hits come first on ties, so an exact match ranks level with the best
+    dense neighbour.
+    """
+    if not lexical_results:
+        return dense_ids[:top_k]
+    floor = BM25_MIN_SCORE_RATIO * lexical_results[0][1]
+    lexical_ids = [chunk_id for chunk_id, score in lexical_results if score >= floor]
+    return reciprocal_rank_fusion([lexical_ids, dense_ids])[:top_k]
+
+
+def lexical_segments(doc_id, tenant: str, documents: List[dict], version: int) -> list:
+    """Segments to search for a query restricted to doc_id (all of documents if None)
+
+    A query over several documents searches them merged into one segment, built once
+    per version of the tenant's documents.
+    """
+    if isinstance(doc_id, str):
+        segment = lexical_index.load_segment(doc_id, tenant)
+        return [segment] if segment is not None else []
+    doc_ids = tuple(document["doc_id"] for document in documents) if doc_id is None else tuple(doc_id)
+    key = (tenant, version, doc_id is None or doc_ids)
+    segment = _merged_segments.get(key)
+    if segment is None:
+        segment = lexical_index.merge([lexical_index.load_segment(document, tenant) for document in doc_ids])
+        if segment is None:
+            return []
+        _merged_segments.put(key, segment)
+    return [segment]
+
+
+def _split_by_store(doc_id, documents: List[dict]) -> tuple:
+    """Documents a query is restricted to, as (Chroma doc filter, exact index doc_ids)"""
+    stores = {document["doc_id"]: document["store"] for document in documents}
+    if doc_id is None:
+        return None, [document for document, store in stores.items() if store == exact_index.ExactStore.name]
+    doc_ids = [doc_id] if isinstance(doc_id, str) else list(doc_id)
+    exact = [document for document in doc_ids if stores.get(document) == exact_index.ExactStore.name]
+    return [document for document in doc_ids if document not in exact], exact
+
+
+def search(collection, query: str, query_embedding, top_k: int = 3, doc_id=None,
+           tenant: str = DEFAULT_TENANT, version: Optional[int] = None) -> List[Hit]:
+    """The top_k chunks for a query, by fused dense and BM25 rank
+
+    version is the tenant's ingest_cache.get_version(), if the caller has read it.
+    """
+    candidates = max(top_k, HYBRID_CANDIDATES) if HYBRID_SEARCH else top_k
+    if version is None:
+        version = ingest_cache.get_version(tenant)
+    documents = tenant_documents(tenant, version)
+    chroma_docs, exact_docs = _split_by_store(doc_id, documents)
+    chroma = vector_store.ChromaStore(collection)
+    exact = exact_index.ExactStore(tenant, vector_store.collection_space(collection))
+    with metrics.span("chroma_query"):
+        dense = chroma.query(query_embedding, candidates, chroma_docs)
+    if exact_docs:
+        with metrics.span("exact_query"):
+            dense = sorted(dense + exact.query(query_embedding, candidates, exact_docs), key=lambda hit: hit[3])
+    dense = dense[:candidates]
+    dense_ids = [chunk_id for chunk_id, _, _, _ in dense]
+    hits = {chunk_id: Hit(chunk_id, text, metadata) for chunk_id, text, metadata, _ in dense}
+    if not HYBRID_SEARCH:
+        return [hits[chunk_id] for chunk_id in dense_ids[:top_k]]
+
+    with metrics.span("bm25_search"):
+        lexical_results = lexical_index.search(query, lexical_segments(doc_id, tenant, documents, version), candidates)
+    fused = fuse(dense_ids, lexical_results, top_k)
+
+    missing = [chunk_id for chunk_id in fused if chunk_id not in hits]
+    if missing:
+        fetched = chroma.get(missing)
+        if exact_docs:
+            fetched += exact.get(missing, exact_docs)
+        for chunk_id, text, metadata in fetched:
+            hits[chunk_id] = Hit(chunk_id, text, metadata)
+    return [hits[chunk_id] for chunk_id in fused if chunk_id in hits]
+
+
+def retrieve(collection, query: str, query_embedding, top_k: int = 3, doc_id=None,
+             tenant: str = DEFAULT_TENANT, version: Optional[int] = None) -> List[Hit]:
+    """search(), followed by cross-encoder reranking of a larger candidate set if RERANK is on"""
+    if not reranker.RERANK:
+        return search(collection, query, query_embedding, top_k, doc_id, tenant, version)
+    candidates = search(collection, query, query_embedding,
+                        max(top_k, reranker.RERANK_CANDIDATES), doc_id, tenant, version)
+    return [candidates[i] for i in reranker.rerank(query, [hit.text for hit in candidates], top_k)]
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from typing import List, Optional
+
+import resources
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+
+# Documents uploaded without a signed-in user (e.g. chat_ui.py) live here
+DEFAULT_TENANT = "default"
+
+# Vector space of full-precision all-MiniLM-L6-v2 embeddings, which every backend used
+# before the space was recorded in collection metadata
+DEFAULT_EMBEDDING_SPACE = "all-MiniLM-L6-v2"
+
+# Chroma accepts at most a few thousand records per call
+CHROMA_BATCH_SIZE = 1000
+
+
+def _create_client():
+    chromadb = resources.lazy_import("chromadb")
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+
+def get_client():
+    """ChromaDB client with persistent storage, opened on first use and shared process-wide"""
+    return resources.get_resource("chroma_client", _create_client)
+
+
+# tenant -> (collection, the tenant's ingest_cache version when it was opened)
+_collections = {}
+_collections_lock = threading.Lock()
+
+# Set in the process that writes to Chroma (the ingest_jobs runner), whose client
+# sees its own writes and never needs reopening
+_writer = False
+
+
+def _reopen_client():
+    """Forget the process's Chroma client and collections, so the next use reads the files afresh
+
+    A Chroma client doesn't see what other processes write after it opened a
+    collection. Collections already handed out keep working on the old client.
+    """
+    chromadb = resources.lazy_import("chromadb")
+    chromadb.api.client.SharedSystemClient.clear_system_cache()
+    resources.reset_resource("chroma_client")
+    _collections.clear()
+
+
+def become_writer():
+    """Called once this process holds the ingest runner lock: reopen the client and stop reopening it"""
+    global _writer
+    with _collections_lock:
+        _reopen_client()
+        _writer = True
+
+
+def collection_name(tenant: str) -> str:
+    """Chroma collection name for a tenant (names are restricted to [a-zA-Z0-9._-])"""
+    if tenant == DEFAULT_TENANT:
+        return "pdf_chunks"
+    return f"pdf_chunks_{hashlib.sha1(tenant.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _open_collection(tenant: str, embedding_space: str):
+    try:
+        return get_client().get_or_create_collection(
+            name=collection_name(tenant),
+            metadata={"hnsw:space": "cosine", "embedding_space": embedding_space}
+        )
+    except Exception as e:
+        logging.error(f"Error initializing ChromaDB: {e}")
+        raise Exception("ChromaDB collection not initialized")
+
+
+def collection_space(collection) -> str:
+    """Embedding space of the vectors a collection holds"""
+    return (collection.metadata or {}).get("embedding_space", DEFAULT_EMBEDDING_SPACE)
+
+
+def get_collection(tenant: str = DEFAULT_TENANT, embedding_space: Optional[str] = None,
+                   version: Optional[int] = None):
+    """Create or get the collection holding one tenant's documents
+
+    Callers that read or write vectors pass the embedding_space they produce; the
+    collection must hold vectors of that space (an empty one is recreated for it, so
+    check the tenant's other documents first: ingest_cache.check_embedding_space).
+    Readers pass the tenant's version (ingest_cache.get_version); outside the writer
+    process, a collection opened at another version is reopened to see the changes.
+    """
+    with _collections_lock:
+        cached = _collections.get(tenant)
+        if cached is not None and version is not None and not _writer and cached[1] != version:
+            _reopen_client()
+            cached = None
+        if cached is None:
+            collection = _open_collection(tenant, embedding_space or DEFAULT_EMBEDDING_SPACE)
+            _collections[tenant] = (collection, version)
+        else:
+            collection = cached[0]
+        if embedding_space is not None:
+            stored = collection_space(collection)
+            if stored != embedding_space:
+                if collection.count():
+                    raise Exception(f"Indexed documents use {stored} embeddings, but the embedding backend "
+                                    f"produces {embedding_space}; reindex them or switch the backend back")
+                get_client().delete_collection(collection_name(tenant))
+                collection = _open_collection(tenant, embedding_space)
+                _collections[tenant] = (collection, version)
+        return collection
+
+
+def drop_collection(tenant: str):
+    """Delete a tenant's collection, e.g. once it holds no documents"""
+    with _collections_lock:
+        _collections.pop(tenant, None)
+        try:
+            get_client().delete_collection(collection_name(tenant))
+        except Exception as e:
+            logging.error(f"Error dropping collection of {tenant}: {e}")
+
+
+def reclaim_space():
+    """Give back the disk space Chroma keeps after deletions
+
+    Deleting records doesn't shrink chroma.sqlite3 and dropping a collection leaves
+    its HNSW directory behind, so this VACUUMs the database and removes the
+    directories of segments it no longer lists.
+    """
+    database = os.path.join(CHROMA_PATH, "chroma.sqlite3")
+    if not os.path.exists(database):
+        return
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        segments = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        conn.execute("VACUUM")
+    except sqlite3.Error as e:
+        logging.error(f"Error compacting the Chroma database: {e}")
+        return
+    finally:
+        conn.close()
+    for name in os.listdir(CHROMA_PATH):
+        try:
+            uuid.UUID(name)
+        except ValueError:
+            continue
+        if name not in segments:
+            shutil.rmtree(os.path.join(CHROMA_PATH, name), ignore_errors=True)
+
+
+def doc_filter(doc_id):
+    """Chroma where-clause restricting a query to one document or a list of documents"""
+    if not doc_id:
+        return None
+    if isinstance(doc_id, str):
+        return {"doc_id": doc_id}
+    doc_id = list(doc_id)
+    if len(doc_id) == 1:
+        return {"doc_id": doc_id[0]}
+    return {"doc_id": {"$in": doc_id}}
+
+
+class VectorStore:
+    """Chunk vectors of a tenant's documents, searched by cosine distance
+
+    Implemented by ChromaStore (the tenant's Chroma collection, HNSW approximate
+    search) and exact_index.ExactStore (one float32 matrix per tenant, exact
+    search). A document lives in exactly one store; the ingest registry records which.
+    """
+    name = ""
+
+    def add(self, doc_id: str, ids, embeddings, texts, metadatas):
+        """Add chunks of a document being indexed"""
+        raise NotImplementedError
+
+    def commit(self, doc_id: str):
+        """Make the chunks added for doc_id searchable"""
+
+    def query(self, query_embedding, n_results: int, doc_ids=None) -> List[tuple]:
+        """(id, text, metadata, distance) of the nearest chunks, closest first
+
+        doc_ids limits the search to those documents; None searches the whole store.
+        """
+        raise NotImplementedError
+
+    def get(self, ids, doc_ids=None) -> List[tuple]:
+        """(id, text, metadata) of the given chunks that are in the store"""
+        raise NotImplementedError
+
+    def delete_document(self, doc_id: str):
+        raise NotImplementedError
+
+
+class ChromaStore(VectorStore):
+    """A tenant's Chroma collection"""
+    name = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def add(self, doc_id: str, ids, embeddings, texts, metadatas):
+        self.collection.upsert(ids=list(ids), embeddings=embeddings, documents=list(texts),
+                               metadatas=list(metadatas))
+
+    def query(self, query_embedding, n_results: int, doc_ids=None) -> List[tuple]:
+        if doc_ids is not None and not doc_ids:
+            return []
+        results = self.collection.query(query_embeddings=[query_embedding], n_results=n_results,
+                                        where=doc_filter(doc_ids))
+        if not results["ids"]:
+            return []
+        return list(zip(results["ids"][0], results["documents"][0],
+                        [metadata or {} for metadata in results["metadatas"][0]], results["distances"][0]))
+
+    def get(self, ids, doc_ids=None) -> List[tuple]:
+        fetched = self.collection.get(ids=list(ids), include=["documents", "metadatas"])
+        return list(zip(fetched["ids"], fetched["documents"], [metadata or {} for metadata in fetched["metadatas"]]))
+
+    def delete_document(self, doc_id: str):
+        self.collection.delete(where={"doc_id": doc_id})